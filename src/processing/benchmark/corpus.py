@@ -0,0 +1,69 @@
+"""
+Deterministic synthetic MASC like corpora.
+
+    <masc_folder>/<subset>/subtitles/audio_000000.ar.vtt
+    <masc_folder>/<subset>/audios/audio_000000.wav
+"""
+from pathlib import Path
+import math
+import wave
+import numpy as np
+from processing.benchmark.vtt_parser import write_vtt
+
+
+SAMPLE_RATE = 16000
+
+
+def write_wav(
+    wav_path: Path,
+    seconds: float,
+    rng: np.random.Generator,
+    sample_rate: int = SAMPLE_RATE,
+    chunk_seconds: int = 60,
+) -> None:
+    """Write a mono 16 bit PCM wav of noise, one chunk at a time so hours fit in memory."""
+    n_frames = math.ceil(seconds * sample_rate)
+    chunk_frames = chunk_seconds * sample_rate
+    with wave.open(str(wav_path), "wb") as f:
+        f.setnchannels(1)
+        f.setsampwidth(2)
+        f.setframerate(sample_rate)
+        for first in range(0, n_frames, chunk_frames):
+            size = min(chunk_frames, n_frames - first)
+            samples = rng.integers(-3000, 3000, size=size, dtype=np.int16)
+            f.writeframes(samples.tobytes())
+
+
+def write_masc_corpus(
+    masc_folder: Path,
+    n_files: int = 2000,
+    n_cues: int = 1000,
+    n_audios: int = 2,
+    subset: str = "clean_dev",
+    seed: int = 0,
+) -> Path:
+    """
+    Write a MASC like subset of n_files subtitles,
+    the first n_audios of them also get a wav covering all their cues.
+    With the default 1000 cues a subtitle spans about an hour.
+    Args:
+        masc_folder: root folder of the corpus
+        n_files: number of subtitles
+        n_cues: number of cues per subtitle
+        n_audios: number of subtitles with an audio
+        subset: subset folder name
+        seed: seed of the generator, the same arguments always write the same corpus
+    Returns:
+        subset folder
+    """
+    rng = np.random.default_rng(seed)
+    subset_folder = masc_folder / subset
+    subtitles_folder = subset_folder / "subtitles"
+    audios_folder = subset_folder / "audios"
+    subtitles_folder.mkdir(parents=True, exist_ok=True)
+    audios_folder.mkdir(parents=True, exist_ok=True)
+    for i in range(n_files):
+        end = write_vtt(subtitles_folder / f"audio_{i:06d}.ar.vtt", n_cues, rng)
+        if i < n_audios:
+            write_wav(audios_folder / f"audio_{i:06d}.wav", end + 1.0, rng)
+    return subset_folder
@@ -0,0 +1,316 @@
+"""
+End to end benchmark of the MASC pipeline on a synthetic corpus.
+Every stage runs in its own process, so its peak RSS is measured alone.
+The memory figure is the peak RSS of the largest single process of the stage,
+not the total of its pool workers.
+
+    python -m processing.benchmark.pipeline --files 2000 --cues 1000 --audios 2 \
+        --save-baseline baseline.json
+    python -m processing.benchmark.pipeline --files 2000 --cues 1000 --audios 2 \
+        --baseline baseline.json
+"""
+from dataclasses import asdict, dataclass
+from multiprocessing import cpu_count, get_context
+from pathlib import Path
+from tempfile import TemporaryDirectory
+from typing import Callable, Optional
+import argparse
+import json
+import logging
+import resource
+import shutil
+import sys
+import time
+import pandas as pd
+from processing.benchmark.corpus import write_masc_corpus
+from processing.db.audio_db import BulkAudioWriter
+from processing.masc.masc_processing import (
+    audio_to_dataframe,
+    masc_dataframe_to_audio,
+    masc_subtitle_to_dataframe,
+    vtt_split_to_dataframe,
+)
+from processing.services import clean_text_batch, folder_vtt_split, split_audio_to_segments
+
+
+logging.basicConfig(format="%(asctime)s - %(message)s", level=logging.INFO)
+
+SUBSET = "clean_dev"
+
+
+@dataclass
+class StageResult:
+    """Time, number of processed items and peak RSS of a stage."""
+
+    seconds: float
+    items: int
+    # peak RSS of the largest process of the stage, the stage process or one of
+    # its workers, a forked worker also counts the memory it shares with the
+    # stage process; it is not the sum over the workers
+    max_process_rss_mb: float
+
+    @property
+    def items_per_second(self) -> float:
+        return self.items / self.seconds if self.seconds else 0.0
+
+
+def _stage_vtt_split(masc_folder: Path, work_dir: Path, workers: int) -> tuple[float, int]:
+    start = time.perf_counter()
+    audios = folder_vtt_split(masc_folder / SUBSET / "subtitles", workers=workers)
+    return time.perf_counter() - start, sum(len(audio.segments) for audio in audios)
+
+
+def _stage_audio_to_dataframe(
+    masc_folder: Path, work_dir: Path, workers: int
+) -> tuple[float, int]:
+    audios = folder_vtt_split(masc_folder / SUBSET / "subtitles", workers=workers)
+    start = time.perf_counter()
+    df = audio_to_dataframe(audios)
+    return time.perf_counter() - start, len(df)
+
+
+def _segments(masc_folder: Path, workers: int) -> pd.DataFrame:
+    return vtt_split_to_dataframe(
+        masc_folder / SUBSET / "subtitles", clean_segment_text=False, workers=workers
+    )
+
+
+def _stage_clean_text(masc_folder: Path, work_dir: Path, workers: int) -> tuple[float, int]:
+    texts = _segments(masc_folder, workers).segment_text
+    start = time.perf_counter()
+    clean_text_batch(texts)
+    return time.perf_counter() - start, len(texts)
+
+
+def _stage_split_audio(masc_folder: Path, work_dir: Path, workers: int) -> tuple[float, int]:
+    df = _segments(masc_folder, workers)
+    audio_folder = masc_folder / SUBSET / "audios"
+    output_dir = work_dir / "segments"
+    output_dir.mkdir(exist_ok=True)
+    groups = [
+        (audio_folder / f"{name}.wav", group)
+        for name, group in df.groupby("audio_filename")
+        if (audio_folder / f"{name}.wav").exists()
+    ]
+    start = time.perf_counter()
+    exported = 0
+    for audio_path, group in groups:
+        exported += split_audio_to_segments(audio_path, group, output_dir, "wav")
+    return time.perf_counter() - start, exported
+
+
+def _stage_mongo_insert(
+    masc_folder: Path, work_dir: Path, workers: int, mongo_uri: Optional[str] = None
+) -> tuple[float, int]:
+    if mongo_uri is not None:
+        from pymongo import MongoClient
+    else:
+        # in memory stand-in, measures the python side of the insert path
+        from mongomock import MongoClient
+    collection = MongoClient(mongo_uri).benchmark[SUBSET]
+    collection.drop()
+    df = _segments(masc_folder, workers)
+    documents = [
+        {"filename": filename, "text": text, "duration": duration}
+        for filename, text, duration in zip(
+            df.segment_filename, df.segment_text, df.segment_duration.round(3)
+        )
+    ]
+    start = time.perf_counter()
+    with BulkAudioWriter(collection) as writer:
+        writer.insert_many(documents)
+    return time.perf_counter() - start, writer.inserted
+
+
+def _flow_folder(masc_folder: Path, work_dir: Path) -> Path:
+    """Corpus limited to the subtitles that have an audio, linked into work_dir."""
+    flow_folder = work_dir / "masc"
+    shutil.rmtree(flow_folder, ignore_errors=True)
+    subtitles = flow_folder / SUBSET / "subtitles"
+    subtitles.mkdir(parents=True)
+    audios = masc_folder / SUBSET / "audios"
+    (flow_folder / SUBSET / "audios").symlink_to(audios.resolve())
+    for audio in audios.glob("*.wav"):
+        subtitle = masc_folder / SUBSET / "subtitles" / f"{audio.stem}.ar.vtt"
+        (subtitles / subtitle.name).symlink_to(subtitle.resolve())
+    return flow_folder
+
+
+def _stage_full_flow(masc_folder: Path, work_dir: Path, workers: int) -> tuple[float, int]:
+    flow_folder = _flow_folder(masc_folder, work_dir)
+    start = time.perf_counter()
+    masc_subtitle_to_dataframe(
+        workers=workers, masc_folder=flow_folder, dataframe_folder=work_dir
+    )
+    masc_dataframe_to_audio(
+        workers=workers, masc_folder=flow_folder, dataframe_folder=work_dir
+    )
+    seconds = time.perf_counter() - start
+    return seconds, len(pd.read_parquet(work_dir / f"{SUBSET}.parquet"))
+
+
+STAGES: dict[str, Callable[..., tuple[float, int]]] = {
+    "vtt_split": _stage_vtt_split,
+    "audio_to_dataframe": _stage_audio_to_dataframe,
+    "clean_text": _stage_clean_text,
+    "split_audio_to_segments": _stage_split_audio,
+    "mongo_insert": _stage_mongo_insert,
+    "full_flow": _stage_full_flow,
+}
+
+
+def _max_process_rss_mb() -> float:
+    # ru_maxrss is in kilobytes on linux, the children one is the largest peak
+    # of a single terminated worker, not their total
+    peak = max(
+        resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+        resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss,
+    )
+    return peak / 1024
+
+
+def _run_stage(stage, queue, *args):
+    seconds, items = stage(*args)
+    queue.put(StageResult(seconds=seconds, items=items, max_process_rss_mb=_max_process_rss_mb()))
+
+
+def run_stage(name: str, *args) -> StageResult:
+    """Run a stage in a fresh process, it can still start its own pool."""
+    context = get_context("fork")
+    queue = context.Queue()
+    process = context.Process(target=_run_stage, args=(STAGES[name], queue, *args))
+    process.start()
+    process.join()
+    if process.exitcode != 0:
+        raise RuntimeError(f"stage {name} failed with exit code {process.exitcode}")
+    return queue.get()
+
+
+def benchmark(
+    masc_folder: Path,
+    work_dir: Path,
+    workers: int = cpu_count(),
+    stages: Optional[list[str]] = None,
+    mongo_uri: Optional[str] = None,
+) -> dict[str, StageResult]:
+    """
+    Time the stages on the corpus of masc_folder.
+    Args:
+        masc_folder: corpus written by write_masc_corpus
+        work_dir: folder for the outputs of the stages
+        workers: number of processes of the parallel stages
+        stages: names of the stages to run, all of STAGES by default
+        mongo_uri: mongodb to insert into, an in memory mongomock collection if None
+    Returns:
+        result of each stage
+    """
+    results = {}
+    for name in stages or STAGES:
+        args = (masc_folder, work_dir, workers)
+        if name == "mongo_insert":
+            args += (mongo_uri,)
+        results[name] = run_stage(name, *args)
+        logging.info(
+            "%s: %.3fs, %d items, %.0f items/s, max process RSS %.1f MB",
+            name,
+            results[name].seconds,
+            results[name].items,
+            results[name].items_per_second,
+            results[name].max_process_rss_mb,
+        )
+    return results
+
+
+def compare_to_baseline(
+    results: dict[str, StageResult], baseline: dict, tolerance: float = 0.2
+) -> list[str]:
+    """
+    Stages slower or bigger than their baseline by more than tolerance.
+    Args:
+        results: results of benchmark
+        baseline: results saved by save_baseline
+        tolerance: allowed relative increase of time and max process RSS
+    Returns:
+        description of each regression
+    """
+    regressions = []
+    for name, result in results.items():
+        if name not in baseline["stages"]:
+            continue
+        reference = baseline["stages"][name]
+        for key in ("seconds", "max_process_rss_mb"):
+            if key not in reference:
+                # saved by a version that measured something else
+                continue
+            ratio = getattr(result, key) / reference[key] if reference[key] else 1.0
+            if ratio > 1 + tolerance:
+                regressions.append(
+                    f"{name} {key}: {getattr(result, key):.3f} vs {reference[key]:.3f} "
+                    f"baseline ({ratio:.2f}x)"
+                )
+    return regressions
+
+
+def save_baseline(results: dict[str, StageResult], config: dict, path: Path) -> None:
+    with open(path, "w") as f:
+        json.dump(
+            {
+                "config": config,
+                "stages": {name: asdict(result) for name, result in results.items()},
+            },
+            f,
+            indent=2,
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the MASC pipeline stages.")
+    parser.add_argument("--files", type=int, default=2000)
+    parser.add_argument("--cues", type=int, default=1000)
+    parser.add_argument("--audios", type=int, default=2)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--workers", type=int, default=cpu_count())
+    parser.add_argument("--stages", nargs="+", choices=list(STAGES), default=None)
+    parser.add_argument("--mongo-uri", default=None)
+    parser.add_argument(
+        "--corpus", type=Path, default=None, help="keep the corpus in this folder and reuse it"
+    )
+    parser.add_argument("--baseline", type=Path, default=None)
+    parser.add_argument("--save-baseline", type=Path, default=None)
+    parser.add_argument("--tolerance", type=float, default=0.2)
+    args = parser.parse_args()
+    config = {
+        "files": args.files,
+        "cues": args.cues,
+        "audios": args.audios,
+        "seed": args.seed,
+        "workers": args.workers,
+    }
+    with TemporaryDirectory() as tmp:
+        masc_folder = args.corpus or Path(tmp) / "masc"
+        if not (masc_folder / SUBSET / "subtitles").exists():
+            logging.info("Writing corpus to %s", masc_folder)
+            write_masc_corpus(
+                masc_folder, args.files, args.cues, args.audios, SUBSET, args.seed
+            )
+        work_dir = Path(tmp) / "work"
+        work_dir.mkdir()
+        results = benchmark(
+            masc_folder, work_dir, args.workers, args.stages, args.mongo_uri
+        )
+    if args.save_baseline is not None:
+        save_baseline(results, config, args.save_baseline)
+    if args.baseline is not None:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        if baseline["config"] != config:
+            logging.warning("Baseline was run with %s", baseline["config"])
+        regressions = compare_to_baseline(results, baseline, args.tolerance)
+        for regression in regressions:
+            logging.error("Regression: %s", regression)
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,124 @@
+"""
+Memory and throughput of segment objects against SegmentTable
+on a synthetic workload.
+
+    python -m processing.benchmark.segment_table --segments 1000000
+"""
+from dataclasses import dataclass
+import argparse
+import gc
+import logging
+import time
+import tracemalloc
+import numpy as np
+import pandas as pd
+from processing.config import Audio, AudioSegment, SourceEnum
+from processing.db.models import MASCAudio
+from processing.services import SegmentTable
+from processing.benchmark.vtt_parser import ARABIC_WORDS
+
+
+logging.basicConfig(format="%(asctime)s - %(message)s", level=logging.INFO)
+
+
+@dataclass
+class DictAudioSegment:
+    """AudioSegment without slots, the layout before slots were added."""
+
+    start: float
+    end: float
+    text: str
+    source: SourceEnum
+    filename: str = None
+
+
+def _columns(n_segments: int, seed: int = 0) -> tuple:
+    rng = np.random.default_rng(seed)
+    starts = np.cumsum(rng.uniform(6.0, 16.0, n_segments))
+    ends = starts + rng.uniform(6.0, 16.0, n_segments)
+    sentences = [
+        " ".join(rng.choice(ARABIC_WORDS, rng.integers(4, 20))) for _ in range(1000)
+    ]
+    texts = [sentences[i] for i in rng.integers(0, len(sentences), n_segments)]
+    return starts.tolist(), ends.tolist(), texts
+
+
+def _measure(build) -> tuple[object, float, int]:
+    """Result of build, seconds spent and bytes still allocated by the result."""
+    gc.collect()
+    tracemalloc.start()
+    start = time.perf_counter()
+    result = build()
+    seconds = time.perf_counter() - start
+    size, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return result, seconds, size
+
+
+def _build_audios(segment_class, starts, ends, texts, per_audio: int) -> list[Audio]:
+    audios = []
+    for first in range(0, len(starts), per_audio):
+        filename = f"audio_{first // per_audio:06d}"
+        segments = [
+            segment_class(
+                start=starts[i],
+                end=ends[i],
+                text=texts[i],
+                source=SourceEnum.MASC,
+                filename=f"{filename}_{i - first}",
+            )
+            for i in range(first, min(first + per_audio, len(starts)))
+        ]
+        audios.append(
+            Audio(filename=filename, duration=0.0, source=SourceEnum.MASC, segments=segments)
+        )
+    return audios
+
+
+def benchmark(n_segments: int, per_audio: int = 200) -> dict[str, dict[str, float]]:
+    starts, ends, texts = _columns(n_segments)
+    results = {}
+    for name, segment_class in (("dict", DictAudioSegment), ("slots", AudioSegment)):
+        audios, seconds, size = _measure(
+            lambda: _build_audios(segment_class, starts, ends, texts, per_audio)
+        )
+        results[f"{name} objects"] = {"build_s": seconds, "memory_mb": size / 2**20}
+        del audios
+    audios = _build_audios(AudioSegment, starts, ends, texts, per_audio)
+    table, seconds, size = _measure(lambda: SegmentTable.from_audios(audios))
+    results["table"] = {"build_s": seconds, "memory_mb": size / 2**20}
+
+    start = time.perf_counter()
+    pd.DataFrame([segment.to_dict() for audio in audios for segment in audio.segments])
+    results["dataframe"] = {"objects_s": time.perf_counter() - start}
+    start = time.perf_counter()
+    table.to_dataframe()
+    results["dataframe"]["table_s"] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    for audio in audios:
+        for segment in audio.segments:
+            MASCAudio(
+                filename=segment.filename,
+                text=segment.text,
+                duration=round(segment.duration, 3),
+            ).dict()
+    results["masc documents"] = {"objects_s": time.perf_counter() - start}
+    start = time.perf_counter()
+    table.masc_documents()
+    results["masc documents"]["table_s"] = time.perf_counter() - start
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark segment representations.")
+    parser.add_argument("--segments", type=int, default=1_000_000)
+    args = parser.parse_args()
+    for name, values in benchmark(args.segments).items():
+        logging.info(
+            "%s: %s", name, ", ".join(f"{key} {value:.3f}" for key, value in values.items())
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,105 @@
+"""
+Benchmark of the native vtt parser against webvtt-py.
+
+    python -m processing.benchmark.vtt_parser --files 200 --cues 2000
+"""
+from pathlib import Path
+from tempfile import TemporaryDirectory
+import argparse
+import logging
+import time
+import numpy as np
+import webvtt
+from processing.services.vtt_parser import parse_vtt
+
+
+logging.basicConfig(format="%(asctime)s - %(message)s", level=logging.INFO)
+
+ARABIC_WORDS = [
+    "السلام",
+    "عليكم",
+    "ورحمة",
+    "الله",
+    "وبركاته",
+    "مرحبا",
+    "بكم",
+    "في",
+    "هذه",
+    "الحلقة",
+    "الجديدة",
+    "من",
+    "البرنامج",
+    "أهلا",
+    "إلى",
+    "[موسيقى]",
+]
+
+
+def _timestamp(seconds: float) -> str:
+    hours, seconds = divmod(seconds, 3600)
+    minutes, seconds = divmod(seconds, 60)
+    return f"{int(hours):02d}:{int(minutes):02d}:{seconds:06.3f}"
+
+
+def write_vtt(vtt_path: Path, n_cues: int, rng: np.random.Generator) -> float:
+    """Write a synthetic youtube like vtt file with n_cues cues, returns the end of the last cue."""
+    durations = rng.uniform(0.5, 6.0, n_cues).round(3)
+    gaps = rng.exponential(0.6, n_cues).round(3)
+    starts = np.cumsum(gaps + np.concatenate([[0.0], durations[:-1]]))
+    lines = ["WEBVTT", "Kind: captions", "Language: ar", ""]
+    for start, duration in zip(starts, durations):
+        words = rng.choice(ARABIC_WORDS, rng.integers(2, 12))
+        lines.append(f"{_timestamp(start)} --> {_timestamp(start + duration)}")
+        lines.append(" ".join(words))
+        lines.append("")
+    vtt_path.write_text("\n".join(lines), encoding="utf-8")
+    return float(starts[-1] + durations[-1]) if n_cues else 0.0
+
+
+def write_corpus(folder: Path, n_files: int, n_cues: int, seed: int = 0) -> list[Path]:
+    """Write n_files synthetic vtt files into folder."""
+    rng = np.random.default_rng(seed)
+    paths = []
+    for i in range(n_files):
+        vtt_path = folder / f"audio_{i:06d}.ar.vtt"
+        write_vtt(vtt_path, n_cues, rng)
+        paths.append(vtt_path)
+    return paths
+
+
+def _webvtt_parse(vtt_path: Path):
+    vtt = webvtt.read(vtt_path)
+    return (
+        [caption.start_in_seconds for caption in vtt],
+        [caption.end_in_seconds for caption in vtt],
+        [caption.text for caption in vtt],
+    )
+
+
+def benchmark(paths: list[Path]) -> dict[str, float]:
+    """Seconds spent by each parser to read all paths."""
+    results = {}
+    for name, parse in (("webvtt", _webvtt_parse), ("native", parse_vtt)):
+        start = time.perf_counter()
+        for vtt_path in paths:
+            parse(vtt_path)
+        results[name] = time.perf_counter() - start
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark vtt parsers.")
+    parser.add_argument("--files", type=int, default=200)
+    parser.add_argument("--cues", type=int, default=2000)
+    args = parser.parse_args()
+    with TemporaryDirectory() as folder:
+        paths = write_corpus(Path(folder), args.files, args.cues)
+        results = benchmark(paths)
+    total_cues = args.files * args.cues
+    for name, seconds in results.items():
+        logging.info("%s: %.3fs, %.0f cues/s", name, seconds, total_cues / seconds)
+    logging.info("speedup: %.2fx", results["webvtt"] / results["native"])
+
+
+if __name__ == "__main__":
+    main()
@@ -1,9 +1,18 @@
+from dataclasses import dataclass
+from functools import partial
 from multiprocessing.pool import ThreadPool
 from pathlib import Path
+from typing import Iterable, Optional
+import argparse
 import logging
+import os
+import subprocess
+import time
 import pandas as pd
 import tqdm
 from pydub import AudioSegment
+from pydub.exceptions import CouldntDecodeError
+from processing import profiling
 
 logging.basicConfig(format="%(asctime)s - %(message)s", level=logging.INFO)
 
@@ -15,35 +24,258 @@ DEV_TSV_PATH = ROOT_PATH / "dev.tsv"
 TEST_TSV_PATH = ROOT_PATH / "test.tsv"
 VALIDATED_TSV_PATH = ROOT_PATH / "validated.tsv"
 TARGET_PATH = ROOT_PATH / "clips_wav"
+FFMPEG_BINARY = os.getenv("FFMPEG_BINARY", "ffmpeg")
+ENGINES = ("ffmpeg", "pydub")
 
 
-def convert_audio(audio_path: Path, target_path: Path = TARGET_PATH):
-    audio = AudioSegment.from_mp3(audio_path)
+@dataclass
+class ConversionSummary:
+    """Aggregated result of converting audio files."""
+
+    converted: int = 0
+    skipped: int = 0
+    failed: int = 0
+    seconds: float = 0.0
+
+    @property
+    def files_per_second(self) -> float:
+        return self.converted / self.seconds if self.seconds else 0.0
+
+    def __str__(self) -> str:
+        return (
+            f"converted {self.converted} files ({self.files_per_second:.1f} files/s), "
+            f"skipped {self.skipped} existing files, failed {self.failed} files"
+        )
+
+
+def convert_audio(
+    audio_path: Path,
+    target_path: Path = TARGET_PATH,
+    sample_rate: Optional[int] = None,
+    channels: Optional[int] = None,
+):
     audio_name = audio_path.stem + ".wav"
-    audio.export(target_path / audio_name, format="wav")
+    pydub_convert_audio(audio_path, target_path / audio_name, sample_rate, channels)
 
 
-def change_df_audio_path(df: pd.DataFrame):
-    df["path"] = df["path"].apply(lambda x: x.replace(".mp3", ".wav"))
-    return df
+def pydub_convert_audio(
+    audio_path: Path,
+    target_file: Path,
+    sample_rate: Optional[int] = None,
+    channels: Optional[int] = None,
+):
+    audio = AudioSegment.from_mp3(audio_path)
+    if sample_rate is not None:
+        audio = audio.set_frame_rate(sample_rate)
+    if channels is not None:
+        audio = audio.set_channels(channels)
+    audio.export(target_file, format="wav")
 
 
-def convert_dataframe_audio(dataframe_path: Path):
-    df = pd.read_csv(dataframe_path, sep="\t")
-    # check if .wav in df path
-    if ".wav" in df["path"].iloc[0]:
-        logging.info("Already converted to .wav")
-        return
-    audio_paths = [AUIDO_PATH / audio_name for audio_name in df["path"]]
-    logging.info(
-        "Converting %s to .wav, detecting %d files", dataframe_path, len(audio_paths)
+def ffmpeg_convert_audio(
+    audio_path: Path,
+    target_file: Path,
+    sample_rate: Optional[int] = None,
+    channels: Optional[int] = None,
+):
+    """
+    Convert an audio file to wav with a single ffmpeg process,
+    the decoded samples never go through python.
+    Args:
+        audio_path: audio file to convert.
+        target_file: wav file to write.
+        sample_rate: resample to this rate, keep the original rate if None.
+        channels: downmix to this number of channels, keep the original channels if None.
+    """
+    command = [FFMPEG_BINARY, "-nostdin", "-hide_banner", "-loglevel", "error"]
+    command += ["-i", str(audio_path), "-vn"]
+    if sample_rate is not None:
+        command += ["-ar", str(sample_rate)]
+    if channels is not None:
+        command += ["-ac", str(channels)]
+    command += ["-f", "wav", "-y", str(target_file)]
+    subprocess.run(command, check=True, capture_output=True)
+
+
+def available_cpus() -> int:
+    """Number of CPUs this process may run on, honours CPU affinity and cpusets."""
+    if hasattr(os, "sched_getaffinity"):
+        return len(os.sched_getaffinity(0))
+    return os.cpu_count() or 1
+
+
+def _convert_file(
+    audio_path: Path,
+    target_path: Path,
+    engine: str,
+    sample_rate: Optional[int],
+    channels: Optional[int],
+) -> str:
+    target_file = target_path / (audio_path.stem + ".wav")
+    if target_file.exists():
+        return "skipped"
+    # written under a temporary name so an interrupted conversion is redone
+    tmp_file = target_path / (audio_path.stem + ".wav.tmp")
+    try:
+        convert = ffmpeg_convert_audio if engine == "ffmpeg" else pydub_convert_audio
+        convert(audio_path, tmp_file, sample_rate, channels)
+        os.replace(tmp_file, target_file)
+        return "converted"
+    except subprocess.CalledProcessError as e:
+        logging.error("Failed to convert %s: %s", audio_path, e.stderr.decode().strip())
+    except (OSError, CouldntDecodeError) as e:
+        logging.error("Failed to convert %s: %s", audio_path, e)
+    tmp_file.unlink(missing_ok=True)
+    return "failed"
+
+
+def convert_audios(
+    audio_paths: Iterable[Path],
+    target_path: Path = TARGET_PATH,
+    engine: str = "ffmpeg",
+    workers: Optional[int] = None,
+    sample_rate: Optional[int] = None,
+    channels: Optional[int] = None,
+) -> ConversionSummary:
+    """
+    Convert audio files to wav, files already converted are skipped.
+    Args:
+        audio_paths: audio files to convert.
+        target_path: directory of the wav files, named after the audio files.
+        engine: "ffmpeg" runs one ffmpeg process per file,
+            "pydub" decodes and re-exports the file in python.
+        workers: number of files converted at the same time, defaults to available_cpus().
+            Threads are enough, the work happens in the ffmpeg processes.
+        sample_rate: resample to this rate, keep the original rate if None.
+        channels: downmix to this number of channels, keep the original channels if None.
+    Returns:
+        ConversionSummary
+    """
+    if engine not in ENGINES:
+        raise ValueError(f"engine should be one of {ENGINES}, got {engine}.")
+    audio_paths = list(audio_paths)
+    convert = partial(
+        _convert_file,
+        target_path=target_path,
+        engine=engine,
+        sample_rate=sample_rate,
+        channels=channels,
     )
-    with ThreadPool(8) as pool:
-        for _ in tqdm.tqdm(
-            pool.imap_unordered(convert_audio, audio_paths), total=len(audio_paths)
+    summary = ConversionSummary()
+    start = time.perf_counter()
+    with ThreadPool(workers or available_cpus()) as pool:
+        for status in tqdm.tqdm(
+            pool.imap_unordered(convert, audio_paths), total=len(audio_paths)
         ):
-            pass
-    change_df_audio_path(df).to_csv(dataframe_path, sep="\t", index=False)
+            setattr(summary, status, getattr(summary, status) + 1)
+    summary.seconds = time.perf_counter() - start
+    return summary
+
+
+def _wav_name(audio_name: str) -> str:
+    return Path(audio_name).stem + ".wav"
+
+
+def conversion_plan(
+    dataframes: Iterable[pd.DataFrame], target_path: Path = TARGET_PATH
+) -> list[str]:
+    """
+    Clips to convert across all the dataframes.
+    Clips shared by several dataframes are converted once, clips already
+    converted by a previous run (their wav exists) are left out.
+    Args:
+        dataframes: common_voice dataframes with a path column.
+        target_path: directory of the wav files.
+    Returns:
+        names of the mp3 clips to convert, in first appearance order.
+    """
+    clips = dict.fromkeys(
+        audio_name
+        for df in dataframes
+        for audio_name in df["path"]
+        if audio_name.endswith(".mp3")
+    )
+    return [
+        audio_name
+        for audio_name in clips
+        if not (target_path / _wav_name(audio_name)).exists()
+    ]
+
+
+def _write_tsv_atomically(df: pd.DataFrame, dataframe_path: Path):
+    tmp_path = dataframe_path.with_name(dataframe_path.name + ".tmp")
+    df.to_csv(tmp_path, sep="\t", index=False)
+    os.replace(tmp_path, dataframe_path)
+
+
+def convert_tsvs(
+    dataframe_paths: list[Path],
+    audio_path: Path = AUIDO_PATH,
+    target_path: Path = TARGET_PATH,
+    engine: str = "ffmpeg",
+    workers: Optional[int] = None,
+    sample_rate: Optional[int] = None,
+    channels: Optional[int] = None,
+) -> ConversionSummary:
+    """
+    Convert the clips of several common_voice tsv files to wav.
+    Each clip is converted once even when it is listed in several tsv files,
+    then every row whose wav exists is pointed to it and the tsv files are
+    replaced atomically. Rows of clips that failed keep their mp3 path so an
+    interrupted or failed run only converts the missing clips next time.
+    Args:
+        dataframe_paths: tsv files to convert.
+        audio_path: directory of the mp3 clips.
+        target_path: directory of the wav files.
+        engine, workers, sample_rate, channels: see convert_audios.
+    Returns:
+        ConversionSummary
+    """
+    dataframes = [pd.read_csv(path, sep="\t") for path in dataframe_paths]
+    plan = conversion_plan(dataframes, target_path)
+    logging.info(
+        "Converting %d clips to .wav for %d tsv files", len(plan), len(dataframes)
+    )
+    summary = convert_audios(
+        [audio_path / audio_name for audio_name in plan],
+        target_path,
+        engine=engine,
+        workers=workers,
+        sample_rate=sample_rate,
+        channels=channels,
+    )
+    logging.info("%s", summary)
+    for dataframe_path, df in zip(dataframe_paths, dataframes):
+        mp3_rows = df["path"].str.endswith(".mp3")
+        wav_names = df.loc[mp3_rows, "path"].map(_wav_name)
+        converted = wav_names[wav_names.map(lambda name: (target_path / name).exists())]
+        if converted.empty:
+            continue
+        df.loc[converted.index, "path"] = converted
+        _write_tsv_atomically(df, dataframe_path)
+        logging.info(
+            "Updated %d rows of %s, %d left as .mp3",
+            len(converted),
+            dataframe_path,
+            int(mp3_rows.sum()) - len(converted),
+        )
+    return summary
+
+
+def convert_dataframe_audio(
+    dataframe_path: Path,
+    engine: str = "ffmpeg",
+    workers: Optional[int] = None,
+    sample_rate: Optional[int] = None,
+    channels: Optional[int] = None,
+):
+    convert_tsvs(
+        [dataframe_path],
+        engine=engine,
+        workers=workers,
+        sample_rate=sample_rate,
+        channels=channels,
+    )
     logging.info("Finished converting %s to .wav", dataframe_path)
 
 
@@ -52,14 +284,32 @@ def create_target_dir_if_not_exist():
         TARGET_PATH.mkdir(parents=True, exist_ok=True)
 
 
-def main():
+def main(
+    engine: str = "ffmpeg",
+    workers: Optional[int] = None,
+    sample_rate: Optional[int] = None,
+    channels: Optional[int] = None,
+):
     logging.info("ROOT_PATH: %s", ROOT_PATH)
 
     create_target_dir_if_not_exist()
     df_paths = [TRAIN_TSV_PATH, DEV_TSV_PATH, TEST_TSV_PATH, VALIDATED_TSV_PATH]
-    for df_path in df_paths:
-        convert_dataframe_audio(df_path)
+    convert_tsvs(
+        df_paths,
+        engine=engine,
+        workers=workers,
+        sample_rate=sample_rate,
+        channels=channels,
+    )
 
 
 if __name__ == "__main__":
-    main()
+    parser = argparse.ArgumentParser(description="Convert common_voice clips to wav.")
+    parser.add_argument("--engine", choices=ENGINES, default="ffmpeg")
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--sample-rate", type=int, default=None)
+    parser.add_argument("--channels", type=int, default=None)
+    profiling.add_arguments(parser)
+    args = parser.parse_args()
+    with profiling.profile(args.profile):
+        main(args.engine, args.workers, args.sample_rate, args.channels)
@@ -9,7 +9,7 @@ class SourceEnum(Enum):
     SADA: str = "SADA"
 
 
-@dataclass
+@dataclass(slots=True)
 class AudioSegment:
     """
     Audio segment configuration class.
@@ -35,7 +35,7 @@ class AudioSegment:
         )
 
 
-@dataclass
+@dataclass(slots=True)
 class Audio:
     """
     Audio configuration class. Used when the audio file is large and needs to be split into segments.
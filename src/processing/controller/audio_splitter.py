@@ -1,11 +1,20 @@
+import argparse
 import os
+from collections import deque
 from pathlib import Path
+from queue import Full, Queue
+from typing import Callable, Generator, Iterable, Optional
 import logging
+import threading
+import numpy as np
 from dotenv import load_dotenv
 from tqdm import tqdm
-from processing.db.models import Audio, AudioSegment, MASCAudio
-from processing.services.audio_split import split_audio
+from processing import metrics, profiling
+from processing.config import SourceEnum
+from processing.services import SegmentTable
+from processing.services.audio_split import split_audio_arrays
 from multiprocessing import Pool, cpu_count
+from multiprocessing.pool import Pool as PoolType
 from processing.db.audio_db import MongoDB, AudioCollection, DBConfig
 from processing.s3_data_provider.s3_provider import S3AudioProvider, S3Config
 
@@ -20,6 +29,21 @@ AUDIO_COLLECTION_NAME = f"{TARGET_SET}_audio"
 ROOT_DOWNLOAD_PATH = Path(f"/mnt/volume_sfo3_01/data/{TARGET_SET}")
 AUDIO_DOWNLOAD_PATH = Path(f"../data/{TARGET_SET}/audios")
 AUDIO_SEGMENT_DOWNLOAD_PATH = ROOT_DOWNLOAD_PATH / "audio_segments"
+# only the fields needed by the workers are fetched from the source collection
+SPLIT_PROJECTION = {
+    "_id": 0,
+    "audio_id": 1,
+    "audio_segments.start": 1,
+    "audio_segments.end": 1,
+    "audio_segments.text": 1,
+    "audio_segments.filename": 1,
+}
+CURSOR_BATCH_SIZE = 500
+MAX_IN_FLIGHT_PER_WORKER = 4
+# number of finished audios waiting for the writer thread
+WRITER_QUEUE_SIZE = 256
+# seconds between checks that the writer thread is still alive while the queue is full
+WRITER_PUT_TIMEOUT = 1.0
 
 # DB configuration
 MONGODB_USERNAME = os.getenv("MONGODB_USERNAME")
@@ -38,21 +62,160 @@ def initialize_db() -> MongoDB:
     return MongoDB(config)
 
 
-def process_audio(audio: Audio):
-    audio_path = AUDIO_DOWNLOAD_PATH / f"{audio.audio_id}.wav"
-    for segment in split_audio(
-        audio_path=audio_path,
-        audio_meta=audio,
-        output_dir=AUDIO_SEGMENT_DOWNLOAD_PATH,
-    ):
-        pass
-
-
-def insert_audio_segments(audio: Audio, target_audio_collection: AudioCollection):
-    masc_audios = [
-        MASCAudio.from_audio_segment(segment).dict() for segment in audio.audio_segments
-    ]
-    target_audio_collection.insert_many(masc_audios)
+def process_audio(document: dict) -> list[dict]:
+    """
+    Split a source audio into its segments.
+    Args:
+        document: source audio projected with SPLIT_PROJECTION, start and end are in milliseconds.
+    Returns:
+        MASCAudio documents of the exported segments, ready to be inserted.
+    """
+    audio_path = AUDIO_DOWNLOAD_PATH / f"{document['audio_id']}.wav"
+    segments = document["audio_segments"]
+    table = SegmentTable(
+        audio_filenames=[document["audio_id"]] * len(segments),
+        filenames=[segment["filename"] for segment in segments],
+        texts=[segment["text"] for segment in segments],
+        starts=np.array([segment["start"] for segment in segments], dtype=np.float64) / 1000,
+        ends=np.array([segment["end"] for segment in segments], dtype=np.float64) / 1000,
+        sources=[SourceEnum.MASC.value] * len(segments),
+    )
+    try:
+        exported = split_audio_arrays(
+            audio=audio_path,
+            filenames=table.filenames,
+            starts=table.starts,
+            ends=table.ends,
+            output_dir=AUDIO_SEGMENT_DOWNLOAD_PATH,
+            extension="wav",
+        )
+    except Exception as e:
+        logging.error("%s while splitting %s", e, audio_path)
+        return []
+    if exported < len(table):
+        table = table.take(
+            np.array(
+                [
+                    (AUDIO_SEGMENT_DOWNLOAD_PATH / f"{filename}.wav").is_file()
+                    for filename in table.filenames
+                ],
+                dtype=bool,
+            )
+        )
+    return table.masc_documents()
+
+
+def imap_bounded(
+    pool: PoolType, func: Callable, iterable: Iterable, max_in_flight: int
+) -> Generator:
+    """
+    Like Pool.imap, but pulls from iterable only when fewer than max_in_flight
+    tasks are pending, Pool.imap would consume the whole iterable upfront.
+    """
+    pending = deque()
+    for item in iterable:
+        pending.append(pool.apply_async(func, (item,)))
+        if len(pending) >= max_in_flight:
+            yield pending.popleft().get()
+    while pending:
+        yield pending.popleft().get()
+
+
+class SegmentWriter(threading.Thread):
+    """
+    Thread inserting the segment documents produced by the workers,
+    so inserts overlap with splitting instead of running after it.
+    The queue is bounded, producers block when the db is the slowest stage.
+    An error that stops the thread is kept in error and raised by put and stop,
+    so producers never wait on a queue nobody reads.
+    """
+
+    _STOP = None
+
+    def __init__(self, collection: AudioCollection, queue_size: int = WRITER_QUEUE_SIZE):
+        super().__init__(name="segment-writer", daemon=True)
+        self.collection = collection
+        self.queue: Queue = Queue(maxsize=queue_size)
+        self.inserted = 0
+        self.failed = 0
+        self.error: Optional[BaseException] = None
+
+    def _raise_if_failed(self) -> None:
+        if self.error is not None:
+            raise self.error
+
+    def put(self, documents: list[dict]) -> None:
+        """Queue documents, raises the writer error instead of blocking forever."""
+        while True:
+            self._raise_if_failed()
+            if not self.is_alive():
+                raise RuntimeError("segment writer is not running")
+            try:
+                self.queue.put(documents, timeout=WRITER_PUT_TIMEOUT)
+                return
+            except Full:
+                continue
+
+    def stop(self) -> None:
+        """
+        Insert what was already queued and wait for the thread to finish.
+        Raises:
+            the error that stopped the thread, if any.
+        """
+        while self.is_alive() and self.error is None:
+            try:
+                self.queue.put(self._STOP, timeout=WRITER_PUT_TIMEOUT)
+                break
+            except Full:
+                continue
+        self.join()
+        self._raise_if_failed()
+
+    def run(self) -> None:
+        writer = self.collection.bulk_writer()
+        try:
+            # the final flush of __exit__ can fail too
+            with writer:
+                while (documents := self.queue.get()) is not self._STOP:
+                    writer.insert_many(documents)
+        except Exception as e:
+            logging.error("Segment writer stopped: %s", e)
+            self.error = e
+        finally:
+            self.inserted = writer.inserted
+            self.failed = writer.failed
+
+
+def split_and_insert(
+    documents: Iterable[dict],
+    target_audio_collection: AudioCollection,
+    workers: int = cpu_count(),
+    total: Optional[int] = None,
+) -> SegmentWriter:
+    """
+    Split source audios in a process pool while a writer thread inserts the
+    segments of every finished audio. On KeyboardInterrupt the pool is
+    terminated and the segments of the finished audios are still inserted.
+    Returns:
+        the stopped writer, holding the inserted and failed counts.
+    Raises:
+        the error that stopped the writer thread, the pool is terminated first.
+    """
+    writer = SegmentWriter(target_audio_collection)
+    writer.start()
+    try:
+        with Pool(workers) as p:
+            results = imap_bounded(
+                p, process_audio, documents, workers * MAX_IN_FLIGHT_PER_WORKER
+            )
+            for segments in tqdm(results, total=total):
+                writer.put(segments)
+    except KeyboardInterrupt:
+        logging.warning("Interrupted, inserting the segments of finished audios.")
+    finally:
+        writer.stop()
+    logging.info("Inserted %d segments, %d failed", writer.inserted, writer.failed)
+    return writer
 
 
 def initialize_dirs():
@@ -66,17 +229,23 @@ def main():
     audio_db = initialize_db()
     source_audio_collection = audio_db.get_collection(TARGET_SET)
     target_audio_collection = audio_db.get_collection(AUDIO_COLLECTION_NAME)
-    all_audios = [
-        Audio.from_dict(audio) for audio in source_audio_collection.find_all()
-    ]
-    # run multi-threaded for prcoessing audio
+    total_audios = source_audio_collection.count()
+    documents = source_audio_collection.iter_documents(
+        projection=SPLIT_PROJECTION, batch_size=CURSOR_BATCH_SIZE
+    )
+    # documents are streamed from the cursor to the workers,
+    # and the segments they export are inserted while the next audios are split
     print(f"Total number of cpus: {cpu_count()}")
-    with Pool(cpu_count()) as p:
-        list(tqdm(p.imap(process_audio, all_audios), total=len(all_audios)))
-    # insert audio segments to db
-    for audio in tqdm(all_audios, total=len(all_audios)):
-        insert_audio_segments(audio, target_audio_collection)
+    split_and_insert(
+        documents, target_audio_collection, workers=cpu_count(), total=total_audios
+    )
 
 
 if __name__ == "__main__":
-    main()
+    parser = argparse.ArgumentParser(description="Split the MASC audios into segments.")
+    metrics.add_arguments(parser)
+    profiling.add_arguments(parser)
+    args = parser.parse_args()
+    metrics.start(args.metrics_port, args.metrics_summary)
+    with profiling.profile(args.profile):
+        main()
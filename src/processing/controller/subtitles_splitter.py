@@ -1,9 +1,21 @@
 import os
+import argparse
+import asyncio
+from concurrent.futures import Executor, ProcessPoolExecutor
 from pathlib import Path
+from typing import Generator, Iterable, Iterator, Optional
 import logging
 from dotenv import load_dotenv
-from processing.services import splitting_vtt
-from processing.db.audio_db import MongoDB, AudioCollection, DBConfig
+from processing import metrics, profiling
+from processing.services import vtt_split
+from processing.services.vtt_parser import VttSource
+from processing.db.audio_db import (
+    AudioCollection,
+    DBConfig,
+    MongoDB,
+    async_insert_many_with_retries,
+)
+from processing.db.models import Audio, AudioSegment
 from processing.s3_data_provider import S3SubtitleProvider, S3Config
 from tqdm import tqdm
 
@@ -24,6 +36,12 @@ MONGODB_PASSWORD = os.getenv("MONGODB_PASSWORD")
 MONGODB_HOST = os.getenv("MONGODB_HOST")
 MONGODB_NAME = os.getenv("MONGODB_NAME")
 
+# async ingestion: subtitles fetched and parsed at the same time, documents per insert
+CONCURRENCY = 32
+INSERT_BATCH_SIZE = 1000
+# sync ingestion: threads downloading the subtitles to disk
+DOWNLOAD_WORKERS = 16
+
 
 def get_s3_provider() -> S3SubtitleProvider:
     s3_config = S3Config(
@@ -47,12 +65,181 @@ def initialize_db() -> MongoDB:
     return MongoDB(config)
 
 
+def subtitle_to_audio(vtt: VttSource, subtitle_name: str) -> Audio:
+    """
+    Split a subtitle into the source audio document.
+    Args:
+        vtt: subtitle path, or its content as bytes or a file-like object.
+        subtitle_name: subtitle filename, e.g. <audio_id>.ar.vtt
+    Returns:
+        Audio document, segments start and end are in milliseconds.
+    """
+    audio_id = subtitle_name.split(".")[0]
+    audio = vtt_split(vtt, filename=audio_id)
+    return Audio(
+        audio_id=audio_id,
+        audio_length=audio.duration,
+        audio_segments=[
+            AudioSegment(
+                start=round(segment.start * 1000),
+                end=round(segment.end * 1000),
+                text=segment.text,
+                filename=segment.filename,
+            )
+            for segment in audio.segments
+        ],
+    )
+
+
+def _split_subtitle(vtt: VttSource, subtitle_name: str) -> Optional[Audio]:
+    try:
+        return subtitle_to_audio(vtt, subtitle_name)
+    except Exception as e:
+        logging.error("%s while splitting %s", e, subtitle_name)
+        return None
+
+
+def splitter_generator(subtitles: Iterable[Path]) -> Generator[Audio, None, None]:
+    """Split downloaded subtitles one at a time, invalid subtitles are skipped."""
+    for subtitle in subtitles:
+        audio = _split_subtitle(subtitle, subtitle.name)
+        if audio is not None:
+            yield audio
+
+
 def initialize_dirs():
     if not SUBTITLE_DOWNLOAD_PATH.exists():
         SUBTITLE_DOWNLOAD_PATH.mkdir(parents=True)
 
 
-def main():
+def initialize_async_collection():
+    # motor is only needed by the async entry point
+    from motor.motor_asyncio import AsyncIOMotorClient
+
+    config = DBConfig(
+        username=MONGODB_USERNAME,
+        password=MONGODB_PASSWORD,
+        db_name=MONGODB_NAME,
+        host=MONGODB_HOST,
+    )
+    return AsyncIOMotorClient(config.uri)[config.db_name][TARGET_SET]
+
+
+async def _split_worker(
+    subtitles: Iterator[str],
+    s3_provider: S3SubtitleProvider,
+    executor: Optional[Executor],
+    documents: asyncio.Queue,
+    progress: tqdm,
+) -> None:
+    loop = asyncio.get_running_loop()
+    # the iterator is shared by all workers, each key is taken once
+    for key in subtitles:
+        subtitle_name = key.split("/")[-1]
+        try:
+            buffer = await asyncio.to_thread(s3_provider.read_object, key)
+        except Exception as e:
+            logging.error("%s while downloading %s", e, key)
+            continue
+        audio = await loop.run_in_executor(
+            executor, _split_subtitle, buffer.getvalue(), subtitle_name
+        )
+        progress.update()
+        if audio is not None and audio.audio_length != 0:
+            await documents.put(audio.dict())
+
+
+async def _insert_worker(
+    collection, documents: asyncio.Queue, batch_size: int, retry_delay: float
+) -> tuple[int, int]:
+    inserted = failed = 0
+    batch = []
+    done = False
+    while not done:
+        document = await documents.get()
+        if document is None:
+            done = True
+        else:
+            batch.append(document)
+        # insert as soon as no document is waiting, so inserts overlap the downloads
+        if batch and (done or len(batch) >= batch_size or documents.empty()):
+            with metrics.track("mongo_write"):
+                counts = await async_insert_many_with_retries(
+                    collection, batch, retry_delay=retry_delay
+                )
+            metrics.count("mongo_write", items=counts.inserted, failures=counts.failed)
+            inserted += counts.inserted
+            failed += counts.failed
+            batch = []
+    return inserted, failed
+
+
+async def ingest_subtitles(
+    s3_provider: S3SubtitleProvider,
+    collection,
+    concurrency: int = CONCURRENCY,
+    batch_size: int = INSERT_BATCH_SIZE,
+    executor: Optional[Executor] = None,
+    retry_delay: float = 0.5,
+) -> tuple[int, int]:
+    """
+    Download, split and insert all subtitles of the provider concurrently.
+    Downloads run in threads, at most concurrency subtitles are in flight,
+    parsing runs in the executor and inserts overlap both.
+    Transient db errors are retried like BulkAudioWriter does, any other
+    insert error cancels the downloads and is raised.
+    Args:
+        s3_provider: provider listing the subtitles.
+        collection: async collection with a motor compatible insert_many.
+        concurrency: number of subtitles downloaded and parsed at the same time.
+        batch_size: maximum number of documents per insert_many.
+        executor: executor used to parse the subtitles, the loop default executor if None.
+        retry_delay: first delay before retrying a transient insert error.
+    Returns:
+        number of inserted and failed documents.
+    """
+    documents = asyncio.Queue(maxsize=batch_size)
+    subtitles = iter(s3_provider.subtitle_list)
+    with tqdm(total=len(s3_provider.subtitle_list)) as progress:
+        inserter = asyncio.create_task(
+            _insert_worker(collection, documents, batch_size, retry_delay)
+        )
+        splitting = asyncio.gather(
+            *(
+                _split_worker(subtitles, s3_provider, executor, documents, progress)
+                for _ in range(concurrency)
+            )
+        )
+        tasks = [inserter, splitting]
+        try:
+            await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+            if inserter.done():
+                # the inserter only returns after the end marker, it failed
+                inserter.result()
+            splitting.result()
+            # the inserter may still fail while the end marker waits for room
+            tasks.append(asyncio.create_task(documents.put(None)))
+            return await inserter
+        finally:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+
+
+async def main_async(concurrency: int = CONCURRENCY):
+    logging.info("USING %s SET!!!", TARGET_SET)
+    s3_provider: S3SubtitleProvider = get_s3_provider()
+    logging.info("Connected to S3 Provider")
+    collection = initialize_async_collection()
+    with ProcessPoolExecutor() as executor:
+        inserted, failed = await ingest_subtitles(
+            s3_provider, collection, concurrency=concurrency, executor=executor
+        )
+    logging.info("Inserted %d audios, %d failed", inserted, failed)
+    logging.info("========= Done")
+
+
+def main(download_workers: int = DOWNLOAD_WORKERS):
     initialize_dirs()
     logging.info("USING %s SET!!!", TARGET_SET)
     s3_provider: S3SubtitleProvider = get_s3_provider()
@@ -61,15 +248,41 @@ def main():
     audio_db = initialize_db()
     logging.info("Connected to db. get %s collection.", TARGET_SET)
     audio_collection: AudioCollection = audio_db.get_collection(TARGET_SET)
-    for audio in tqdm(
-        splitting_vtt.splitter_generator(s3_provider.download_subtitles),
-        total=len(s3_provider.subtitle_list),
-    ):
-        if audio.audio_length == 0:
-            continue
-        audio_collection.insert_one(audio.dict())
+    with audio_collection.bulk_writer() as writer:
+        for audio in tqdm(
+            splitter_generator(
+                s3_provider.download_subtitles(workers=download_workers)
+            ),
+            total=len(s3_provider.subtitle_list),
+        ):
+            if audio.audio_length == 0:
+                continue
+            writer.insert(audio.dict())
+    logging.info("Inserted %d audios, %d failed", writer.inserted, writer.failed)
     logging.info("========= Done")
 
 
 if __name__ == "__main__":
-    main()
+    parser = argparse.ArgumentParser(description="Split MASC subtitles into the db.")
+    parser.add_argument(
+        "--async",
+        dest="use_async",
+        action="store_true",
+        help="stream subtitles from S3 and insert them with motor.",
+    )
+    parser.add_argument("--concurrency", type=int, default=CONCURRENCY)
+    parser.add_argument(
+        "--download-workers",
+        type=int,
+        default=DOWNLOAD_WORKERS,
+        help="subtitle download threads, subtitles are split in completion order.",
+    )
+    metrics.add_arguments(parser)
+    profiling.add_arguments(parser)
+    args = parser.parse_args()
+    metrics.start(args.metrics_port, args.metrics_summary)
+    with profiling.profile(args.profile):
+        if args.use_async:
+            asyncio.run(main_async(args.concurrency))
+        else:
+            main(args.download_workers)
@@ -1,15 +1,21 @@
+import asyncio
 import os
-from typing import Union
+import time
+from typing import Iterable, Optional, Union
 from dotenv import load_dotenv
 from dataclasses import dataclass
 import logging
+import bson
 from pymongo import MongoClient
 import pymongo
 from pymongo.collection import Collection
+from pymongo.cursor import Cursor
+from pymongo.errors import AutoReconnect, BulkWriteError, NetworkTimeout
 
 # mongo object id
 from bson.objectid import ObjectId
 
+from processing import metrics
 from processing.db.models import Audio, AudioSegment
 
 logging.basicConfig(format="%(asctime)s - %(message)s", level=logging.INFO)
@@ -35,6 +41,201 @@ class DBConfig:
         return f"{self.protocol_name}://{self.username}:{self.password}@{self.host}/?retryWrites=true&w=majority"
 
 
+DUPLICATE_KEY_ERROR = 11000
+TRANSIENT_ERRORS = (AutoReconnect, NetworkTimeout)
+# bson overhead of a field besides its name, of a string besides its utf-8 bytes,
+# and the largest size of a number
+BSON_FIELD_OVERHEAD = 2
+BSON_STRING_OVERHEAD = 5
+BSON_SCALAR_SIZE = 8
+
+
+@dataclass
+class InsertCounts:
+    """Outcome of inserting a batch of documents."""
+
+    inserted: int = 0
+    # documents already in the collection before the first attempt
+    duplicates: int = 0
+    failed: int = 0
+    write_concern_errors: int = 0
+
+
+def bulk_write_counts(
+    error: BulkWriteError, n_documents: int, retried: bool
+) -> InsertCounts:
+    """
+    Outcome of a failed unordered insert_many.
+    Duplicate keys on a retry are documents stored by the previous attempt and
+    are counted as inserted, on the first attempt they were already in the
+    collection and are counted as duplicates.
+    Args:
+        error: error raised by insert_many
+        n_documents: number of documents of the insert_many
+        retried: whether a previous attempt may have stored some documents
+    """
+    counts = InsertCounts()
+    for err in error.details.get("writeErrors", []):
+        if err["code"] == DUPLICATE_KEY_ERROR:
+            counts.duplicates += 1
+        else:
+            logging.error("Failed to insert document: %s", err["errmsg"])
+            counts.failed += 1
+    write_concern_errors = error.details.get("writeConcernErrors", [])
+    for err in write_concern_errors:
+        logging.warning("Write concern error: %s", err.get("errmsg", err))
+    counts.write_concern_errors = len(write_concern_errors)
+    counts.inserted = n_documents - counts.duplicates - counts.failed
+    if retried:
+        counts.inserted += counts.duplicates
+        counts.duplicates = 0
+    return counts
+
+
+def transient_retry_delay(
+    error: Exception, attempt: int, max_retries: int, retry_delay: float
+) -> Optional[float]:
+    """
+    Seconds to wait before retrying an insert that raised a transient error,
+    the delay doubles with every attempt.
+    Returns:
+        the delay, None when the insert should not be retried.
+    """
+    if attempt == max_retries:
+        logging.error("Giving up inserting documents: %s", error)
+        return None
+    delay = retry_delay * 2**attempt
+    logging.warning("%s, retrying insert in %.1fs", error, delay)
+    return delay
+
+
+def insert_many_with_retries(
+    collection: Collection,
+    documents: list[dict],
+    max_retries: int = 5,
+    retry_delay: float = 0.5,
+) -> InsertCounts:
+    """Unordered insert_many retried on TRANSIENT_ERRORS with exponential backoff."""
+    for attempt in range(max_retries + 1):
+        try:
+            result = collection.insert_many(documents, ordered=False)
+            return InsertCounts(inserted=len(result.inserted_ids))
+        except BulkWriteError as e:
+            return bulk_write_counts(e, len(documents), retried=attempt > 0)
+        except TRANSIENT_ERRORS as e:
+            delay = transient_retry_delay(e, attempt, max_retries, retry_delay)
+            if delay is None:
+                return InsertCounts(failed=len(documents))
+            time.sleep(delay)
+
+
+async def async_insert_many_with_retries(
+    collection,
+    documents: list[dict],
+    max_retries: int = 5,
+    retry_delay: float = 0.5,
+) -> InsertCounts:
+    """insert_many_with_retries for a motor collection."""
+    for attempt in range(max_retries + 1):
+        try:
+            result = await collection.insert_many(documents, ordered=False)
+            return InsertCounts(inserted=len(result.inserted_ids))
+        except BulkWriteError as e:
+            return bulk_write_counts(e, len(documents), retried=attempt > 0)
+        except TRANSIENT_ERRORS as e:
+            delay = transient_retry_delay(e, attempt, max_retries, retry_delay)
+            if delay is None:
+                return InsertCounts(failed=len(documents))
+            await asyncio.sleep(delay)
+
+
+def estimated_bson_size(document: dict) -> int:
+    """
+    Approximate bson size of a document, exact for flat documents of strings.
+    Only nested and uncommon values are encoded.
+    """
+    size = 5
+    for key, value in document.items():
+        size += len(key) + BSON_FIELD_OVERHEAD
+        if isinstance(value, str):
+            size += len(value.encode()) + BSON_STRING_OVERHEAD
+        elif value is None or isinstance(value, (bool, int, float)):
+            size += BSON_SCALAR_SIZE
+        else:
+            size += len(bson.encode({"": value}))
+    return size
+
+
+class BulkAudioWriter:
+    """
+    Buffer documents and insert them with unordered insert_many.
+    The buffer is flushed when it holds max_documents documents or about
+    max_bytes bson bytes, flushing blocks the caller which throttles producers
+    faster than the db. Transient network errors are retried, see bulk_write_counts
+    for how duplicate keys are counted.
+    Use it as a context manager to flush the remaining documents on exit.
+    """
+
+    def __init__(
+        self,
+        collection: Collection,
+        max_documents: int = 1000,
+        max_bytes: int = 8 * 1024 * 1024,
+        max_retries: int = 5,
+        retry_delay: float = 0.5,
+    ):
+        self.collection = collection
+        self.max_documents = max_documents
+        self.max_bytes = max_bytes
+        self.max_retries = max_retries
+        self.retry_delay = retry_delay
+        self.inserted = 0
+        self.duplicates = 0
+        self.failed = 0
+        self.write_concern_errors = 0
+        self._buffer: list[dict] = []
+        self._buffer_bytes = 0
+
+    def __enter__(self) -> "BulkAudioWriter":
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.flush()
+
+    def insert(self, audio: dict) -> None:
+        self._buffer.append(audio)
+        self._buffer_bytes += estimated_bson_size(audio)
+        if (
+            len(self._buffer) >= self.max_documents
+            or self._buffer_bytes >= self.max_bytes
+        ):
+            self.flush()
+
+    def insert_many(self, audios: Iterable[dict]) -> None:
+        for audio in audios:
+            self.insert(audio)
+
+    def flush(self) -> int:
+        """
+        Insert the buffered documents.
+        Returns:
+            number of documents inserted by this flush.
+        """
+        if not self._buffer:
+            return 0
+        documents, self._buffer, self._buffer_bytes = self._buffer, [], 0
+        with metrics.track("mongo_write"):
+            counts = insert_many_with_retries(
+                self.collection, documents, self.max_retries, self.retry_delay
+            )
+        metrics.count("mongo_write", items=counts.inserted, failures=counts.failed)
+        self.inserted += counts.inserted
+        self.duplicates += counts.duplicates
+        self.failed += counts.failed
+        self.write_concern_errors += counts.write_concern_errors
+        return counts.inserted
+
+
 class AudioCollection:
     """Audio collection wrapper class"""
 
@@ -50,6 +251,24 @@ class AudioCollection:
     def find_all(self):
         return self.collection.find()
 
+    def iter_documents(
+        self, projection: Optional[dict] = None, batch_size: int = 1000
+    ) -> Cursor:
+        """
+        Lazy cursor over the whole collection.
+        Args:
+            projection: fields to fetch, e.g. {"audio_id": 1, "audio_segments.filename": 1}
+            batch_size: number of documents fetched per round trip
+        """
+        return self.collection.find({}, projection=projection, batch_size=batch_size)
+
+    def count(self) -> int:
+        return self.collection.estimated_document_count()
+
+    def bulk_writer(self, **kwargs) -> BulkAudioWriter:
+        """Buffered writer for many documents, see BulkAudioWriter for the options."""
+        return BulkAudioWriter(self.collection, **kwargs)
+
 
 class MongoDB:
     def __init__(self, config: DBConfig):
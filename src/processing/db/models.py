@@ -1,10 +1,19 @@
-from dataclasses import dataclass
+from dataclasses import dataclass, InitVar
 from typing import Optional
-from maha.cleaners.functions import normalize, keep
 from pprint import pprint
+from processing.text_cleaning import cached_clean_text
 
 
-@dataclass
+# segment durations of the documents are rounded to milliseconds
+DURATION_DECIMALS = 3
+
+
+def masc_document(filename: str, text: str, duration: float) -> dict:
+    """Segment document of the MASC collections, see MASCAudio."""
+    return {"filename": filename, "text": text, "duration": duration}
+
+
+@dataclass(slots=True)
 class AudioSegment:
     """
     Class to represent an audio segment.
@@ -28,38 +37,41 @@ class AudioSegment:
 
     @property
     def duration(self) -> float:
-        return round((self.end - self.start) / 1000, 3)
+        return round((self.end - self.start) / 1000, DURATION_DECIMALS)
 
 
-@dataclass
+@dataclass(slots=True)
 class MASCAudio:
+    """
+    Class to represent a segment document of the MASC collections.
+    text is cleaned on construction unless clean_text is False,
+    for text that is already known to be clean.
+    """
 
     filename: str
     text: str
     duration: float
     _id: Optional[str] = None
+    clean_text: InitVar[bool] = True
 
-    def __post_init__(self):
-        self.text = normalize(self.text, alef=True)
-        self.text = keep(self.text, arabic_letters=True)
+    def __post_init__(self, clean_text: bool):
+        if clean_text:
+            self.text = cached_clean_text(self.text)
 
     @staticmethod
-    def from_audio_segment(audio_segment: AudioSegment):
+    def from_audio_segment(audio_segment: AudioSegment, clean_text: bool = True):
         return MASCAudio(
             filename=audio_segment.filename,
             text=audio_segment.text,
             duration=audio_segment.duration,
+            clean_text=clean_text,
         )
 
     def dict(self):
-        return {
-            "filename": self.filename,
-            "text": self.text,
-            "duration": self.duration,
-        }
+        return masc_document(self.filename, self.text, self.duration)
 
 
-@dataclass
+@dataclass(slots=True)
 class Audio:
     """
     Class to represent an audio. which will be converted to AudioDocument.
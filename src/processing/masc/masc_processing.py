@@ -1,15 +1,34 @@
+import argparse
+from contextlib import nullcontext
+from dataclasses import dataclass
+from multiprocessing import Pool, cpu_count
 from pathlib import Path
+from typing import Generator, Iterable, Optional
 from tqdm import tqdm
 import logging
+import os
 import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+from processing import metrics, profiling
 from processing.config import Audio, SourceEnum
-from processing.services import folder_vtt_split, clean_text, split_audio_to_segments
+from processing.services import (
+    folder_vtt_split,
+    iter_folder_vtt_split,
+    clean_text_batch,
+    split_audio_arrays,
+    SegmentManifest,
+    SegmentTable,
+)
+from processing.services.segment_manifest import segment_record, segments_digest
 
 
 logging.basicConfig(
     level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s"
 )
 
+MASC_FOLDER = Path(os.getenv("MASC_FOLDER", "/root/datasets/masc/"))
+
 
 def audio_to_dataframe(audios: list[Audio]) -> pd.DataFrame:
     """
@@ -28,15 +47,40 @@ def audio_to_dataframe(audios: list[Audio]) -> pd.DataFrame:
     Returns:
         dataframe
     """
-    data = [
-        [
-            {"audio_filename": audio.filename, **segment.to_dict()}
-            for segment in audio.segments
-        ]
-        for audio in audios
-    ]
-    data = [item for sublist in data for item in sublist]
-    return pd.DataFrame(data)
+    return SegmentTable.from_audios(audios).to_dataframe()
+
+
+def iter_audio_dataframes(
+    audios: Iterable[Audio], chunk_size: int = 100_000
+) -> Generator[pd.DataFrame, None, None]:
+    """
+    Same as audio_to_dataframe, but yields dataframes of about chunk_size rows.
+    The segments of an audio are never split across two dataframes.
+    Args:
+        audios: iterable of Audio objects, consumed lazily
+        chunk_size: minimum number of rows of each dataframe, except the last one
+    Yields:
+        dataframes
+    """
+    chunk, rows = [], 0
+    for audio in audios:
+        chunk.append(audio)
+        rows += len(audio.segments)
+        if rows >= chunk_size:
+            yield audio_to_dataframe(chunk)
+            chunk, rows = [], 0
+    if rows:
+        yield audio_to_dataframe(chunk)
+
+
+def _prepare_dataframe(df: pd.DataFrame, clean_segment_text: bool) -> pd.DataFrame:
+    if clean_segment_text:
+        logging.info("Cleaning text.")
+        df["segment_text"] = clean_text_batch(df["segment_text"])
+    df.source = pd.Categorical(df.source)
+    df.audio_filename = df.audio_filename.apply(lambda x: x.replace(".ar", ""))
+    df.segment_filename = df.segment_filename.apply(lambda x: x.replace(".ar", ""))
+    return df
 
 
 def vtt_split_to_dataframe(
@@ -46,6 +90,10 @@ def vtt_split_to_dataframe(
     max_duration=16.0,
     threshold=2.0,
     source=SourceEnum.MASC,
+    workers: int = 1,
+    parser: str = "webvtt",
+    engine: str = "python",
+    cue_cache: bool = False,
 ) -> pd.DataFrame:
     """
     Take a dataframe and subtitle folder and split the subtitle files into segments.
@@ -62,6 +110,11 @@ def vtt_split_to_dataframe(
         subtitle_folder: folder containing subtitle files
         dataframe_path: path to dataframe
         clean_text: clean text using clean_text function
+        workers: number of processes used to parse the subtitle files
+        parser: vtt parser, "webvtt" or "native"
+        engine: caption merging engine, "python" or "numpy"
+        cue_cache: keep the parsed captions in a cache inside subtitle_folder,
+            reruns with other durations or threshold skip parsing.
     Returns:
         dataframe
     """
@@ -74,16 +127,92 @@ def vtt_split_to_dataframe(
         max_duration=max_duration,
         threshold=threshold,
         source=source,
+        workers=workers,
+        parser=parser,
+        engine=engine,
+        cue_cache=cue_cache,
     )
     df = audio_to_dataframe(audios)
     logging.info("Converting audio segments to dataframe.")
-    if clean_segment_text:
-        logging.info("Cleaning text.")
-        df["segment_text"] = df["segment_text"].apply(clean_text)
-    df.source = pd.Categorical(df.source)
-    df.audio_filename = df.audio_filename.apply(lambda x: x.replace(".ar", ""))
-    df.segment_filename = df.segment_filename.apply(lambda x: x.replace(".ar", ""))
-    return df
+    return _prepare_dataframe(df, clean_segment_text)
+
+
+def vtt_split_to_parquet(
+    subtitle_folder: Path,
+    dataframe_path: Path,
+    clean_segment_text: bool = True,
+    min_duration=6.0,
+    max_duration=16.0,
+    threshold=2.0,
+    source=SourceEnum.MASC,
+    chunk_size: int = 100_000,
+    workers: int = 1,
+    parser: str = "webvtt",
+    engine: str = "python",
+    cue_cache: bool = False,
+) -> int:
+    """
+    Streaming version of vtt_split_to_dataframe followed by validate_dataframe.
+    Subtitle files are split lazily and every chunk of about chunk_size rows
+    is validated and written as a parquet row group, so memory stays bounded
+    by chunk_size whatever the number of subtitle files.
+    Duplicated rows are removed within each chunk only.
+    Args:
+        subtitle_folder: folder containing subtitle files
+        dataframe_path: path to the parquet file
+        clean_segment_text: clean text using clean_text function
+        chunk_size: number of rows of each row group
+        workers: number of processes used to parse the subtitle files
+        parser: vtt parser, "webvtt" or "native"
+        engine: caption merging engine, "python" or "numpy"
+        cue_cache: keep the parsed captions in a cache inside subtitle_folder,
+            reruns with other durations or threshold skip parsing.
+    Returns:
+        number of rows written
+    """
+    if not subtitle_folder.is_dir():
+        raise ValueError("subtitle_folder should be a path to a folder.")
+    if dataframe_path.suffix != ".parquet":
+        raise ValueError("dataframe_path should be a parquet file.")
+    audios = iter_folder_vtt_split(
+        vtt_folder=subtitle_folder,
+        min_duration=min_duration,
+        max_duration=max_duration,
+        threshold=threshold,
+        source=source,
+        workers=workers,
+        parser=parser,
+        engine=engine,
+        cue_cache=cue_cache,
+    )
+    total = 0
+    writer = None
+    try:
+        for df in iter_audio_dataframes(audios, chunk_size=chunk_size):
+            df = _prepare_dataframe(df, clean_segment_text)
+            _validate_duration(df, min_duration, max_duration)
+            df = df.drop_duplicates()
+            if writer is None:
+                table = pa.Table.from_pandas(df, preserve_index=False)
+                writer = pq.ParquetWriter(dataframe_path, table.schema)
+            else:
+                table = pa.Table.from_pandas(
+                    df, schema=writer.schema, preserve_index=False
+                )
+            writer.write_table(table)
+            total += len(df)
+    finally:
+        if writer is not None:
+            writer.close()
+    logging.info(f"{total} segments written to {dataframe_path}.")
+    return total
+
+
+def _validate_duration(df: pd.DataFrame, min_duration: float, max_duration: float):
+    if df.segment_duration.min() < min_duration:
+        raise ValueError(f"min duration is {df.segment_duration.min()}")
+    if df.segment_duration.max() > max_duration:
+        raise ValueError(f"max duration is {df.segment_duration.max()}")
 
 
 def validate_dataframe(
@@ -105,10 +234,7 @@ def validate_dataframe(
     Returns:
         Series describing the segment duration
     """
-    if df.segment_duration.min() < min_duration:
-        raise ValueError(f"min duration is {df.segment_duration.min()}")
-    if df.segment_duration.max() > max_duration:
-        raise ValueError(f"max duration is {df.segment_duration.max()}")
+    _validate_duration(df, min_duration, max_duration)
     if dataframe_path.is_dir():
         raise ValueError("dataframe_path should be a path to a file.")
     if dataframe_path.suffix != ".parquet":
@@ -120,45 +246,182 @@ def validate_dataframe(
     return df
 
 
+@dataclass
+class SplitSummary:
+    """Aggregated result of splitting a subset into segments."""
+
+    exported: int = 0
+    failed: int = 0
+    missing_audios: int = 0
+    skipped_audios: int = 0
+
+    def __str__(self) -> str:
+        return (
+            f"exported {self.exported} segments, failed {self.failed} segments, "
+            f"missing {self.missing_audios} audios, skipped {self.skipped_audios} audios"
+        )
+
+
+def _split_audio_group(
+    task: tuple,
+) -> tuple[str, int, int, Optional[list[dict]], Optional[str]]:
+    """
+    Split a single audio into its segments, runs inside the worker processes.
+    The task carries only the needed columns as arrays, not a dataframe slice.
+    Returns:
+        audio name, number of exported segments, number of failed segments,
+        the manifest records of the segments when a digest was given and all were
+        exported, and the segments digest.
+    """
+    (
+        audio_name,
+        audio_path,
+        filenames,
+        starts,
+        ends,
+        output_dir,
+        extension,
+        digest,
+    ) = task
+    try:
+        exported = split_audio_arrays(
+            audio=audio_path,
+            filenames=filenames,
+            starts=starts,
+            ends=ends,
+            output_dir=output_dir,
+            extension=extension,
+        )
+    except Exception as e:
+        logging.error("%s while splitting %s", e, audio_path)
+        exported = 0
+    failed = len(filenames) - exported
+    records = None
+    if digest is not None and failed == 0:
+        records = [
+            segment_record(output_dir / f"{filename}.{extension}")
+            for filename in filenames
+        ]
+    return audio_name, exported, failed, records, digest
+
+
+def _split_tasks(
+    df: pd.DataFrame,
+    subset_audio_folder: Path,
+    subset_output_folder: Path,
+    audio_extension: str,
+    summary: SplitSummary,
+    manifest: Optional[SegmentManifest] = None,
+) -> list[tuple]:
+    """
+    Build one task per audio file, largest files first so the last
+    tasks to finish are short ones. Audios the manifest holds with the same
+    segments are skipped.
+    """
+    filenames = df.segment_filename.to_numpy()
+    starts = df.segment_start.to_numpy()
+    ends = df.segment_end.to_numpy()
+    tasks = []
+    for audio_name, positions in df.groupby("audio_filename", sort=True).indices.items():
+        digest = None
+        if manifest is not None:
+            digest = segments_digest(
+                filenames[positions], starts[positions], ends[positions]
+            )
+            if manifest.is_complete(audio_name, filenames[positions], digest):
+                summary.skipped_audios += 1
+                continue
+        audio_path = subset_audio_folder / f"{audio_name}.{audio_extension}"
+        if not audio_path.is_file():
+            logging.warning(f"{audio_path} is not a file")
+            summary.missing_audios += 1
+            summary.failed += len(positions)
+            continue
+        task = (
+            audio_name,
+            audio_path,
+            filenames[positions],
+            starts[positions],
+            ends[positions],
+            subset_output_folder,
+            audio_extension,
+            digest,
+        )
+        tasks.append((audio_path.stat().st_size, task))
+    tasks.sort(key=lambda size_task: size_task[0], reverse=True)
+    return [task for _, task in tasks]
+
+
 def split_subset_to_audio(
     df: pd.DataFrame,
     subset_audio_folder: Path,
     subset_output_folder: Path,
     audio_extension: str = "wav",
-) -> None:
+    workers: int = 1,
+    manifest: Optional[SegmentManifest] = None,
+) -> SplitSummary:
     """
     split audio files into segments, grouped by audio_filename
     Args:
         df: dataframe
         subset_audio_folder: path to audio files
         subset_output_folder: path to output folder
+        audio_extension: extension of the audio files and the segments
+        workers: number of processes, each audio file is handled by a single process.
+        manifest: when given, audios it holds with the same segments are skipped
+            and completed audios are added to it.
+    Returns:
+        SplitSummary with the number of exported and failed segments.
     """
-    df = df.groupby("audio_filename")
-    total_audios = len(df)
-    logging.info(f"total audios: {total_audios}")
-    for audio_name, audio_segments in tqdm(df, total=total_audios):
-        audio_path = subset_audio_folder / f"{audio_name}.{audio_extension}"
-        if not audio_path.is_file():
-            logging.warning(f"{audio_path} is not a file")
-            continue
-        split_audio_to_segments(
-            audio=audio_path,
-            audio_segments=audio_segments,
-            output_dir=subset_output_folder,
-            extension=audio_extension,
-        )
+    summary = SplitSummary()
+    tasks = _split_tasks(
+        df, subset_audio_folder, subset_output_folder, audio_extension, summary, manifest
+    )
+    logging.info(f"total audios: {len(tasks)}")
+    with Pool(workers) if workers > 1 else nullcontext() as pool:
+        if pool is None:
+            results = map(_split_audio_group, tasks)
+        else:
+            results = pool.imap_unordered(_split_audio_group, tasks)
+        for audio_name, exported, failed, records, digest in tqdm(
+            results, total=len(tasks)
+        ):
+            summary.exported += exported
+            summary.failed += failed
+            if records is not None:
+                manifest.add(audio_name, records, digest)
+    logging.info(summary)
+    return summary
 
 
-def masc_subtitle_to_dataframe():
-    masc_folder = Path("/root/datasets/masc/")
+def masc_subtitle_to_dataframe(
+    chunk_size: Optional[int] = None,
+    workers: int = cpu_count(),
+    masc_folder: Path = MASC_FOLDER,
+    dataframe_folder: Path = Path("."),
+):
+    """
+    Split the subtitles of every MASC subset into a parquet file of segments.
+    Args:
+        workers: number of processes used to parse the subtitle files
+        chunk_size: when given, subtitles are streamed to parquet row groups of
+            chunk_size rows instead of building the whole dataframe in memory.
+        masc_folder: folder with a subtitles folder per subset
+        dataframe_folder: folder of the <subset>.parquet files
+    """
     for subset in masc_folder.glob("*"):
         if not subset.is_dir():
             logging.warning(f"{subset} is not a directory")
             continue
         logging.info(f"processing {subset.name}...")
-        dataframe_path = Path(f"{subset.name}.parquet")
+        dataframe_path = dataframe_folder / f"{subset.name}.parquet"
         subset_folder = subset / "subtitles"
-        df = vtt_split_to_dataframe(subset_folder)
+        if chunk_size is not None:
+            vtt_split_to_parquet(
+                subset_folder, dataframe_path, chunk_size=chunk_size, workers=workers
+            )
+            continue
+        df = vtt_split_to_dataframe(subset_folder, workers=workers)
         logging.info(f"validating {subset.name}...")
         df = validate_dataframe(
             df=df, dataframe_path=dataframe_path, min_duration=6.0, max_duration=16.0
@@ -166,20 +429,59 @@ def masc_subtitle_to_dataframe():
         logging.info(df.segment_duration.describe())
 
 
-def masc_dataframe_to_audio():
-    masc_folder = Path("/root/datasets/masc/")
+def masc_dataframe_to_audio(
+    workers: int = cpu_count(),
+    verify: bool = False,
+    masc_folder: Path = MASC_FOLDER,
+    dataframe_folder: Path = Path("."),
+):
+    """
+    Split the audios of every MASC subset into segments.
+    A manifest inside each segments folder records completed audios, so a rerun
+    only exports the audios that were not finished.
+    Args:
+        workers: number of processes
+        verify: re-check the checksums of completed audios first and export again
+            the ones with missing or changed segments.
+        masc_folder: folder with an audios folder per subset, segments are written
+            to a segments folder next to it
+        dataframe_folder: folder of the <subset>.parquet files
+    """
     for subset in masc_folder.glob("*"):
         if not subset.is_dir():
             logging.warning(f"{subset} is not a directory")
             continue
         logging.info(f"processing {subset.name}...")
-        dataframe = pd.read_parquet(f"{subset.name}.parquet")
+        dataframe = pd.read_parquet(dataframe_folder / f"{subset.name}.parquet")
         subset_folder = subset / "audios"
         subset_output = subset / "segments"
         subset_output.mkdir(exist_ok=True)
-        split_subset_to_audio(dataframe, subset_folder, subset_output)
+        manifest = SegmentManifest(subset_output)
+        if verify:
+            logging.info(f"verifying {len(manifest)} completed audios...")
+            corrupted = manifest.verify(workers=workers)
+            logging.info(f"{len(corrupted)} audios will be exported again")
+            manifest.invalidate(corrupted)
+        split_subset_to_audio(
+            dataframe, subset_folder, subset_output, workers=workers, manifest=manifest
+        )
 
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Split MASC subsets into segments.")
+    parser.add_argument("--workers", type=int, default=cpu_count())
+    parser.add_argument("--masc-folder", type=Path, default=MASC_FOLDER)
+    parser.add_argument(
+        "--verify",
+        action="store_true",
+        help="re-check the checksums of already exported segments",
+    )
+    metrics.add_arguments(parser)
+    profiling.add_arguments(parser)
+    args = parser.parse_args()
+    metrics.start(args.metrics_port, args.metrics_summary)
     # masc_subtitle_to_dataframe()
-    masc_dataframe_to_audio()
+    with profiling.profile(args.profile):
+        masc_dataframe_to_audio(
+            workers=args.workers, verify=args.verify, masc_folder=args.masc_folder
+        )
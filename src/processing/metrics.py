@@ -0,0 +1,213 @@
+"""
+Counters and latency histograms of the pipeline stages.
+
+Metrics are off until enable (or start) is called by an entry point, track and
+count do nothing before that, so importing the library has no side effect.
+enable switches prometheus_client to multiprocess mode, so the values recorded
+by pool workers forked afterwards are aggregated with the parent ones. The mode
+is chosen when prometheus_client is imported, PROMETHEUS_MULTIPROC_DIR is set
+to a fresh temporary directory unless it is already set; call enable before
+anything else imports prometheus_client.
+"""
+from contextlib import contextmanager
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Iterator, Optional
+import atexit
+import json
+import logging
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+
+STAGES = ("vtt_parse", "clean_text", "segment_export", "s3_transfer", "mongo_write")
+SECONDS_BUCKETS = (
+    0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0, 10.0, 60.0, float("inf")
+)
+
+
+@dataclass
+class _Metrics:
+    stage_seconds: object
+    stage_items: object
+    stage_failures: object
+    s3_bytes: object
+    # registry of the metrics when they are not in multiprocess mode
+    registry: Optional[object] = None
+
+
+_metrics: Optional[_Metrics] = None
+_owned_dir: Optional[str] = None
+_owner_pid: Optional[int] = None
+
+
+def _remove_owned_dir() -> None:
+    # forked workers inherit the handler, only the creator of the dir removes it
+    if os.getpid() == _owner_pid:
+        shutil.rmtree(_owned_dir, ignore_errors=True)
+
+
+def enabled() -> bool:
+    return _metrics is not None
+
+
+def enable() -> None:
+    """
+    Start recording the metrics, does nothing if they are already recorded.
+    Call it before the worker processes are started.
+    """
+    global _metrics, _owned_dir, _owner_pid
+    if _metrics is not None:
+        return
+    multiprocess_mode = "PROMETHEUS_MULTIPROC_DIR" in os.environ
+    if not multiprocess_mode and "prometheus_client" not in sys.modules:
+        _owned_dir = tempfile.mkdtemp(prefix="processing_metrics_")
+        _owner_pid = os.getpid()
+        os.environ["PROMETHEUS_MULTIPROC_DIR"] = _owned_dir
+        atexit.register(_remove_owned_dir)
+        multiprocess_mode = True
+    elif not multiprocess_mode:
+        logging.warning(
+            "prometheus_client was imported before metrics were enabled, "
+            "metrics of worker processes are not aggregated"
+        )
+    from prometheus_client import CollectorRegistry, Counter, Histogram
+
+    registry = None if multiprocess_mode else CollectorRegistry()
+    _metrics = _Metrics(
+        stage_seconds=Histogram(
+            "processing_stage_seconds",
+            "Time spent in a call of a pipeline stage, a call handles a batch of "
+            "items, e.g. one insert_many flush of mongo_write, not one document.",
+            ["stage"],
+            buckets=SECONDS_BUCKETS,
+            registry=registry,
+        ),
+        stage_items=Counter(
+            "processing_stage_items",
+            "Items processed by a pipeline stage.",
+            ["stage"],
+            registry=registry,
+        ),
+        stage_failures=Counter(
+            "processing_stage_failures",
+            "Items a pipeline stage failed to process.",
+            ["stage"],
+            registry=registry,
+        ),
+        s3_bytes=Counter(
+            "processing_s3_bytes", "Bytes transferred from S3.", registry=registry
+        ),
+        registry=registry,
+    )
+
+
+@contextmanager
+def track(stage: str) -> Iterator[None]:
+    """
+    Observe the duration of a stage call, an exception counts as one failure.
+    Args:
+        stage: one of STAGES
+    """
+    if _metrics is None:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    except Exception:
+        _metrics.stage_failures.labels(stage).inc()
+        raise
+    finally:
+        _metrics.stage_seconds.labels(stage).observe(time.perf_counter() - start)
+
+
+def count(stage: str, items: int = 1, failures: int = 0) -> None:
+    """Count the items processed and failed by a stage call."""
+    if _metrics is None:
+        return
+    if items:
+        _metrics.stage_items.labels(stage).inc(items)
+    if failures:
+        _metrics.stage_failures.labels(stage).inc(failures)
+
+
+def count_s3_bytes(size: int) -> None:
+    if _metrics is not None:
+        _metrics.s3_bytes.inc(size)
+
+
+def registry():
+    """Registry aggregating the metrics of every process, metrics must be enabled."""
+    if _metrics is None:
+        raise RuntimeError("metrics are not enabled, call metrics.enable first.")
+    if _metrics.registry is not None:
+        return _metrics.registry
+    from prometheus_client import CollectorRegistry, multiprocess
+
+    collector_registry = CollectorRegistry()
+    multiprocess.MultiProcessCollector(collector_registry)
+    return collector_registry
+
+
+def summary() -> dict:
+    """
+    Aggregated metrics of every process, all zero when metrics are not enabled.
+    Returns:
+        calls, seconds, items and failures of each stage, and the S3 bytes.
+    """
+    stages = {
+        stage: {"calls": 0, "seconds": 0.0, "items": 0, "failures": 0} for stage in STAGES
+    }
+    s3_bytes = 0
+    if _metrics is None:
+        return {"stages": stages, "s3_bytes": s3_bytes}
+    for metric in registry().collect():
+        for sample in metric.samples:
+            stage = sample.labels.get("stage")
+            if sample.name == "processing_stage_seconds_count":
+                stages[stage]["calls"] = int(sample.value)
+            elif sample.name == "processing_stage_seconds_sum":
+                stages[stage]["seconds"] = sample.value
+            elif sample.name == "processing_stage_items_total":
+                stages[stage]["items"] = int(sample.value)
+            elif sample.name == "processing_stage_failures_total":
+                stages[stage]["failures"] = int(sample.value)
+            elif sample.name == "processing_s3_bytes_total":
+                s3_bytes = int(sample.value)
+    return {"stages": stages, "s3_bytes": s3_bytes}
+
+
+def write_summary(path: Path) -> None:
+    with open(path, "w") as f:
+        json.dump(summary(), f, indent=2)
+    logging.info("Metrics summary written to %s", path)
+
+
+def start(port: Optional[int] = None, summary_path: Optional[Path] = None) -> None:
+    """
+    Enable the metrics when requested, then expose them and/or write their
+    summary when the program exits.
+    Args:
+        port: serve the metrics on http://localhost:<port>/metrics when given
+        summary_path: json file written at exit when given
+    """
+    if port is None and summary_path is None:
+        return
+    enable()
+    if port is not None:
+        from prometheus_client import start_http_server
+
+        start_http_server(port, registry=registry())
+        logging.info("Serving metrics on port %d", port)
+    if summary_path is not None:
+        atexit.register(write_summary, summary_path)
+
+
+def add_arguments(parser) -> None:
+    """Add the --metrics-port and --metrics-summary options to an argparse parser."""
+    parser.add_argument("--metrics-port", type=int, default=None)
+    parser.add_argument("--metrics-summary", type=Path, default=None)
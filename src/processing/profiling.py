@@ -0,0 +1,126 @@
+"""
+cProfile of a run and of every worker process it forks.
+
+The parent and each multiprocessing worker write their own profile,
+they are merged into one report when the run ends. Only the main thread
+of each process is profiled.
+"""
+from contextlib import contextmanager
+from multiprocessing import util
+from pathlib import Path
+from typing import Iterator, Optional
+import cProfile
+import io
+import logging
+import os
+import pstats
+import signal
+
+
+# functions where a process waits for a child process, e.g. ffmpeg encoders
+SUBPROCESS_WAITS = ("run", "call", "check_call", "check_output", "communicate", "wait")
+
+
+class _Session:
+    """Profiler of the current process, restarted in forked workers."""
+
+    def __init__(self, output_dir: Path):
+        self.output_dir = output_dir
+        self.profiler = cProfile.Profile()
+
+    def dump(self, name: str) -> None:
+        self.profiler.disable()
+        self.profiler.dump_stats(self.output_dir / f"{name}.prof")
+
+    def after_fork(self) -> None:
+        # the parent profiler is inherited but belongs to the parent
+        self.profiler.disable()
+        self.profiler = cProfile.Profile()
+        name = f"worker-{os.getpid()}"
+        # workers leave on pool.terminate (SIGTERM) or through the exit finalizers
+        util.Finalize(self, self.dump, args=(name,), exitpriority=100)
+        signal.signal(signal.SIGTERM, lambda signum, frame: self._terminate(name))
+        self.profiler.enable()
+
+    def _terminate(self, name: str) -> None:
+        self.dump(name)
+        os._exit(0)
+
+
+def subprocess_wait_seconds(stats: pstats.Stats) -> tuple[float, int]:
+    """
+    Wall time spent waiting for child processes started with subprocess.
+    Calls between subprocess functions are not counted twice.
+    Returns:
+        seconds and number of calls
+    """
+    seconds, calls = 0.0, 0
+    for (filename, _, name), (*_, callers) in stats.stats.items():
+        if not filename.endswith("subprocess.py") or name not in SUBPROCESS_WAITS:
+            continue
+        for caller, (edge_calls, _, _, edge_seconds) in callers.items():
+            if not caller[0].endswith("subprocess.py"):
+                seconds += edge_seconds
+                calls += edge_calls
+    return seconds, calls
+
+
+def merge(output_dir: Path, top: int = 30) -> str:
+    """
+    Merge the profiles of output_dir into merged.prof and write report.txt.
+    Returns:
+        the report
+    """
+    paths = sorted(output_dir.glob("*.prof"))
+    paths = [path for path in paths if path.name != "merged.prof"]
+    stream = io.StringIO()
+    stats = pstats.Stats(*map(str, paths), stream=stream)
+    stats.dump_stats(output_dir / "merged.prof")
+    seconds, calls = subprocess_wait_seconds(stats)
+    stream.write(f"{len(paths)} processes profiled\n")
+    stream.write(
+        f"waiting for subprocesses (encoders): {seconds:.3f}s in {calls} calls\n\n"
+    )
+    stats.sort_stats("cumulative").print_stats(top)
+    stats.sort_stats("tottime").print_stats(top)
+    report = stream.getvalue()
+    (output_dir / "report.txt").write_text(report)
+    return report
+
+
+@contextmanager
+def profile(output_dir: Optional[Path], top: int = 30) -> Iterator[None]:
+    """
+    Profile the block and the worker processes forked inside it.
+    Profiles left in output_dir by a previous run are deleted first.
+    Args:
+        output_dir: folder of the profiles and the merged report, nothing is profiled if None
+        top: number of functions listed in the report
+    """
+    if output_dir is None:
+        yield
+        return
+    output_dir.mkdir(parents=True, exist_ok=True)
+    for path in output_dir.glob("*.prof"):
+        path.unlink()
+    session = _Session(output_dir)
+    util.register_after_fork(session, _Session.after_fork)
+    session.profiler.enable()
+    try:
+        yield
+    finally:
+        session.dump("main")
+        # the registry holds a weak reference, forks made after this are not profiled
+        del session
+        report = merge(output_dir, top)
+        logging.info("Profile written to %s\n%s", output_dir, report[:4000])
+
+
+def add_arguments(parser) -> None:
+    """Add the --profile option to an argparse parser."""
+    parser.add_argument(
+        "--profile",
+        type=Path,
+        default=None,
+        help="folder to write the merged cProfile of the run and its workers",
+    )
@@ -1 +1 @@
-from .s3_provider import S3SubtitleProvider, S3Config
+from .s3_provider import S3SubtitleProvider, S3AudioProvider, S3Config
@@ -0,0 +1,87 @@
+from dataclasses import dataclass, asdict
+from pathlib import Path
+import json
+import logging
+import os
+import time
+
+
+CACHE_FILENAME = ".s3_cache.json"
+# the index is saved after this many updates or seconds since the last save,
+# so a killed run loses at most that much of it
+SAVE_EVERY = 500
+SAVE_INTERVAL = 10.0
+
+
+@dataclass
+class CachedObject:
+    """S3 object downloaded to a local file."""
+
+    etag: str
+    size: int
+    mtime: float
+
+
+class ObjectCache:
+    """
+    Index of the objects already downloaded to a folder.
+    An object is fresh when its etag and size didn't change on S3
+    and the local file still has the size and mtime it had after the download.
+    The index is a json file inside the folder, updates are saved every
+    save_every updates or save_interval seconds, call save to write the rest.
+    """
+
+    def __init__(
+        self,
+        folder: Path,
+        save_every: int = SAVE_EVERY,
+        save_interval: float = SAVE_INTERVAL,
+    ):
+        self.path = folder / CACHE_FILENAME
+        self.save_every = save_every
+        self.save_interval = save_interval
+        self._objects: dict[str, CachedObject] = self._load()
+        self._unsaved = 0
+        self._saved_at = time.monotonic()
+
+    def _load(self) -> dict[str, CachedObject]:
+        if not self.path.is_file():
+            return {}
+        try:
+            with open(self.path, encoding="utf-8") as f:
+                return {key: CachedObject(**value) for key, value in json.load(f).items()}
+        except (json.JSONDecodeError, TypeError) as e:
+            logging.warning("Ignoring corrupted cache %s: %s", self.path, e)
+            return {}
+
+    def __len__(self) -> int:
+        return len(self._objects)
+
+    def is_fresh(self, key: str, etag: str, size: int, local_path: Path) -> bool:
+        cached = self._objects.get(key)
+        if cached is None or cached.etag != etag or cached.size != size:
+            return False
+        try:
+            stat = local_path.stat()
+        except FileNotFoundError:
+            return False
+        return stat.st_size == cached.size and stat.st_mtime == cached.mtime
+
+    def update(self, key: str, etag: str, size: int, local_path: Path) -> None:
+        self._objects[key] = CachedObject(
+            etag=etag, size=size, mtime=local_path.stat().st_mtime
+        )
+        self._unsaved += 1
+        if (
+            self._unsaved >= self.save_every
+            or time.monotonic() - self._saved_at >= self.save_interval
+        ):
+            self.save()
+
+    def save(self) -> None:
+        tmp_path = self.path.with_suffix(".tmp")
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({key: asdict(value) for key, value in self._objects.items()}, f)
+        os.replace(tmp_path, self.path)
+        self._unsaved = 0
+        self._saved_at = time.monotonic()
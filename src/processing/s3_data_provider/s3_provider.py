@@ -1,10 +1,19 @@
 import boto3
+from boto3.s3.transfer import TransferConfig
+from botocore.config import Config
+from botocore.exceptions import ClientError
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from dotenv import load_dotenv
 from pathlib import Path
+import io
 import os
-from typing import Generator
+from typing import Generator, Iterable, Optional
 from dataclasses import dataclass
 import logging
+import numpy as np
+from processing import metrics
+from processing.services.audio_split import read_wav_info, segment_byte_ranges
+from processing.s3_data_provider.object_cache import ObjectCache
 
 logging.basicConfig(format="%(asctime)s - %(message)s", level=logging.INFO)
 
@@ -17,6 +26,18 @@ AUDIO_PREFIX = "masc/clean_train/audios"
 SUBTITLE_DOWNLOAD_PATH = Path.cwd().parent / "data" / "subtitles"
 AUDIO_DOWNLOAD_PATH = Path.cwd().parent / "data" / "audios"
 BUCKET_NAME = "arabic-speech-data"
+# connections shared by the download threads
+MAX_POOL_CONNECTIONS = 64
+# audios are large, download them in parallel parts
+AUDIO_TRANSFER_CONFIG = TransferConfig(
+    multipart_threshold=32 * 1024 * 1024,
+    multipart_chunksize=16 * 1024 * 1024,
+    max_concurrency=8,
+)
+# subtitles are small, one request each and the threads are used across files
+SUBTITLE_TRANSFER_CONFIG = TransferConfig(use_threads=False)
+# bytes read to find the wav data chunk, covers the fmt and usual metadata chunks
+WAV_HEADER_RANGE = 64 * 1024
 
 
 @dataclass(kw_only=True)
@@ -39,11 +60,102 @@ class AWSS3:
         # Create a resource
         self._s3 = self._session.resource("s3")
         self._bucket = self._s3.Bucket(self._s3_config.bucket_name)
+        # low level client shared by all download threads, clients are thread safe
+        self._client = self._session.client(
+            "s3", config=Config(max_pool_connections=MAX_POOL_CONNECTIONS)
+        )
 
     @property
     def folder_prefix(self) -> str:
         return self._s3_config.folder_prefix
 
+    def _download_file(
+        self, key: str, target_path: Path, transfer_config: Optional[TransferConfig]
+    ) -> Path:
+        with metrics.track("s3_transfer"):
+            self._client.download_file(
+                self._s3_config.bucket_name, key, str(target_path), Config=transfer_config
+            )
+        metrics.count("s3_transfer")
+        metrics.count_s3_bytes(target_path.stat().st_size)
+        return target_path
+
+    def _get_object(self, key: str, byte_range: Optional[str] = None) -> tuple[bytes, dict]:
+        kwargs = {} if byte_range is None else {"Range": byte_range}
+        with metrics.track("s3_transfer"):
+            response = self._client.get_object(
+                Bucket=self._s3_config.bucket_name, Key=key, **kwargs
+            )
+            content = response["Body"].read()
+        metrics.count("s3_transfer")
+        metrics.count_s3_bytes(len(content))
+        return content, response
+
+    def download_many(
+        self,
+        keys: Iterable[str],
+        target_dir: Path,
+        workers: int = 16,
+        transfer_config: Optional[TransferConfig] = None,
+    ) -> Generator[Path, None, None]:
+        """
+        Download many objects concurrently with a thread pool.
+        Objects failing to download are logged and skipped.
+        :param keys: keys of the objects to download.
+        :param target_dir: directory to download the objects to, named after the last part of the key.
+        :param workers: number of download threads.
+        :param transfer_config: boto3 transfer configuration of each download.
+        :return: generator of the downloaded paths, in completion order.
+        """
+        executor = ThreadPoolExecutor(workers)
+        try:
+            futures = {
+                executor.submit(
+                    self._download_file,
+                    key,
+                    target_dir / key.split("/")[-1],
+                    transfer_config,
+                ): key
+                for key in keys
+            }
+            for future in as_completed(futures):
+                try:
+                    yield future.result()
+                except ClientError as e:
+                    logging.error("Failed to download %s: %s", futures[future], e)
+        finally:
+            executor.shutdown(cancel_futures=True)
+
+    def read_object(self, key: str) -> io.BytesIO:
+        """
+        Read an object in memory.
+        :param key: key of the object.
+        :return: buffer with the object content.
+        """
+        content, _ = self._get_object(key)
+        return io.BytesIO(content)
+
+    def stream_many(
+        self, keys: Iterable[str], workers: int = 16
+    ) -> Generator[tuple[str, io.BytesIO], None, None]:
+        """
+        Read many objects in memory concurrently, nothing is written to disk.
+        Objects failing to download are logged and skipped.
+        :param keys: keys of the objects to read.
+        :param workers: number of download threads.
+        :return: generator of (key, buffer) pairs, in completion order.
+        """
+        executor = ThreadPoolExecutor(workers)
+        try:
+            futures = {executor.submit(self.read_object, key): key for key in keys}
+            for future in as_completed(futures):
+                try:
+                    yield futures[future], future.result()
+                except ClientError as e:
+                    logging.error("Failed to download %s: %s", futures[future], e)
+        finally:
+            executor.shutdown(cancel_futures=True)
+
 
 class S3AudioProvider(AWSS3):
     def __init__(self, s3_config: S3Config, audio_download_path: Path):
@@ -59,32 +171,179 @@ class S3AudioProvider(AWSS3):
         """
         target_path = self._audio_download_path / filename
         source_file = f"{self.folder_prefix}/{filename}"
-        self._bucket.download_file(source_file, target_path)
+        return self._download_file(source_file, target_path, AUDIO_TRANSFER_CONFIG)
+
+    def download_audios(
+        self, filenames: Iterable[str], workers: int = 4
+    ) -> Generator[Path, None, None]:
+        """
+        Download audio files concurrently, each one in parallel parts.
+        :param filenames: names of the audio files to download.
+        :param workers: number of files downloaded at the same time.
+        :return: generator of the downloaded paths, in completion order.
+        """
+        return self.download_many(
+            (f"{self.folder_prefix}/{filename}" for filename in filenames),
+            self._audio_download_path,
+            workers=workers,
+            transfer_config=AUDIO_TRANSFER_CONFIG,
+        )
+
+    def _read_range(self, key: str, offset: int, size: int) -> bytes:
+        content, _ = self._get_object(key, f"bytes={offset}-{offset + size - 1}")
+        return content
+
+    def _write_segment(
+        self, key: str, header: bytes, offset: int, size: int, target_path: Path
+    ) -> Path:
+        data = self._read_range(key, offset, size) if size else b""
+        with open(target_path, "wb") as f:
+            f.write(header)
+            f.write(data)
         return target_path
 
+    def split_remote(
+        self,
+        filename: str,
+        segment_filenames: Iterable[str],
+        starts: np.ndarray,
+        ends: np.ndarray,
+        output_dir: Path,
+        workers: int = 8,
+    ) -> Optional[int]:
+        """
+        Write wav segments of a remote PCM wav without downloading the whole recording.
+        The header is read once, then only the bytes of each segment are fetched
+        with concurrent ranged GETs. Segments are identical to split_audio_arrays ones.
+        Segments failing to download are logged and skipped.
+        :param filename: Name of the audio file.
+        :param segment_filenames: segment filenames without extension.
+        :param starts: segment start times in seconds.
+        :param ends: segment end times in seconds.
+        :param output_dir: directory to write the segments to.
+        :param workers: number of ranges fetched at the same time.
+        :return: number of segments written, None if the audio is not a PCM wav
+            or its data chunk is not in the first WAV_HEADER_RANGE bytes.
+        """
+        key = f"{self.folder_prefix}/{filename}"
+        head, response = self._get_object(key, f"bytes=0-{WAV_HEADER_RANGE - 1}")
+        # Content-Range: bytes 0-65535/total_size
+        total_size = int(response["ContentRange"].rsplit("/", 1)[1])
+        info = read_wav_info(head, total_size)
+        if info is None:
+            return None
+        offsets, sizes = segment_byte_ranges(info, starts, ends)
+        total = 0
+        with ThreadPoolExecutor(workers) as executor:
+            futures = {
+                executor.submit(
+                    self._write_segment,
+                    key,
+                    info.header(size),
+                    offset,
+                    size,
+                    output_dir / f"{segment_filename}.wav",
+                ): segment_filename
+                for segment_filename, offset, size in zip(
+                    segment_filenames, offsets.tolist(), sizes.tolist()
+                )
+            }
+            for future in as_completed(futures):
+                try:
+                    future.result()
+                    total += 1
+                except (ClientError, OSError) as e:
+                    logging.error("Failed to write segment %s: %s", futures[future], e)
+        return total
+
+    def read(self, filename: str) -> io.BytesIO:
+        """
+        Read a single audio file in memory, e.g. to split it without landing it on disk.
+        :param filename: Name of the audio file to read.
+        :return: buffer with the audio content.
+        """
+        return self.read_object(f"{self.folder_prefix}/{filename}")
+
 
 class S3SubtitleProvider(AWSS3):
     def __init__(self, s3_config: S3Config, subtitle_download_path: Path):
         super().__init__(s3_config)
         self._subtitle_download_path = subtitle_download_path
+        # etag and size of each subtitle, filled while listing
+        self._subtitle_objects: dict[str, tuple[str, int]] = {}
         # Get the list of subtitles
         self._subtitle_list: list[str] = self._get_subtitle_list()
         logging.info(f"Total number of subtitles: {len(self._subtitle_list)}")
+        self._cache = ObjectCache(subtitle_download_path)
 
     @property
     def subtitle_list(self) -> list[str]:
         return self._subtitle_list
 
-    def download_subtitles(self) -> Generator[Path, None, None]:
+    def _subtitle_path(self, subtitle: str) -> Path:
+        return self._subtitle_download_path / subtitle.split("/")[-1]
+
+    def download_subtitles(
+        self, workers: int = 1, skip_unchanged: bool = True
+    ) -> Generator[Path, None, None]:
         """
         Generator that yields the path to the downloaded subtitles.
+        :param workers: number of download threads, with more than one thread
+            subtitles are yielded in completion order.
+        :param skip_unchanged: don't download subtitles whose local copy matches
+            the etag and size listed on S3, their path is yielded first.
         :return: List of paths to downloaded subtitles.
         """
         print("Downloading subtitles...")
-        for subtitle in self._subtitle_list:
-            file_path = self._subtitle_download_path / subtitle.split("/")[-1]
-            self._bucket.download_file(subtitle, file_path)
-            yield file_path
+        subtitles = self._subtitle_list
+        if skip_unchanged:
+            subtitles = []
+            unchanged = []
+            for subtitle in self._subtitle_list:
+                file_path = self._subtitle_path(subtitle)
+                etag, size = self._subtitle_objects[subtitle]
+                if self._cache.is_fresh(subtitle, etag, size, file_path):
+                    unchanged.append(file_path)
+                else:
+                    subtitles.append(subtitle)
+            logging.info(
+                f"{len(unchanged)} subtitles unchanged, downloading {len(subtitles)}"
+            )
+            yield from unchanged
+        if workers > 1:
+            file_paths = self.download_many(
+                subtitles,
+                self._subtitle_download_path,
+                workers=workers,
+                transfer_config=SUBTITLE_TRANSFER_CONFIG,
+            )
+        else:
+            file_paths = self._download_serially(subtitles)
+        names = {subtitle.split("/")[-1]: subtitle for subtitle in subtitles}
+        try:
+            for file_path in file_paths:
+                subtitle = names[file_path.name]
+                self._cache.update(subtitle, *self._subtitle_objects[subtitle], file_path)
+                yield file_path
+        finally:
+            self._cache.save()
+
+    def stream_subtitles(
+        self, workers: int = 16
+    ) -> Generator[tuple[str, io.BytesIO], None, None]:
+        """
+        Generator that yields the subtitles in memory, without writing them to disk.
+        :param workers: number of download threads.
+        :return: generator of (filename, buffer) pairs, in completion order.
+        """
+        for subtitle, buffer in self.stream_many(self._subtitle_list, workers=workers):
+            yield subtitle.split("/")[-1], buffer
+
+    def _download_serially(self, subtitles: list[str]) -> Generator[Path, None, None]:
+        for subtitle in subtitles:
+            yield self._download_file(
+                subtitle, self._subtitle_path(subtitle), SUBTITLE_TRANSFER_CONFIG
+            )
 
     def _get_subtitle_list(self) -> list[str]:
         subtitle_list: list[str] = []
@@ -92,7 +351,9 @@ class S3SubtitleProvider(AWSS3):
         for page in self._bucket.objects.filter(
             Prefix=self._s3_config.folder_prefix
         ).pages():
-            [subtitle_list.append(o.key) for o in page]
+            for o in page:
+                subtitle_list.append(o.key)
+                self._subtitle_objects[o.key] = (o.e_tag, o.size)
             logging.info(f"Retrieved {len(subtitle_list)} subtitles")
         return subtitle_list
 
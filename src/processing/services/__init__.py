@@ -1,3 +1,6 @@
-from .vtt_split import vtt_split, folder_vtt_split
-from .clean_text import clean_text
-from .audio_split import split_audio_to_segments
+from .vtt_split import vtt_split, folder_vtt_split, iter_folder_vtt_split
+from .clean_text import clean_text, clean_text_batch, cached_clean_text
+from .audio_split import split_audio_to_segments, split_audio_arrays
+from .segment_manifest import SegmentManifest
+from .segment_table import SegmentTable
+from .cue_cache import CueCache
@@ -1,37 +1,236 @@
+from dataclasses import dataclass
+import io
+import mmap
 from pathlib import Path
-from typing import Optional, Tuple, Union
+import struct
+from typing import BinaryIO, Optional, Tuple, Union
 import logging
+import numpy as np
 from pydub import AudioSegment as PydubAudioSegment
 import pandas as pd
+from processing import metrics
 from processing.config import AudioSegment
 
 
 logger = logging.getLogger(__name__)
 logging.basicConfig(format="%(asctime)s - %(message)s", level=logging.INFO)
 
+WAVE_FORMAT_PCM = 0x0001
+WAVE_FORMAT_EXTENSIBLE = 0xFFFE
+ENGINES = ("auto", "mmap", "pydub")
+# in memory wav content, e.g. an object read from S3
+AudioBuffer = Union[bytes, bytearray, memoryview, BinaryIO]
+
+
+@dataclass
+class WavInfo:
+    """
+    Layout of a PCM wav file, enough to address its frames without decoding.
+    data_offset and data_size are in bytes.
+    """
+
+    channels: int
+    sample_rate: int
+    sample_width: int
+    data_offset: int
+    data_size: int
+
+    @property
+    def frame_width(self) -> int:
+        return self.channels * self.sample_width
+
+    @property
+    def n_frames(self) -> int:
+        return self.data_size // self.frame_width
+
+    def header(self, data_size: int) -> bytes:
+        """Canonical 44 bytes PCM header for a wav holding data_size bytes."""
+        return struct.pack(
+            "<4sI4s4sIHHIIHH4sI",
+            b"RIFF",
+            36 + data_size,
+            b"WAVE",
+            b"fmt ",
+            16,
+            WAVE_FORMAT_PCM,
+            self.channels,
+            self.sample_rate,
+            self.sample_rate * self.frame_width,
+            self.frame_width,
+            self.sample_width * 8,
+            b"data",
+            data_size,
+        )
+
+
+def read_wav_info(buffer, total_size: Optional[int] = None) -> Optional[WavInfo]:
+    """
+    Parse the RIFF chunks of a wav file.
+    Args:
+        buffer: bytes-like object starting at the beginning of the file (bytes, mmap, ...).
+        total_size: size of the whole file, defaults to len(buffer).
+            used to clamp the data chunk of truncated or streamed files.
+    Returns:
+        WavInfo if the file is integer PCM, None otherwise (e.g. float or compressed wav).
+    """
+    total_size = len(buffer) if total_size is None else total_size
+    if len(buffer) < 12 or buffer[0:4] != b"RIFF" or buffer[8:12] != b"WAVE":
+        return None
+    fmt = None
+    pos = 12
+    while pos + 8 <= len(buffer):
+        chunk_id = bytes(buffer[pos : pos + 4])
+        (chunk_size,) = struct.unpack_from("<I", buffer, pos + 4)
+        if chunk_id == b"fmt " and chunk_size >= 16:
+            fmt = struct.unpack_from("<HHIIHH", buffer, pos + 8)
+            if fmt[0] == WAVE_FORMAT_EXTENSIBLE and chunk_size >= 40:
+                # the sub format GUID starts with the actual format tag
+                (sub_format,) = struct.unpack_from("<H", buffer, pos + 32)
+                fmt = (sub_format, *fmt[1:])
+        elif chunk_id == b"data":
+            if fmt is None or fmt[0] != WAVE_FORMAT_PCM or fmt[5] % 8:
+                return None
+            data_offset = pos + 8
+            return WavInfo(
+                channels=fmt[1],
+                sample_rate=fmt[2],
+                sample_width=fmt[5] // 8,
+                data_offset=data_offset,
+                data_size=min(chunk_size, total_size - data_offset),
+            )
+        # chunks are word aligned
+        pos += 8 + chunk_size + (chunk_size & 1)
+    return None
+
+
+def segment_frame_bounds(
+    info: WavInfo, starts: np.ndarray, ends: np.ndarray
+) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Compute the frame range of every segment at once.
+    Times are truncated to milliseconds then converted to frames,
+    the same way pydub slices, so both engines cut identical samples.
+    Args:
+        info: wav layout
+        starts: segment start times in seconds
+        ends: segment end times in seconds
+    Returns:
+        start and end frame indices, clamped to the audio length.
+    """
+    frames_per_ms = info.sample_rate / 1000.0
+    start_ms = (np.asarray(starts, dtype=np.float64) * 1000).astype(np.int64)
+    end_ms = (np.asarray(ends, dtype=np.float64) * 1000).astype(np.int64)
+    start_frames = (start_ms * frames_per_ms).astype(np.int64)
+    end_frames = (end_ms * frames_per_ms).astype(np.int64)
+    np.clip(start_frames, 0, info.n_frames, out=start_frames)
+    np.clip(end_frames, start_frames, info.n_frames, out=end_frames)
+    return start_frames, end_frames
+
+
+def segment_byte_ranges(
+    info: WavInfo, starts: np.ndarray, ends: np.ndarray
+) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Compute the byte range of every segment in the wav file.
+    Args:
+        info: wav layout
+        starts: segment start times in seconds
+        ends: segment end times in seconds
+    Returns:
+        offsets from the beginning of the file and sizes of the segments data.
+    """
+    start_frames, end_frames = segment_frame_bounds(info, starts, ends)
+    offsets = info.data_offset + start_frames * info.frame_width
+    sizes = (end_frames - start_frames) * info.frame_width
+    return offsets, sizes
+
+
+def _write_wav_segments(
+    buffer,
+    total_size: int,
+    filenames: np.ndarray,
+    starts: np.ndarray,
+    ends: np.ndarray,
+    output_dir: Path,
+) -> Optional[int]:
+    """
+    Cut segments out of PCM wav content without decoding it.
+    Each segment is written as a header followed by a view of the data.
+    Returns:
+        number of segments written, None if the content is not PCM.
+    """
+    info = read_wav_info(buffer, total_size)
+    if info is None:
+        return None
+    offsets, sizes = segment_byte_ranges(info, starts, ends)
+    total = 0
+    with memoryview(buffer) as view:
+        for filename, offset, size in zip(filenames, offsets.tolist(), sizes.tolist()):
+            filename = f"{filename}.wav"
+            try:
+                with open(output_dir / filename, "wb") as out:
+                    out.write(info.header(size))
+                    out.write(view[offset : offset + size])
+                total += 1
+            except OSError as e:
+                logger.error("%s with filename: %s", e, filename)
+    return total
+
+
+def _split_wav(
+    audio_path: Path,
+    filenames: np.ndarray,
+    starts: np.ndarray,
+    ends: np.ndarray,
+    output_dir: Path,
+) -> Optional[int]:
+    """
+    Cut segments out of a PCM wav file, the file is memory mapped.
+    Returns:
+        number of segments written, None if the file is not PCM.
+    """
+    with open(audio_path, "rb") as f:
+        file_size = f.seek(0, 2)
+        if file_size == 0:
+            return None
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+            return _write_wav_segments(
+                mapped, file_size, filenames, starts, ends, output_dir
+            )
+
+
+def _buffer_bytes(audio: AudioBuffer) -> Union[bytes, bytearray, memoryview]:
+    if isinstance(audio, io.BytesIO):
+        # view of the BytesIO content without copying it
+        return audio.getbuffer()
+    if hasattr(audio, "read"):
+        return audio.read()
+    return audio
+
 
 def _split_audio(
     audio: PydubAudioSegment,
-    segment_series: pd.Series,
+    segment_filename: str,
+    segment_start: float,
+    segment_end: float,
     output_dir: Path,
     extension: str = "mp3",
 ) -> int:
     """
-    Split an audio file to multiple segments.
+    Export a single segment of a decoded audio.
     Args:
-        audio: audio file path or AudioSegment object, if audio path, audio_dir must be provided.
-        segment_series: pandas series with the following columns:
-            - segment_filename
-            - segment_start
-            - segment_end
+        audio: decoded AudioSegment object.
+        segment_filename: segment filename without extension.
+        segment_start: segment start in seconds.
+        segment_end: segment end in seconds.
         output_dir: output directory to save the new audio files.
         extension: audio file extension.
     Returns:
-        True if the audio was split successfully, False otherwise.
+        1 if the segment was exported successfully, 0 otherwise.
     """
-    start = int(segment_series.segment_start * 1000)
-    end = int(segment_series.segment_end * 1000)
-    filename = f"{segment_series.segment_filename}.{extension}"
+    start = int(segment_start * 1000)
+    end = int(segment_end * 1000)
+    filename = f"{segment_filename}.{extension}"
     try:
         seg = audio[start:end]
         seg.export(output_dir / filename, format=extension)
@@ -41,21 +240,111 @@ def _split_audio(
         return 0
 
 
-def split_audio_to_segments(
-    audio: Union[Path, PydubAudioSegment],
-    audio_segments: pd.DataFrame,
+def split_audio_arrays(
+    audio: Union[Path, AudioBuffer, PydubAudioSegment],
+    filenames: np.ndarray,
+    starts: np.ndarray,
+    ends: np.ndarray,
     output_dir: Path,
     extension: str = "mp3",
+    engine: str = "auto",
 ) -> int:
-    total = 0
+    """
+    Split an audio file to segments described by column arrays.
+    Args:
+        audio: audio file path, wav content (bytes or a binary file-like object)
+            or AudioSegment object.
+        filenames: segment filenames without extension.
+        starts: segment start times in seconds.
+        ends: segment end times in seconds.
+        output_dir: output directory to save the new audio files.
+        extension: audio file extension.
+        engine: "mmap" cuts PCM wav files and buffers without decoding them, only when exporting to wav.
+            "pydub" decodes the whole file and re-exports each segment.
+            "auto" uses mmap when possible and falls back to pydub otherwise.
+    Returns:
+        number of segments exported successfully.
+    """
+    with metrics.track("segment_export"):
+        total = _split_audio_arrays(
+            audio, filenames, starts, ends, output_dir, extension, engine
+        )
+    # _split_audio logs and skips the segments it fails to export
+    metrics.count("segment_export", items=total, failures=len(filenames) - total)
+    return total
+
+
+def _split_audio_arrays(
+    audio: Union[Path, AudioBuffer, PydubAudioSegment],
+    filenames: np.ndarray,
+    starts: np.ndarray,
+    ends: np.ndarray,
+    output_dir: Path,
+    extension: str,
+    engine: str,
+) -> int:
+    if engine not in ENGINES:
+        raise ValueError(f"engine should be one of {ENGINES}, got {engine}.")
     if isinstance(audio, Path):
         if not audio.exists():
             logger.error("Audio file %s does not exist.", audio)
             raise FileNotFoundError(f"Audio file {audio} does not exist.")
+        if engine != "pydub" and extension == "wav":
+            total = _split_wav(audio, filenames, starts, ends, output_dir)
+            if total is not None:
+                return total
+        if engine == "mmap":
+            raise ValueError(f"{audio} can't be split with mmap engine, not a PCM wav.")
         audio = PydubAudioSegment.from_wav(audio)
-    for _, series_segments in audio_segments.iterrows():
-        total += _split_audio(audio, series_segments, output_dir, extension)
+    elif not isinstance(audio, PydubAudioSegment):
+        content = _buffer_bytes(audio)
+        if engine != "pydub" and extension == "wav":
+            total = _write_wav_segments(
+                content, len(content), filenames, starts, ends, output_dir
+            )
+            if total is not None:
+                return total
+        if engine == "mmap":
+            raise ValueError("audio buffer can't be split with mmap engine, not a PCM wav.")
+        audio = PydubAudioSegment.from_wav(io.BytesIO(content))
+    elif engine == "mmap":
+        raise ValueError("mmap engine requires an audio file path or buffer.")
+    total = 0
+    for filename, start, end in zip(filenames, starts, ends):
+        total += _split_audio(audio, filename, start, end, output_dir, extension)
     return total
+
+
+def split_audio_to_segments(
+    audio: Union[Path, AudioBuffer, PydubAudioSegment],
+    audio_segments: pd.DataFrame,
+    output_dir: Path,
+    extension: str = "mp3",
+    engine: str = "auto",
+) -> int:
+    """
+    Split an audio file to the segments of a dataframe.
+    Args:
+        audio: audio file path, wav content or AudioSegment object.
+        audio_segments: dataframe with the following columns:
+            - segment_filename
+            - segment_start
+            - segment_end
+        output_dir: output directory to save the new audio files.
+        extension: audio file extension.
+        engine: see split_audio_arrays.
+    Returns:
+        number of segments exported successfully.
+    """
+    return split_audio_arrays(
+        audio=audio,
+        filenames=audio_segments.segment_filename.to_numpy(),
+        starts=audio_segments.segment_start.to_numpy(),
+        ends=audio_segments.segment_end.to_numpy(),
+        output_dir=output_dir,
+        extension=extension,
+        engine=engine,
+    )
     # total = 0
     # audio_segments, audio_dir, output_dir = data
     # # if isinstance(audio, (str, Path)):
@@ -1,4 +1,8 @@
+from typing import Union
+import pandas as pd
 from maha.cleaners.functions import normalize, keep
+from processing import metrics
+from processing.text_cleaning import cached_clean_text, clean_text_compiled
 
 
 def clean_text(text: str) -> str:
@@ -9,3 +13,25 @@ def clean_text(text: str) -> str:
     text = normalize(text, alef=True)
     text = keep(text, arabic_letters=True)
     return text
+
+
+def clean_text_batch(
+    texts: Union[pd.Series, list[str]], dedupe: bool = True
+) -> Union[pd.Series, list[str]]:
+    """
+    Clean many texts at once, the output is the same as applying clean_text to each one.
+    Args:
+        texts: pandas Series or list of texts
+        dedupe: look texts up in the cached_clean_text cache, so repeated
+            texts are cleaned once
+    Returns:
+        cleaned texts, a Series with the same index if texts is a Series, a list otherwise.
+    """
+    clean = cached_clean_text if dedupe else clean_text_compiled
+    with metrics.track("clean_text"):
+        if isinstance(texts, pd.Series):
+            cleaned = texts.map(clean)
+        else:
+            cleaned = [clean(text) for text in texts]
+    metrics.count("clean_text", items=len(texts))
+    return cleaned
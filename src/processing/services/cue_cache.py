@@ -0,0 +1,223 @@
+from dataclasses import dataclass
+from pathlib import Path
+from tempfile import TemporaryDirectory
+from typing import Iterable, Optional
+import hashlib
+import logging
+import os
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+
+CUE_CACHE_FILENAME = ".cues.parquet"
+CUE_CACHE_SCHEMA = pa.schema(
+    [
+        ("filename", pa.string()),
+        ("parser", pa.string()),
+        ("size", pa.int64()),
+        ("mtime_ns", pa.int64()),
+        ("hash", pa.string()),
+        ("starts", pa.list_(pa.float64())),
+        ("ends", pa.list_(pa.float64())),
+        ("texts", pa.list_(pa.string())),
+    ]
+)
+INDEX_COLUMNS = ["filename", "parser", "size", "mtime_ns", "hash"]
+# files per row group, cues are read one row group at a time
+ROW_GROUP_SIZE = 64
+# (starts, ends, texts) of a vtt file
+Cues = tuple[list[float], list[float], list[str]]
+# parquet file, row group and row of the cues of a file
+RowPosition = tuple[Path, int, int]
+
+
+def content_hash(path: Path) -> str:
+    with open(path, "rb") as f:
+        return hashlib.blake2b(f.read(), digest_size=16).hexdigest()
+
+
+@dataclass(frozen=True)
+class CueFile:
+    """Size, mtime and content hash of a vtt file when it was looked up."""
+
+    path: Path
+    size: int
+    mtime_ns: int
+    digest: str
+
+
+class CueCache:
+    """
+    Parsed cues of the vtt files of a folder, stored in a single parquet file.
+    Cues are addressed by the hash of the file content and the parser that
+    produced them, a file whose size and mtime didn't change is not hashed
+    again, a modified file is hashed and parsed again only if its content changed.
+    Only the size, mtime and hash of the files are loaded, the cues are read
+    from disk one row group at a time when they are looked up, and the cues
+    added by put are spilled to temporary parquet files, so memory doesn't grow
+    with the number of files. Call save to persist the cues added since loading.
+    """
+
+    def __init__(self, folder: Path, cache_path: Optional[Path] = None):
+        self.path = cache_path or folder / CUE_CACHE_FILENAME
+        self._reset()
+        if self.path.is_file():
+            self._load()
+
+    def _reset(self) -> None:
+        # (filename, parser) -> (size, mtime_ns, hash)
+        self._files: dict[tuple[str, str], tuple[int, int, str]] = {}
+        # (hash, parser) -> position of the cues on disk
+        self._rows: dict[tuple[str, str], RowPosition] = {}
+        # cues added by put and not spilled yet
+        self._added: dict[tuple[str, str], Cues] = {}
+        self._spill_dir: Optional[TemporaryDirectory] = None
+        self._spilled = 0
+        # last row group read and its columns
+        self._row_group: Optional[tuple[Path, int]] = None
+        self._row_group_columns: dict = {}
+        self._changed = False
+
+    def _load(self) -> None:
+        try:
+            parquet_file = pq.ParquetFile(self.path)
+            columns = parquet_file.read(columns=INDEX_COLUMNS).to_pydict()
+        except (pa.ArrowInvalid, OSError, KeyError) as e:
+            # KeyError: written by a version without some column
+            logging.warning("Ignoring unreadable cue cache %s: %r", self.path, e)
+            return
+        positions = [
+            (self.path, group, row)
+            for group in range(parquet_file.num_row_groups)
+            for row in range(parquet_file.metadata.row_group(group).num_rows)
+        ]
+        rows = zip(*(columns[name] for name in INDEX_COLUMNS), positions)
+        for filename, parser, size, mtime_ns, digest, position in rows:
+            self._files[filename, parser] = (size, mtime_ns, digest)
+            self._rows[digest, parser] = position
+
+    def __len__(self) -> int:
+        return len(self._files)
+
+    def _contains(self, key: tuple[str, str]) -> bool:
+        return key in self._rows or key in self._added
+
+    def _read(self, key: tuple[str, str]) -> Cues:
+        if key in self._added:
+            return self._added[key]
+        path, group, row = self._rows[key]
+        if self._row_group != (path, group):
+            table = pq.ParquetFile(path).read_row_group(
+                group, columns=["starts", "ends", "texts"]
+            )
+            self._row_group = (path, group)
+            self._row_group_columns = table.to_pydict()
+        columns = self._row_group_columns
+        return columns["starts"][row], columns["ends"][row], columns["texts"][row]
+
+    def get(self, vtt_path: Path, parser: str) -> tuple[Optional[Cues], CueFile]:
+        """
+        Cached cues of a vtt file.
+        Returns:
+            the cues, None if the file content was never parsed with parser,
+            and the state of the file to give to put.
+        """
+        stat = vtt_path.stat()
+        cached = self._files.get((vtt_path.name, parser))
+        if cached is not None and cached[:2] == (stat.st_size, stat.st_mtime_ns):
+            file = CueFile(vtt_path, stat.st_size, stat.st_mtime_ns, cached[2])
+            return self._read((file.digest, parser)), file
+        file = CueFile(vtt_path, stat.st_size, stat.st_mtime_ns, content_hash(vtt_path))
+        key = (file.digest, parser)
+        if not self._contains(key):
+            return None, file
+        self._files[vtt_path.name, parser] = (file.size, file.mtime_ns, file.digest)
+        self._changed = True
+        return self._read(key), file
+
+    def put(self, file: CueFile, parser: str, cues: Optional[Cues] = None) -> bool:
+        """
+        Add the cues parsed from a file looked up with get, e.g. in another process.
+        Args:
+            cues: None when get found them, only the state of the file is updated
+        Returns:
+            False when the file changed since get, or cues is None and the
+            file content is unknown, nothing is cached.
+        """
+        key = (file.digest, parser)
+        if cues is None and not self._contains(key):
+            return False
+        stat = file.path.stat()
+        if (stat.st_size, stat.st_mtime_ns) != (file.size, file.mtime_ns):
+            logging.warning("%s changed while it was parsed, not caching it", file.path)
+            return False
+        state = (file.size, file.mtime_ns, file.digest)
+        if cues is None and self._files.get((file.path.name, parser)) == state:
+            return True
+        self._files[file.path.name, parser] = state
+        if cues is not None and not self._contains(key):
+            self._added[key] = cues
+            if len(self._added) >= ROW_GROUP_SIZE:
+                self._spill()
+        self._changed = True
+        return True
+
+    def _spill(self) -> None:
+        """Write the added cues to a temporary parquet file."""
+        if self._spill_dir is None:
+            self._spill_dir = TemporaryDirectory(prefix="cue_cache_")
+        path = Path(self._spill_dir.name) / f"{self._spilled}.parquet"
+        keys = list(self._added)
+        # only the cues of spilled rows are read, save writes the file states
+        rows = [
+            ("", parser, 0, 0, digest, *self._added[digest, parser])
+            for digest, parser in keys
+        ]
+        pq.write_table(_table(rows), path)
+        for row, key in enumerate(keys):
+            self._rows[key] = (path, 0, row)
+        self._added = {}
+        self._spilled += 1
+
+    def prune(self, filenames: Iterable[str]) -> None:
+        """Forget the files that are not in filenames, e.g. deleted from the folder."""
+        filenames = set(filenames)
+        removed = [key for key in self._files if key[0] not in filenames]
+        for key in removed:
+            del self._files[key]
+        if removed:
+            self._changed = True
+
+    def save(self) -> None:
+        """Write the cache if it changed, atomically, one row group at a time."""
+        if not self._changed:
+            return
+        tmp_path = self.path.with_name(self.path.name + ".tmp")
+        with pq.ParquetWriter(tmp_path, CUE_CACHE_SCHEMA) as writer:
+            rows = []
+            for (filename, parser), (size, mtime_ns, digest) in sorted(
+                self._files.items()
+            ):
+                cues = self._read((digest, parser))
+                rows.append((filename, parser, size, mtime_ns, digest, *cues))
+                if len(rows) == ROW_GROUP_SIZE:
+                    writer.write_table(_table(rows))
+                    rows = []
+            if rows or not self._files:
+                writer.write_table(_table(rows))
+        os.replace(tmp_path, self.path)
+        if self._spill_dir is not None:
+            self._spill_dir.cleanup()
+        self._reset()
+        self._load()
+
+
+def _table(rows: list[tuple]) -> pa.Table:
+    columns = list(zip(*rows)) if rows else [[] for _ in CUE_CACHE_SCHEMA]
+    return pa.Table.from_arrays(
+        [
+            pa.array(column, type=field.type)
+            for column, field in zip(columns, CUE_CACHE_SCHEMA)
+        ],
+        schema=CUE_CACHE_SCHEMA,
+    )
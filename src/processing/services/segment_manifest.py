@@ -0,0 +1,171 @@
+from multiprocessing import Pool
+from pathlib import Path
+from typing import Optional, Sequence
+import hashlib
+import json
+import logging
+import os
+import zlib
+import numpy as np
+
+
+logger = logging.getLogger(__name__)
+logging.basicConfig(format="%(asctime)s - %(message)s", level=logging.INFO)
+
+MANIFEST_FILENAME = ".manifest.jsonl"
+CHUNK_SIZE = 1 << 20
+
+
+def file_checksum(path: Path) -> str:
+    """crc32 of a file as an 8 characters hex string."""
+    crc = 0
+    with open(path, "rb") as f:
+        while chunk := f.read(CHUNK_SIZE):
+            crc = zlib.crc32(chunk, crc)
+    return f"{crc:08x}"
+
+
+def segment_record(path: Path) -> dict:
+    """Manifest record of an exported segment file."""
+    return {
+        "segment_filename": path.stem,
+        "size": path.stat().st_size,
+        "checksum": file_checksum(path),
+    }
+
+
+def segments_digest(
+    filenames: Sequence[str], starts: np.ndarray, ends: np.ndarray
+) -> str:
+    """Hash of the segments requested for an audio, changes with any name or bound."""
+    digest = hashlib.blake2b(digest_size=16)
+    digest.update("\n".join(filenames).encode())
+    digest.update(np.ascontiguousarray(starts, dtype=np.float64).tobytes())
+    digest.update(np.ascontiguousarray(ends, dtype=np.float64).tobytes())
+    return digest.hexdigest()
+
+
+def _verify_audio(task: tuple) -> Optional[str]:
+    """Returns the audio name if one of its segments is missing or changed."""
+    audio_name, output_dir, extension, records = task
+    for record in records:
+        path = output_dir / f"{record['segment_filename']}.{extension}"
+        if not path.is_file() or path.stat().st_size != record["size"]:
+            return audio_name
+        if file_checksum(path) != record["checksum"]:
+            return audio_name
+    return None
+
+
+class SegmentManifest:
+    """
+    Append only log of the audio files whose segments were all exported.
+    Each line is a json object holding the audio name, the segments_digest of
+    the requested segments and the filename, size and checksum of its segments,
+    it lives inside the segments folder.
+    """
+
+    def __init__(self, output_dir: Path, extension: str = "wav"):
+        self.output_dir = output_dir
+        self.extension = extension
+        self.path = output_dir / MANIFEST_FILENAME
+        self._completed: dict[str, list[dict]] = {}
+        self._digests: dict[str, Optional[str]] = {}
+        self._load()
+
+    def _load(self) -> None:
+        if not self.path.is_file():
+            return
+        with open(self.path, "rb+") as f:
+            data = f.read()
+            end = data.rfind(b"\n") + 1
+            if end < len(data):
+                # last line of an interrupted run, the next add starts a new line
+                logger.warning("Removing truncated last line of %s", self.path)
+                f.truncate(end)
+        for line in data[:end].decode("utf-8").splitlines():
+            try:
+                entry = json.loads(line)
+            except json.JSONDecodeError:
+                logger.warning("Skipping corrupted line in %s", self.path)
+                continue
+            self._completed[entry["audio_filename"]] = entry["segments"]
+            self._digests[entry["audio_filename"]] = entry.get("digest")
+
+    def __len__(self) -> int:
+        return len(self._completed)
+
+    def __contains__(self, audio_name: str) -> bool:
+        return audio_name in self._completed
+
+    def is_complete(
+        self, audio_name: str, filenames: Sequence[str], digest: str
+    ) -> bool:
+        """
+        Whether the audio was exported with exactly the requested segments,
+        an audio recorded with other segments (e.g. other vtt_split parameters) is not.
+        Args:
+            audio_name: audio filename
+            filenames: requested segment filenames
+            digest: segments_digest of the requested segments
+        """
+        if audio_name not in self._completed:
+            return False
+        if self._digests[audio_name] is None:
+            # recorded without a digest, only the segment names can be compared
+            recorded = [
+                record["segment_filename"] for record in self._completed[audio_name]
+            ]
+            return recorded == list(filenames)
+        return self._digests[audio_name] == digest
+
+    def add(
+        self, audio_name: str, segments: list[dict], digest: Optional[str] = None
+    ) -> None:
+        """
+        Record an audio whose segments were all exported.
+        Args:
+            audio_name: audio filename
+            segments: segment_record of each segment
+            digest: segments_digest of the requested segments
+        """
+        entry = {"audio_filename": audio_name, "digest": digest, "segments": segments}
+        with open(self.path, "a", encoding="utf-8") as f:
+            f.write(json.dumps(entry, ensure_ascii=False) + "\n")
+        self._completed[audio_name] = segments
+        self._digests[audio_name] = digest
+
+    def verify(self, workers: int = 1) -> list[str]:
+        """
+        Re-check the size and checksum of every recorded segment.
+        Args:
+            workers: number of processes used to compute the checksums.
+        Returns:
+            names of the audios with missing or changed segments.
+        """
+        tasks = [
+            (audio_name, self.output_dir, self.extension, segments)
+            for audio_name, segments in self._completed.items()
+        ]
+        if workers > 1:
+            with Pool(workers) as pool:
+                results = pool.map(_verify_audio, tasks, chunksize=64)
+        else:
+            results = map(_verify_audio, tasks)
+        return [audio_name for audio_name in results if audio_name is not None]
+
+    def invalidate(self, audio_names: list[str]) -> None:
+        """Forget the given audios so they are exported again, rewrites the manifest."""
+        for audio_name in audio_names:
+            self._completed.pop(audio_name, None)
+            self._digests.pop(audio_name, None)
+        tmp_path = self.path.with_suffix(".tmp")
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            for audio_name, segments in self._completed.items():
+                entry = {
+                    "audio_filename": audio_name,
+                    "digest": self._digests[audio_name],
+                    "segments": segments,
+                }
+                f.write(json.dumps(entry, ensure_ascii=False) + "\n")
+        os.replace(tmp_path, self.path)
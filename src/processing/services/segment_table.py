@@ -0,0 +1,89 @@
+from dataclasses import dataclass
+from typing import Iterable
+import numpy as np
+import pandas as pd
+from processing.config import Audio
+from processing.db.models import DURATION_DECIMALS, masc_document
+from processing.services.clean_text import clean_text_batch
+
+
+@dataclass
+class SegmentTable:
+    """
+    Segments of many audios in columnar form, one row per segment.
+    start and end are in seconds.
+    Used instead of one AudioSegment object per segment when millions are built.
+    """
+
+    audio_filenames: list[str]
+    filenames: list[str]
+    texts: list[str]
+    starts: np.ndarray
+    ends: np.ndarray
+    sources: list[str]
+
+    def __len__(self) -> int:
+        return len(self.filenames)
+
+    @property
+    def durations(self) -> np.ndarray:
+        return self.ends - self.starts
+
+    @staticmethod
+    def from_audios(audios: Iterable[Audio]) -> "SegmentTable":
+        audio_filenames, filenames, texts, starts, ends, sources = [], [], [], [], [], []
+        for audio in audios:
+            audio_filenames.extend([audio.filename] * len(audio.segments))
+            for segment in audio.segments:
+                filenames.append(segment.filename)
+                texts.append(segment.text)
+                starts.append(segment.start)
+                ends.append(segment.end)
+                sources.append(segment.source.value)
+        return SegmentTable(
+            audio_filenames=audio_filenames,
+            filenames=filenames,
+            texts=texts,
+            starts=np.array(starts, dtype=np.float64),
+            ends=np.array(ends, dtype=np.float64),
+            sources=sources,
+        )
+
+    def take(self, rows: np.ndarray) -> "SegmentTable":
+        """Rows selected by a boolean mask or indices."""
+        indices = np.arange(len(self))[rows].tolist()
+        return SegmentTable(
+            audio_filenames=[self.audio_filenames[i] for i in indices],
+            filenames=[self.filenames[i] for i in indices],
+            texts=[self.texts[i] for i in indices],
+            starts=self.starts[indices],
+            ends=self.ends[indices],
+            sources=[self.sources[i] for i in indices],
+        )
+
+    def to_dataframe(self) -> pd.DataFrame:
+        """Dataframe with the columns of masc_processing.audio_to_dataframe."""
+        return pd.DataFrame(
+            {
+                "audio_filename": self.audio_filenames,
+                "segment_filename": self.filenames,
+                "segment_text": self.texts,
+                "segment_start": self.starts,
+                "segment_end": self.ends,
+                "segment_duration": self.durations,
+                "source": self.sources,
+            }
+        )
+
+    def masc_documents(self, clean_text: bool = True) -> list[dict]:
+        """
+        Segment documents of the MASC collections, same as MASCAudio.dict()
+        without building a MASCAudio per segment.
+        """
+        texts = clean_text_batch(self.texts) if clean_text else self.texts
+        # times are whole milliseconds, far from rounding ties, np.round matches round
+        durations = np.round(self.durations, DURATION_DECIMALS).tolist()
+        return [
+            masc_document(filename, text, duration)
+            for filename, text, duration in zip(self.filenames, texts, durations)
+        ]
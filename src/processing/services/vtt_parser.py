@@ -0,0 +1,157 @@
+from contextlib import contextmanager
+from dataclasses import dataclass
+from pathlib import Path
+from typing import BinaryIO, Iterable, Iterator, Optional, TextIO, Union
+import io
+import os
+import re
+import numpy as np
+
+
+TIMING_PATTERN = re.compile(
+    r"\s*((?:\d+:)?\d{2}:\d{2}.\d{3})\s*-->\s*((?:\d+:)?\d{2}:\d{2}.\d{3})"
+)
+CUE_TAGS_PATTERN = re.compile("<.*?>")
+COMMENT_PATTERN = re.compile(r"NOTE(?:\s.+|$)")
+STYLE_PATTERN = re.compile(r"STYLE[ \t]*$")
+
+# a vtt file path (str or Path), its content as bytes, or a file-like object
+# with its content; text content must be wrapped, e.g. in io.StringIO
+VttSource = Union[Path, str, bytes, bytearray, BinaryIO, TextIO]
+
+
+@dataclass
+class VttCues:
+    """
+    Cues of a vtt file in columnar form.
+    starts and ends are in seconds.
+    """
+
+    starts: np.ndarray
+    ends: np.ndarray
+    texts: list[str]
+
+    def __len__(self) -> int:
+        return len(self.texts)
+
+
+def _timestamp_to_seconds(timestamp: str) -> float:
+    *hours, minutes, seconds = timestamp.split(":")
+    hours = int(hours[0]) if hours else 0
+    # same operations order as webvtt-py so both parsers give identical floats
+    return hours * 3600 + int(minutes) * 60 + int(seconds[:2]) + int(seconds[3:6]) / 1000
+
+
+class _CueReader:
+    """
+    Block based reader following the webvtt-py parsing rules:
+    blocks are separated by empty lines, the first block is the file header,
+    a cue block has a timing line as one of its first two lines,
+    NOTE and STYLE blocks are ignored.
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+        self.starts: list[float] = []
+        self.ends: list[float] = []
+        self.texts: list[str] = []
+
+    def read(self, lines: Iterable[str]) -> VttCues:
+        lines = iter(lines)
+        header = next(lines, "").rstrip("\n\r")
+        if not header.startswith("WEBVTT"):
+            raise ValueError(f"{self.name} is not a valid vtt file.")
+        block = [header]
+        is_header = True
+        for line in lines:
+            line = line.rstrip("\n\r")
+            if line:
+                if block or line.strip():
+                    block.append(line)
+            elif block:
+                if not is_header:
+                    self._read_block(block)
+                is_header = False
+                block = []
+        if block and not is_header:
+            self._read_block(block)
+        return VttCues(
+            starts=np.array(self.starts, dtype=np.float64),
+            ends=np.array(self.ends, dtype=np.float64),
+            texts=self.texts,
+        )
+
+    def _read_block(self, block: list[str]) -> None:
+        if "-->" in block[0] or (len(block) > 1 and "-->" in block[1]):
+            self._read_cue(block)
+        elif COMMENT_PATTERN.match(block[0]) or STYLE_PATTERN.match(block[0]):
+            return
+        else:
+            raise ValueError(f"{self.name}: missing timing in block {block[0]!r}.")
+
+    def _read_cue(self, block: list[str]) -> None:
+        timing = None
+        text_lines = []
+        for index, line in enumerate(block):
+            if "-->" in line:
+                if timing is not None:
+                    # a second timing line starts a new cue without a blank line
+                    self._append(timing, text_lines)
+                    text_lines = []
+                timing = TIMING_PATTERN.match(line)
+                if timing is None:
+                    raise ValueError(f"{self.name}: invalid timing {line!r}.")
+            elif index > 0:
+                text_lines.append(line)
+        self._append(timing, text_lines)
+
+    def _append(self, timing: re.Match, text_lines: list[str]) -> None:
+        text = "\n".join(text_lines)
+        if "<" in text:
+            text = CUE_TAGS_PATTERN.sub("", text)
+        self.starts.append(_timestamp_to_seconds(timing.group(1)))
+        self.ends.append(_timestamp_to_seconds(timing.group(2)))
+        self.texts.append(text)
+
+
+def is_vtt_path(vtt: VttSource) -> bool:
+    """A str is always a path, content is given as bytes or a file-like object."""
+    return isinstance(vtt, (str, os.PathLike))
+
+
+@contextmanager
+def open_vtt(vtt: VttSource) -> Iterator[TextIO]:
+    """
+    Open a vtt source as text decoded like webvtt-py does,
+    utf-8 with an optional BOM and universal newlines.
+    Args:
+        vtt: path to vtt file, its content as bytes, or a binary or text
+            file-like object
+    Returns:
+        context manager of a text stream
+    """
+    if is_vtt_path(vtt):
+        with open(vtt, encoding="utf-8-sig") as f:
+            yield f
+        return
+    content = vtt.read() if hasattr(vtt, "read") else vtt
+    if not isinstance(content, str):
+        content = bytes(content).decode("utf-8-sig")
+    yield io.StringIO(content, newline=None)
+
+
+def parse_vtt(vtt: VttSource, name: Optional[str] = None) -> VttCues:
+    """
+    Read the cues of a vtt file in a single streaming pass.
+    Gives the same start, end and text values as webvtt-py.
+    Args:
+        vtt: path to vtt file, its content as bytes or a file-like object
+            (e.g. an S3 body)
+        name: name used in error messages, defaults to the path
+    Returns:
+        VttCues
+    """
+    if name is None:
+        name = str(vtt) if is_vtt_path(vtt) else "<buffer>"
+    with open_vtt(vtt) as f:
+        return _CueReader(name).read(f)
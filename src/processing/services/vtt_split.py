@@ -1,25 +1,60 @@
+from contextlib import nullcontext
+from functools import partial
+from multiprocessing import Pool
 from pathlib import Path
-from typing import Optional, Tuple
+from typing import Callable, Generator, Optional, Tuple, TypeVar
+import logging
+import numpy as np
 import webvtt
 from tqdm import tqdm
+from processing import metrics
 from processing.config import Audio, AudioSegment, SourceEnum
+from processing.services.cue_cache import CueCache, CueFile, Cues
+from processing.services.vtt_parser import VttSource, is_vtt_path, open_vtt, parse_vtt
 
 
 MIN_CAPTION_DURATION = 0.75
 MAX_CAPTION_DURATION = 11.0
+PARSERS = ("webvtt", "native")
+ENGINES = ("python", "numpy")
+T = TypeVar("T")
+
+
+def _read_cues(vtt_source: VttSource, parser: str) -> Tuple[list, list, list]:
+    """Read the start, end and text of every caption of a vtt file or buffer."""
+    if parser == "native":
+        cues = parse_vtt(vtt_source)
+        return cues.starts.tolist(), cues.ends.tolist(), cues.texts
+    if parser == "webvtt":
+        if is_vtt_path(vtt_source):
+            vtt = webvtt.read(vtt_source)
+        else:
+            with open_vtt(vtt_source) as f:
+                vtt = webvtt.read_buffer(f)
+        return (
+            [caption.start_in_seconds for caption in vtt],
+            [caption.end_in_seconds for caption in vtt],
+            [caption.text for caption in vtt],
+        )
+    raise ValueError(f"parser should be one of {PARSERS}, got {parser}.")
 
 
 def _get_first_segment(
-    caption: webvtt.Caption, filename: str, max_duration=16.0, source=SourceEnum.MASC
+    start: float,
+    end: float,
+    text: str,
+    filename: str,
+    max_duration=16.0,
+    source=SourceEnum.MASC,
 ) -> Tuple[Optional[AudioSegment], bool]:
-    caption_duration = caption.end_in_seconds - caption.start_in_seconds
+    caption_duration = end - start
     if caption_duration > MAX_CAPTION_DURATION or caption_duration < MIN_CAPTION_DURATION:
         return None, True
     if caption_duration <= max_duration:
         current_segment = AudioSegment(
-            start=caption.start_in_seconds,
-            end=caption.end_in_seconds,
-            text=caption.text,
+            start=start,
+            end=end,
+            text=text,
             source=source,
             filename=f"{filename}_0",
         )
@@ -30,48 +65,37 @@ def _get_first_segment(
     return current_segment, create_new_segment
 
 
-def vtt_split(
-    vtt_path: Path,
-    min_duration: float = 6.0,
-    max_duration: float = 16.0,
-    threshold: float = 2.0,
-    source: SourceEnum = SourceEnum.MASC,
-) -> Audio:
-    """
-    Split a vtt file into audio segments
-
-    Args:
-        vtt_path: path to vtt file
-        min_duration: minimum duration of a segment
-        max_duration: maximum duration of a segment
-        threshold: threshold for splitting segments
-        source: source of the audio
-    Returns:
-        Audio object
-    """
-    vtt = webvtt.read(vtt_path)
-    filename = vtt_path.stem
+def _split_cues(
+    starts: list,
+    ends: list,
+    texts: list,
+    filename: str,
+    min_duration: float,
+    max_duration: float,
+    threshold: float,
+    source: SourceEnum,
+) -> list[AudioSegment]:
+    """Greedily merge consecutive captions into segments."""
     segments = []
-    caption_duration = vtt[0].end_in_seconds - vtt[0].start_in_seconds
     current_segment, create_new_segment = _get_first_segment(
-        vtt[0], filename, max_duration, source
+        starts[0], ends[0], texts[0], filename, max_duration, source
     )
-    for caption in vtt[1:]:
-        caption_duration = caption.end_in_seconds - caption.start_in_seconds
+    for start, end, text in zip(starts[1:], ends[1:], texts[1:]):
+        caption_duration = end - start
         if caption_duration > MAX_CAPTION_DURATION or caption_duration < MIN_CAPTION_DURATION:
             continue
         if create_new_segment:
             if caption_duration <= max_duration:
                 current_segment = AudioSegment(
-                    start=caption.start_in_seconds,
-                    end=caption.end_in_seconds,
-                    text=caption.text,
+                    start=start,
+                    end=end,
+                    text=text,
                     source=source,
                     filename=f"{filename}_{len(segments)}",
                 )
                 create_new_segment = False
             continue
-        caption_difference = caption.start_in_seconds - current_segment.end
+        caption_difference = start - current_segment.end
         if caption_difference > threshold:
             # difference between current caption and previous caption is greater than threshold
             if current_segment.duration >= min_duration:
@@ -79,9 +103,9 @@ def vtt_split(
             # check the caption duration is less than max_duration
             if caption_duration <= max_duration:
                 current_segment = AudioSegment(
-                    start=caption.start_in_seconds,
-                    end=caption.end_in_seconds,
-                    text=caption.text,
+                    start=start,
+                    end=end,
+                    text=text,
                     source=source,
                     filename=f"{filename}_{len(segments)}",
                 )
@@ -94,16 +118,16 @@ def vtt_split(
             <= max_duration
         ):
             # current caption can be added to the segment
-            current_segment.end = caption.end_in_seconds
-            current_segment.text = f"{current_segment.text} {caption.text}"
+            current_segment.end = end
+            current_segment.text = f"{current_segment.text} {text}"
         elif current_segment.duration >= min_duration:
             # current caption cannot be added to the segment
             segments.append(current_segment)
             if caption_duration <= max_duration:
                 current_segment = AudioSegment(
-                    start=caption.start_in_seconds,
-                    end=caption.end_in_seconds,
-                    text=caption.text,
+                    start=start,
+                    end=end,
+                    text=text,
                     source=source,
                     filename=f"{filename}_{len(segments)}",
                 )
@@ -114,9 +138,9 @@ def vtt_split(
             # skip the current caption and start a new segment
             if caption_duration <= max_duration:
                 current_segment = AudioSegment(
-                    start=caption.start_in_seconds,
-                    end=caption.end_in_seconds,
-                    text=caption.text,
+                    start=start,
+                    end=end,
+                    text=text,
                     source=source,
                     filename=f"{filename}_{len(segments)}",
                 )
@@ -124,6 +148,193 @@ def vtt_split(
                 create_new_segment = True
     if current_segment and current_segment.duration >= min_duration:
         segments.append(current_segment)
+    return segments
+
+
+def segment_bounds(
+    starts: np.ndarray,
+    ends: np.ndarray,
+    min_duration: float,
+    max_duration: float,
+    threshold: float,
+) -> Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Array version of the merging rules of _split_cues.
+    Caption durations, validity, gaps and threshold breaks are computed with NumPy,
+    the remaining greedy pass only compares floats.
+    Args:
+        starts: caption start times in seconds
+        ends: caption end times in seconds
+    Returns:
+        indices of the valid captions, first and last position of each segment
+        in those indices, and the filename suffix of each segment.
+    """
+    starts = np.asarray(starts, dtype=np.float64)
+    ends = np.asarray(ends, dtype=np.float64)
+    durations = ends - starts
+    captions = np.flatnonzero(
+        (durations <= MAX_CAPTION_DURATION) & (durations >= MIN_CAPTION_DURATION)
+    )
+    caption_starts = starts[captions]
+    caption_ends = ends[captions]
+    caption_durations = durations[captions]
+    # a caption is only compared to the segment when the previous valid caption
+    # belongs to it, so the gap to the segment end is the gap to that caption.
+    gaps = np.empty_like(caption_starts)
+    gaps[:1] = 0.0
+    np.subtract(caption_starts[1:], caption_ends[:-1], out=gaps[1:])
+    # the greedy pass only sees plain python values
+    decisions = zip(
+        range(len(captions)),
+        (gaps > threshold).tolist(),
+        (caption_durations <= max_duration).tolist(),
+        caption_starts.tolist(),
+        caption_ends.tolist(),
+        caption_durations.tolist(),
+        gaps.tolist(),
+    )
+
+    firsts, lasts, names = [], [], []
+    first = last = name = -1
+    start = end = 0.0
+    create_new_segment = True
+    for k, is_break, fits, caption_start, caption_end, duration, gap in decisions:
+        if create_new_segment:
+            if fits:
+                first, last, name = k, k, len(names)
+                start, end = caption_start, caption_end
+                create_new_segment = False
+            continue
+        if not is_break and (end - start) + duration + gap <= max_duration:
+            last, end = k, caption_end
+            continue
+        if end - start >= min_duration:
+            firsts.append(first)
+            lasts.append(last)
+            names.append(name)
+        if fits:
+            first, last, name = k, k, len(names)
+            start, end = caption_start, caption_end
+        else:
+            create_new_segment = True
+    if first >= 0 and end - start >= min_duration:
+        firsts.append(first)
+        lasts.append(last)
+        names.append(name)
+    return (
+        captions,
+        np.array(firsts, dtype=np.int64),
+        np.array(lasts, dtype=np.int64),
+        np.array(names, dtype=np.int64),
+    )
+
+
+def _split_cues_numpy(
+    starts: np.ndarray,
+    ends: np.ndarray,
+    texts: list,
+    filename: str,
+    min_duration: float,
+    max_duration: float,
+    threshold: float,
+    source: SourceEnum,
+) -> list[AudioSegment]:
+    """Same output as _split_cues, built from segment_bounds, text is joined once per segment."""
+    captions, firsts, lasts, names = segment_bounds(
+        starts, ends, min_duration, max_duration, threshold
+    )
+    captions = captions.tolist()
+    starts = np.asarray(starts, dtype=np.float64).tolist()
+    ends = np.asarray(ends, dtype=np.float64).tolist()
+    return [
+        AudioSegment(
+            start=starts[captions[first]],
+            end=ends[captions[last]],
+            text=" ".join([texts[i] for i in captions[first : last + 1]]),
+            source=source,
+            filename=f"{filename}_{name}",
+        )
+        for first, last, name in zip(firsts.tolist(), lasts.tolist(), names.tolist())
+    ]
+
+
+def vtt_split(
+    vtt_path: VttSource,
+    min_duration: float = 6.0,
+    max_duration: float = 16.0,
+    threshold: float = 2.0,
+    source: SourceEnum = SourceEnum.MASC,
+    parser: str = "webvtt",
+    engine: str = "python",
+    filename: Optional[str] = None,
+    cue_cache: Optional[CueCache] = None,
+) -> Audio:
+    """
+    Split a vtt file into audio segments
+
+    Args:
+        vtt_path: path to vtt file, or its content as bytes or a file-like object
+        min_duration: minimum duration of a segment
+        max_duration: maximum duration of a segment
+        threshold: threshold for splitting segments
+        source: source of the audio
+        parser: "webvtt" to read the file with webvtt-py,
+            "native" to use the streaming parser of vtt_parser.
+        engine: "python" merges captions one AudioSegment at a time,
+            "numpy" computes segment bounds on arrays first, both give the same segments.
+        filename: audio filename the segments are named after,
+            defaults to the vtt path stem, required for buffers.
+        cue_cache: cues are read from this cache when the file was parsed before,
+            and added to it otherwise, call cue_cache.save to keep them.
+    Returns:
+        Audio object
+    """
+    if engine not in ENGINES:
+        raise ValueError(f"engine should be one of {ENGINES}, got {engine}.")
+    if filename is None:
+        if not is_vtt_path(vtt_path):
+            raise ValueError("filename is required when splitting a vtt buffer.")
+        filename = Path(vtt_path).stem
+    if cue_cache is None or not is_vtt_path(vtt_path):
+        cues = _parse_cues(vtt_path, parser)
+    else:
+        cues, cue_file = cue_cache.get(Path(vtt_path), parser)
+        if cues is None:
+            cues = _parse_cues(vtt_path, parser)
+            cue_cache.put(cue_file, parser, cues)
+    return _cues_to_audio(
+        cues, filename, min_duration, max_duration, threshold, source, engine
+    )
+
+
+def _parse_cues(vtt_source: VttSource, parser: str) -> Cues:
+    with metrics.track("vtt_parse"):
+        cues = _read_cues(vtt_source, parser)
+    metrics.count("vtt_parse")
+    return cues
+
+
+def _cues_to_audio(
+    cues: Cues,
+    filename: str,
+    min_duration: float,
+    max_duration: float,
+    threshold: float,
+    source: SourceEnum,
+    engine: str,
+) -> Audio:
+    starts, ends, texts = cues
+    split_cues = _split_cues_numpy if engine == "numpy" else _split_cues
+    segments = split_cues(
+        starts,
+        ends,
+        texts,
+        filename=filename,
+        min_duration=min_duration,
+        max_duration=max_duration,
+        threshold=threshold,
+        source=source,
+    )
     audio = Audio(
         filename=filename,
         duration=sum([segment.duration for segment in segments]),
@@ -133,12 +344,154 @@ def vtt_split(
     return audio
 
 
+# cache of the folder in a pool worker of imap_cached_cues
+_worker_cue_cache: Optional[CueCache] = None
+
+
+def _open_worker_cue_cache(cache_path: Path) -> None:
+    global _worker_cue_cache
+    _worker_cue_cache = CueCache(cache_path.parent, cache_path)
+
+
+def _apply_cached_cues(
+    vtt_path: Path,
+    func: Callable[[Path, Cues], T],
+    parser: str,
+    cache: Optional[CueCache] = None,
+) -> tuple[T, CueFile, Optional[Cues]]:
+    if cache is None:
+        cache = _worker_cue_cache
+    cues, cue_file = cache.get(vtt_path, parser)
+    parsed = None
+    if cues is None:
+        cues = parsed = _parse_cues(vtt_path, parser)
+    return func(vtt_path, cues), cue_file, parsed
+
+
+def imap_cached_cues(
+    func: Callable[[Path, Cues], T],
+    vtt_paths: list[Path],
+    cache: CueCache,
+    workers: int = 1,
+    chunksize: int = 32,
+    parser: str = "webvtt",
+) -> Generator[T, None, None]:
+    """
+    Lazily apply func to the cues of every vtt file, in the process that reads
+    them: the cues of a file are read from the cache or parsed, then given to
+    func, only the cues that were parsed are sent back to this process to be
+    added to the cache. Files of the cache that are not in vtt_paths are removed
+    from it, the cache is saved once every file was yielded.
+    Args:
+        func: called with the path and the cues of a file, picklable when workers > 1
+        vtt_paths: all the vtt files of the cache folder
+        cache: CueCache of their folder
+        workers: number of processes, each one reads the cache file on its own
+        chunksize: number of files sent to a worker at once
+        parser: vtt parser, see vtt_split
+    Yields:
+        result of func for each file, in the order of vtt_paths
+    """
+    cache.prune(vtt_path.name for vtt_path in vtt_paths)
+    apply = partial(_apply_cached_cues, func=func, parser=parser)
+    initializer = partial(_open_worker_cue_cache, cache.path)
+    with Pool(workers, initializer) if workers > 1 else nullcontext() as pool:
+        if pool is None:
+            results = map(partial(apply, cache=cache), vtt_paths)
+        else:
+            results = pool.imap(apply, vtt_paths, chunksize=chunksize)
+        for result, cue_file, parsed in results:
+            cache.put(cue_file, parser, parsed)
+            yield result
+    cache.save()
+
+
+def _split_path_cues(vtt_path: Path, cues: Cues, **kwargs) -> Audio:
+    return _cues_to_audio(cues, vtt_path.stem, **kwargs)
+
+
+def iter_folder_vtt_split(
+    vtt_folder: Path,
+    min_duration: float = 6.0,
+    max_duration: float = 16.0,
+    threshold: float = 2.0,
+    source: SourceEnum = SourceEnum.MASC,
+    workers: int = 1,
+    chunksize: int = 32,
+    parser: str = "webvtt",
+    engine: str = "python",
+    cue_cache: bool = False,
+) -> Generator[Audio, None, None]:
+    """
+    Lazily split a folder of vtt files into audio segments.
+    Files are processed in sorted order, with workers > 1 they are parsed by a
+    process pool in chunks of chunksize files and yielded in the same order,
+    so the output doesn't depend on the number of workers.
+
+    Args:
+        vtt_folder: path to folder of vtt files
+        min_duration: minimum duration of a segment
+        max_duration: maximum duration of a segment
+        threshold: threshold for splitting segments
+        source: source of the audio
+        workers: number of processes
+        chunksize: number of files sent to a worker at once
+        parser: vtt parser, see vtt_split
+        engine: merging engine, see vtt_split
+        cue_cache: keep the parsed cues in a CueCache inside vtt_folder,
+            later calls only parse new or modified files. Files are still read
+            and split one at a time, see imap_cached_cues.
+    Yields:
+        Audio objects
+    """
+    if engine not in ENGINES:
+        raise ValueError(f"engine should be one of {ENGINES}, got {engine}.")
+    vtt_paths = sorted(vtt_folder.glob("*.vtt"))
+    split = partial(
+        vtt_split,
+        min_duration=min_duration,
+        max_duration=max_duration,
+        threshold=threshold,
+        source=source,
+        parser=parser,
+        engine=engine,
+    )
+    if cue_cache:
+        split_cues = partial(
+            _split_path_cues,
+            min_duration=min_duration,
+            max_duration=max_duration,
+            threshold=threshold,
+            source=source,
+            engine=engine,
+        )
+        audios = imap_cached_cues(
+            split_cues, vtt_paths, CueCache(vtt_folder), workers, chunksize, parser
+        )
+        yield from tqdm(
+            audios, desc="Splitting vtt files into segments", total=len(vtt_paths)
+        )
+        return
+    with Pool(workers) if workers > 1 else nullcontext() as pool:
+        if pool is None:
+            audios = map(split, vtt_paths)
+        else:
+            audios = pool.imap(split, vtt_paths, chunksize=chunksize)
+        yield from tqdm(
+            audios, desc="Splitting vtt files into segments", total=len(vtt_paths)
+        )
+
+
 def folder_vtt_split(
     vtt_folder: Path,
     min_duration: float = 6.0,
     max_duration: float = 16.0,
     threshold: float = 2.0,
     source: SourceEnum = SourceEnum.MASC,
+    workers: int = 1,
+    parser: str = "webvtt",
+    engine: str = "python",
+    cue_cache: bool = False,
 ) -> list[Audio]:
     """
     Split a folder of vtt files into audio segments
@@ -149,24 +502,23 @@ def folder_vtt_split(
         max_duration: maximum duration of a segment
         threshold: threshold for splitting segments
         source: source of the audio
+        workers: number of processes
+        parser: vtt parser, see vtt_split
+        engine: merging engine, see vtt_split
+        cue_cache: see iter_folder_vtt_split
     Returns:
         list of Audio objects
     """
-    audios = []
-    for vtt_path in tqdm(
-        vtt_folder.glob("*"),
-        desc="Splitting vtt files into segments",
-        total=len(list(vtt_folder.glob("*"))),
-    ):
-        if vtt_path.suffix == ".vtt":
-            audios.append(
-                vtt_split(
-                    vtt_path=vtt_path,
-                    min_duration=min_duration,
-                    max_duration=max_duration,
-                    threshold=threshold,
-                    source=source,
-                )
-            )
-
-    return audios
+    return list(
+        iter_folder_vtt_split(
+            vtt_folder=vtt_folder,
+            min_duration=min_duration,
+            max_duration=max_duration,
+            threshold=threshold,
+            source=source,
+            workers=workers,
+            parser=parser,
+            engine=engine,
+            cue_cache=cue_cache,
+        )
+    )
@@ -0,0 +1,236 @@
+"""
+Evaluate many vtt_split parameter combinations in one pass over the parsed cues.
+
+Only the segment bounds are computed, with segment_bounds, no AudioSegment
+is built, so a grid of settings can be compared on a whole corpus:
+
+    python -m processing.services.vtt_sweep subtitles/ \
+        --min-durations 4 6 8 --max-durations 12 16 20 --thresholds 1 2 3
+"""
+from contextlib import nullcontext
+from dataclasses import dataclass
+from functools import partial
+from itertools import product
+from multiprocessing import Pool, cpu_count
+from pathlib import Path
+from typing import Iterable, Optional
+import argparse
+import logging
+import numpy as np
+import pandas as pd
+from processing.services.cue_cache import CueCache, Cues
+from processing.services.vtt_split import imap_cached_cues, segment_bounds
+
+
+logging.basicConfig(format="%(asctime)s - %(message)s", level=logging.INFO)
+
+# (min_duration, max_duration, threshold)
+Parameters = tuple[float, float, float]
+
+
+@dataclass
+class SweepResult:
+    """Segments vtt_split would keep with a combination of parameters."""
+
+    min_duration: float
+    max_duration: float
+    threshold: float
+    segments: int
+    seconds: float
+    # number of segments in each bin of the sweep bins
+    histogram: np.ndarray
+
+    @property
+    def hours(self) -> float:
+        return self.seconds / 3600
+
+
+def parameter_grid(
+    min_durations: Iterable[float],
+    max_durations: Iterable[float],
+    thresholds: Iterable[float],
+) -> list[Parameters]:
+    """
+    Every combination of the values,
+    combinations with min_duration > max_duration are left out.
+    """
+    return [
+        (min_duration, max_duration, threshold)
+        for min_duration, max_duration, threshold in product(
+            min_durations, max_durations, thresholds
+        )
+        if min_duration <= max_duration
+    ]
+
+
+# (starts, ends) of a vtt file, the texts are not needed to sweep
+Times = tuple[np.ndarray, np.ndarray]
+
+
+def _cue_times(cues: Cues) -> Times:
+    return np.asarray(cues[0], dtype=np.float64), np.asarray(cues[1], dtype=np.float64)
+
+
+def _sweep_times(
+    times: Times, grid: list[Parameters], bins: np.ndarray
+) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """Segment counts, seconds and duration histograms of a file per combination."""
+    counts = np.zeros(len(grid), dtype=np.int64)
+    seconds = np.zeros(len(grid), dtype=np.float64)
+    histograms = np.zeros((len(grid), len(bins) - 1), dtype=np.int64)
+    starts, ends = times
+    if not len(starts):
+        return counts, seconds, histograms
+    for i, (min_duration, max_duration, threshold) in enumerate(grid):
+        captions, firsts, lasts, _ = segment_bounds(
+            starts, ends, min_duration, max_duration, threshold
+        )
+        durations = ends[captions[lasts]] - starts[captions[firsts]]
+        counts[i] = len(durations)
+        seconds[i] = durations.sum()
+        histograms[i] = np.histogram(durations, bins=bins)[0]
+    return counts, seconds, histograms
+
+
+def _sweep_path_cues(
+    vtt_path: Path, cues: Cues, grid: list[Parameters], bins: np.ndarray
+) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    return _sweep_times(_cue_times(cues), grid, bins)
+
+
+def _default_bins(grid: list[Parameters]) -> np.ndarray:
+    return np.arange(0.0, max(parameters[1] for parameters in grid) + 1.0)
+
+
+def _sum_results(
+    file_results: Iterable[tuple[np.ndarray, np.ndarray, np.ndarray]],
+    grid: list[Parameters],
+    bins: np.ndarray,
+) -> list[SweepResult]:
+    counts = np.zeros(len(grid), dtype=np.int64)
+    seconds = np.zeros(len(grid), dtype=np.float64)
+    histograms = np.zeros((len(grid), len(bins) - 1), dtype=np.int64)
+    for file_counts, file_seconds, file_histograms in file_results:
+        counts += file_counts
+        seconds += file_seconds
+        histograms += file_histograms
+    return [
+        SweepResult(
+            min_duration=min_duration,
+            max_duration=max_duration,
+            threshold=threshold,
+            segments=int(counts[i]),
+            seconds=float(seconds[i]),
+            histogram=histograms[i],
+        )
+        for i, (min_duration, max_duration, threshold) in enumerate(grid)
+    ]
+
+
+def sweep_cues(
+    cues: Iterable[Cues],
+    grid: list[Parameters],
+    bins: Optional[np.ndarray] = None,
+    workers: int = 1,
+    chunksize: int = 32,
+) -> list[SweepResult]:
+    """
+    Evaluate every combination of the grid on the cues of many files.
+    The counts are those of vtt_split, validate_dataframe drops duplicated rows
+    on top of it, which only happens when two vtt files name the same audio,
+    e.g. a.vtt and a.ar.vtt, those are counted twice here.
+    Args:
+        cues: (starts, ends, texts) of each file
+        grid: (min_duration, max_duration, threshold) combinations, see parameter_grid
+        bins: edges of the duration histograms in seconds,
+            one second bins up to the largest max_duration by default
+        workers: number of processes, each file is swept by a single process
+        chunksize: number of files sent to a worker at once
+    Returns:
+        result of each combination, in grid order
+    """
+    if bins is None:
+        bins = _default_bins(grid)
+    sweep = partial(_sweep_times, grid=grid, bins=bins)
+    # only the time arrays are sent to the workers
+    times = map(_cue_times, cues)
+    with Pool(workers) if workers > 1 else nullcontext() as pool:
+        if pool is None:
+            file_results = map(sweep, times)
+        else:
+            file_results = pool.imap_unordered(sweep, times, chunksize=chunksize)
+        return _sum_results(file_results, grid, bins)
+
+
+def sweep_folder(
+    vtt_folder: Path,
+    grid: list[Parameters],
+    bins: Optional[np.ndarray] = None,
+    workers: int = 1,
+    chunksize: int = 32,
+    parser: str = "webvtt",
+) -> list[SweepResult]:
+    """
+    Evaluate every combination of the grid on a folder of vtt files.
+    Files are parsed once and kept in the CueCache of the folder,
+    later sweeps of the same folder skip parsing. A file is read or parsed
+    and swept by the same worker, see imap_cached_cues.
+    Args:
+        vtt_folder: path to folder of vtt files
+        parser: vtt parser, see vtt_split
+        grid, bins, workers, chunksize: see sweep_cues
+    Returns:
+        result of each combination, in grid order
+    """
+    if bins is None:
+        bins = _default_bins(grid)
+    vtt_paths = sorted(vtt_folder.glob("*.vtt"))
+    logging.info(
+        "Sweeping %d combinations over %d vtt files", len(grid), len(vtt_paths)
+    )
+    file_results = imap_cached_cues(
+        partial(_sweep_path_cues, grid=grid, bins=bins),
+        vtt_paths,
+        CueCache(vtt_folder),
+        workers,
+        chunksize,
+        parser,
+    )
+    return _sum_results(file_results, grid, bins)
+
+
+def sweep_report(results: list[SweepResult]) -> pd.DataFrame:
+    """One row per combination, sorted by retained hours."""
+    df = pd.DataFrame(
+        {
+            "min_duration": [result.min_duration for result in results],
+            "max_duration": [result.max_duration for result in results],
+            "threshold": [result.threshold for result in results],
+            "segments": [result.segments for result in results],
+            "hours": [result.hours for result in results],
+        }
+    )
+    df["mean_duration"] = df.hours * 3600 / df.segments.where(df.segments > 0)
+    return df.sort_values("hours", ascending=False, ignore_index=True)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Compare vtt_split parameters on a folder of vtt files."
+    )
+    parser.add_argument("vtt_folder", type=Path)
+    parser.add_argument("--min-durations", type=float, nargs="+", default=[6.0])
+    parser.add_argument("--max-durations", type=float, nargs="+", default=[16.0])
+    parser.add_argument("--thresholds", type=float, nargs="+", default=[2.0])
+    parser.add_argument("--workers", type=int, default=cpu_count())
+    parser.add_argument("--output", type=Path, default=None, help="csv of the report")
+    args = parser.parse_args()
+    sweep_results = sweep_folder(
+        args.vtt_folder,
+        parameter_grid(args.min_durations, args.max_durations, args.thresholds),
+        workers=args.workers,
+    )
+    report = sweep_report(sweep_results)
+    logging.info("\n%s", report.to_string())
+    if args.output is not None:
+        report.to_csv(args.output, index=False)
@@ -0,0 +1,44 @@
+"""
+Arabic text cleaning shared by the services and the db models.
+
+Only depends on maha, so the db layer can clean texts without importing
+the audio and vtt stack of processing.services.
+"""
+from functools import lru_cache
+import os
+import re
+from maha.constants import ALEF, ALEF_VARIATIONS, ALL_HARAKAT, ARABIC_LETTERS, TATWEEL
+
+
+# normalize alef and drop harakat and tatweel in a single translate call
+CLEAN_TEXT_TRANSLATION = str.maketrans(
+    {
+        **{alef: ALEF for alef in ALEF_VARIATIONS},
+        **{char: None for char in ALL_HARAKAT + [TATWEEL]},
+    }
+)
+# maha replaces non kept characters line by line, so new lines survive
+NOT_ARABIC_LETTERS_PATTERN = re.compile(f"[^{''.join(ARABIC_LETTERS)}\n]+")
+# subtitles repeat a lot (music tags, repeated captions), each process keeps
+# this many cleaned texts, cached_clean_text.cache_info() gives hits and misses
+CLEAN_TEXT_CACHE_SIZE = int(os.getenv("CLEAN_TEXT_CACHE_SIZE", 2**16))
+
+
+def clean_text_compiled(text: str) -> str:
+    """
+    Same output as services.clean_text, normalize `alef` and keep only arabic
+    letters, using a precompiled translation table and regex.
+    """
+    if not text:
+        return ""
+    text = text.translate(CLEAN_TEXT_TRANSLATION)
+    return NOT_ARABIC_LETTERS_PATTERN.sub(" ", text).strip()
+
+
+@lru_cache(maxsize=CLEAN_TEXT_CACHE_SIZE)
+def cached_clean_text(text: str) -> str:
+    """
+    Memoized clean_text shared by the dataframe and the database paths.
+    Bounded LRU cache of CLEAN_TEXT_CACHE_SIZE entries.
+    """
+    return clean_text_compiled(text)
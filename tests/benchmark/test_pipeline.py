@@ -0,0 +1,57 @@
+import wave
+from processing.benchmark.corpus import write_masc_corpus
+from processing.benchmark.pipeline import StageResult, benchmark, compare_to_baseline
+
+
+def test_write_masc_corpus_is_deterministic(tmp_path):
+    first = write_masc_corpus(tmp_path / "a", n_files=3, n_cues=20, n_audios=1)
+    second = write_masc_corpus(tmp_path / "b", n_files=3, n_cues=20, n_audios=1)
+    vtt = "subtitles/audio_000002.ar.vtt"
+    assert (first / vtt).read_text() == (second / vtt).read_text()
+    assert [p.name for p in (first / "audios").iterdir()] == ["audio_000000.wav"]
+    with wave.open(str(first / "audios" / "audio_000000.wav")) as f:
+        assert f.getnframes() / f.getframerate() > 20
+
+
+def test_benchmark_stages(tmp_path):
+    masc_folder = tmp_path / "masc"
+    write_masc_corpus(masc_folder, n_files=4, n_cues=60, n_audios=2)
+    work_dir = tmp_path / "work"
+    work_dir.mkdir()
+    results = benchmark(
+        masc_folder,
+        work_dir,
+        workers=1,
+        stages=["vtt_split", "split_audio_to_segments", "mongo_insert", "full_flow"],
+    )
+    assert results["vtt_split"].items == results["mongo_insert"].items > 0
+    assert results["split_audio_to_segments"].items == results["full_flow"].items > 0
+    assert all(result.max_process_rss_mb > 0 for result in results.values())
+
+
+def test_compare_to_baseline():
+    baseline = {
+        "stages": {
+            "vtt_split": {"seconds": 1.0, "items": 10, "max_process_rss_mb": 100.0},
+            "clean_text": {"seconds": 1.0, "items": 10, "max_process_rss_mb": 100.0},
+        }
+    }
+    results = {
+        "vtt_split": StageResult(seconds=1.1, items=10, max_process_rss_mb=130.0),
+        "clean_text": StageResult(seconds=1.5, items=10, max_process_rss_mb=90.0),
+        "full_flow": StageResult(seconds=9.0, items=10, max_process_rss_mb=90.0),
+    }
+    regressions = compare_to_baseline(results, baseline, tolerance=0.2)
+    assert [regression.split(":")[0] for regression in regressions] == [
+        "vtt_split max_process_rss_mb",
+        "clean_text seconds",
+    ]
+
+
+def test_compare_to_baseline_skips_missing_metric():
+    # baseline saved before max_process_rss_mb
+    baseline = {
+        "stages": {"vtt_split": {"seconds": 1.0, "items": 10, "peak_rss_mb": 1.0}}
+    }
+    results = {"vtt_split": StageResult(seconds=1.0, items=10, max_process_rss_mb=500.0)}
+    assert compare_to_baseline(results, baseline) == []
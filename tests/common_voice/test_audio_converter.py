@@ -0,0 +1,122 @@
+import os
+import shutil
+import subprocess
+import wave
+from pathlib import Path
+from unittest import mock
+import numpy as np
+import pandas as pd
+import pytest
+from processing.common_voice import audio_converter
+from processing.common_voice.audio_converter import (
+    conversion_plan,
+    convert_audios,
+    convert_tsvs,
+)
+
+requires_ffmpeg = pytest.mark.skipif(shutil.which("ffmpeg") is None, reason="needs ffmpeg")
+
+
+def _write_wav(path, sample_rate=48000, channels=2):
+    samples = np.zeros((sample_rate, channels), dtype=np.int16)
+    with wave.open(str(path), "wb") as f:
+        f.setnchannels(channels)
+        f.setsampwidth(2)
+        f.setframerate(sample_rate)
+        f.writeframes(samples.tobytes())
+
+
+def test_convert_audios_skips_existing_and_counts_failures(tmp_path):
+    target = tmp_path / "clips_wav"
+    target.mkdir()
+    (target / "done.wav").write_bytes(b"wav")
+    summary = convert_audios(
+        [tmp_path / "done.mp3", tmp_path / "missing.mp3"], target, workers=2
+    )
+    assert (summary.converted, summary.skipped, summary.failed) == (0, 1, 1)
+    assert sorted(p.name for p in target.iterdir()) == ["done.wav"]
+
+
+def _fake_ffmpeg(command, check, capture_output):
+    source, target = Path(command[command.index("-i") + 1]), Path(command[-1])
+    assert command[command.index("-ar") + 1] == "16000"
+    if source.stem == "broken":
+        raise subprocess.CalledProcessError(1, command, stderr=b"Invalid data found")
+    # written under a temporary name, renamed once complete
+    assert target.name == f"{source.stem}.wav.tmp"
+    target.write_bytes(b"RIFF")
+
+
+def test_convert_audios_with_mocked_ffmpeg(tmp_path):
+    target = tmp_path / "clips_wav"
+    target.mkdir()
+    sources = [tmp_path / f"{name}.mp3" for name in ("a", "broken", "b")]
+    with mock.patch.object(audio_converter.subprocess, "run", side_effect=_fake_ffmpeg):
+        summary = convert_audios(sources, target, workers=2, sample_rate=16000)
+    assert (summary.converted, summary.skipped, summary.failed) == (2, 0, 1)
+    assert sorted(p.name for p in target.iterdir()) == ["a.wav", "b.wav"]
+
+
+def test_available_cpus():
+    assert 1 <= audio_converter.available_cpus() <= os.cpu_count()
+
+
+def test_convert_audios_rejects_unknown_engine(tmp_path):
+    with pytest.raises(ValueError):
+        convert_audios([], tmp_path, engine="sox")
+
+
+@requires_ffmpeg
+def test_ffmpeg_engine_resamples_and_downmixes(tmp_path):
+    source = tmp_path / "clip.mp3"
+    _write_wav(source)
+    target = tmp_path / "clips_wav"
+    target.mkdir()
+    summary = convert_audios([source], target, sample_rate=16000, channels=1)
+    assert summary.converted == 1
+    with wave.open(str(target / "clip.wav")) as f:
+        assert (f.getframerate(), f.getnchannels()) == (16000, 1)
+
+
+@pytest.fixture
+def tsv_files(tmp_path):
+    clips = [f"common_voice_ar_{i}.mp3" for i in range(6)]
+    tables = {
+        "train.tsv": clips[:4],
+        "dev.tsv": clips[3:],
+        "validated.tsv": clips,
+    }
+    paths = []
+    for name, table_clips in tables.items():
+        path = tmp_path / name
+        pd.DataFrame({"path": table_clips, "sentence": ["نص"] * len(table_clips)}).to_csv(
+            path, sep="\t", index=False
+        )
+        paths.append(path)
+    return paths
+
+
+def test_conversion_plan_dedupes_and_skips_converted(tsv_files, tmp_path):
+    (tmp_path / "common_voice_ar_1.wav").write_bytes(b"wav")
+    dataframes = [pd.read_csv(path, sep="\t") for path in tsv_files]
+    assert conversion_plan(dataframes, tmp_path) == [
+        f"common_voice_ar_{i}.mp3" for i in [0, 2, 3, 4, 5]
+    ]
+
+
+def test_convert_tsvs_rewrites_converted_rows(tsv_files, tmp_path):
+    target = tmp_path / "clips_wav"
+    target.mkdir()
+    # converted by an interrupted run, the other clips fail (no mp3 files)
+    (target / "common_voice_ar_3.wav").write_bytes(b"wav")
+    summary = convert_tsvs(tsv_files, tmp_path / "clips", target, workers=2)
+    assert (summary.converted, summary.failed) == (0, 5)
+    train = pd.read_csv(tsv_files[0], sep="\t")
+    assert train["path"].tolist() == [
+        "common_voice_ar_0.mp3",
+        "common_voice_ar_1.mp3",
+        "common_voice_ar_2.mp3",
+        "common_voice_ar_3.wav",
+    ]
+    assert pd.read_csv(tsv_files[2], sep="\t")["path"].str.endswith(".wav").sum() == 1
+    assert not list(tmp_path.glob("*.tmp"))
@@ -0,0 +1,25 @@
+import os
+import pytest
+from processing import metrics
+
+
+@pytest.fixture(scope="session")
+def _metrics_state():
+    # prometheus_client can only be set up once per process, enable the metrics
+    # once and switch them off again until a test asks for them
+    multiproc_dir = os.environ.get("PROMETHEUS_MULTIPROC_DIR")
+    metrics.enable()
+    state = (metrics._metrics, os.environ.get("PROMETHEUS_MULTIPROC_DIR"))
+    metrics._metrics = None
+    if multiproc_dir is None:
+        os.environ.pop("PROMETHEUS_MULTIPROC_DIR", None)
+    return state
+
+
+@pytest.fixture
+def enabled_metrics(_metrics_state, monkeypatch):
+    """Metrics enabled for the test only."""
+    state, multiproc_dir = _metrics_state
+    monkeypatch.setattr(metrics, "_metrics", state)
+    if multiproc_dir is not None:
+        monkeypatch.setenv("PROMETHEUS_MULTIPROC_DIR", multiproc_dir)
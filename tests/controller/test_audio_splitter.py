@@ -0,0 +1,130 @@
+import os
+import time
+import wave
+from unittest import mock
+from multiprocessing.pool import ThreadPool
+import mongomock
+import numpy as np
+import pytest
+from pymongo.errors import OperationFailure
+
+os.environ.setdefault("AWS_ACCESS_KEY", "testing")
+os.environ.setdefault("AWS_SECRET_KEY", "testing")
+from processing.controller import audio_splitter
+from processing.db.audio_db import AudioCollection
+
+
+@pytest.fixture
+def source_collection():
+    collection = mongomock.MongoClient().db.clean_dev
+    collection.insert_many(
+        [
+            {
+                "audio_id": f"audio{i}",
+                "audio_length": 20.0,
+                "audio_segments": [
+                    {"start": 0, "end": 6500, "text": "مرحبا", "filename": f"audio{i}_0"},
+                    {"start": 7000, "end": 14000, "text": "بكم", "filename": f"audio{i}_1"},
+                ],
+            }
+            for i in range(10)
+        ]
+    )
+    return AudioCollection(collection)
+
+
+def test_iter_documents_projection(source_collection):
+    documents = list(
+        source_collection.iter_documents(
+            projection=audio_splitter.SPLIT_PROJECTION, batch_size=3
+        )
+    )
+    assert len(documents) == source_collection.count() == 10
+    assert documents[0] == {
+        "audio_id": "audio0",
+        "audio_segments": [
+            {"start": 0, "end": 6500, "text": "مرحبا", "filename": "audio0_0"},
+            {"start": 7000, "end": 14000, "text": "بكم", "filename": "audio0_1"},
+        ],
+    }
+
+
+def test_imap_bounded_limits_pending_tasks():
+    pulled = []
+
+    def items():
+        for i in range(20):
+            pulled.append(i)
+            yield i
+
+    def slow_square(x):
+        time.sleep(0.001)
+        return x * x
+
+    with ThreadPool(2) as pool:
+        results = []
+        for result in audio_splitter.imap_bounded(pool, slow_square, items(), 3):
+            # never more than max_in_flight items pulled ahead of the consumer
+            assert len(pulled) - len(results) <= 3
+            results.append(result)
+    assert results == [i * i for i in range(20)]
+
+
+@pytest.fixture
+def audio_dirs(tmp_path, monkeypatch):
+    audio_dir = tmp_path / "audios"
+    segment_dir = tmp_path / "audio_segments"
+    audio_dir.mkdir()
+    segment_dir.mkdir()
+    for i in range(8):
+        with wave.open(str(audio_dir / f"audio{i}.wav"), "wb") as f:
+            f.setnchannels(1)
+            f.setsampwidth(2)
+            f.setframerate(8000)
+            f.writeframes(np.zeros(8000 * 20, dtype=np.int16).tobytes())
+    monkeypatch.setattr(audio_splitter, "AUDIO_DOWNLOAD_PATH", audio_dir)
+    monkeypatch.setattr(audio_splitter, "AUDIO_SEGMENT_DOWNLOAD_PATH", segment_dir)
+    return segment_dir
+
+
+def test_split_and_insert(source_collection, audio_dirs):
+    target = AudioCollection(mongomock.MongoClient().db.clean_dev_audio)
+    documents = source_collection.iter_documents(
+        projection=audio_splitter.SPLIT_PROJECTION
+    )
+    writer = audio_splitter.split_and_insert(documents, target, workers=2)
+    # audio8 and audio9 are not on disk
+    assert writer.inserted == 16
+    assert writer.failed == 0
+    assert len(list(audio_dirs.iterdir())) == 16
+    assert target.collection.find_one({"filename": "audio3_1"}, {"_id": 0}) == {
+        "filename": "audio3_1",
+        "text": "بكم",
+        "duration": 7.0,
+    }
+
+
+def test_segment_writer_error_does_not_block_producers(source_collection):
+    target = AudioCollection(mongomock.MongoClient().db.clean_dev_audio)
+    writer = audio_splitter.SegmentWriter(target, queue_size=1)
+    error = OperationFailure("not authorized")
+    with mock.patch.object(target.collection, "insert_many", side_effect=error):
+        writer.start()
+        with pytest.raises(OperationFailure):
+            # the queue is full after the writer died, put raises instead of blocking
+            for _ in range(10):
+                writer.put([{"filename": f"a_{i}"} for i in range(1000)])
+        with pytest.raises(OperationFailure):
+            writer.stop()
+    assert not writer.is_alive()
+
+
+def test_split_and_insert_raises_writer_error(source_collection, audio_dirs):
+    target = AudioCollection(mongomock.MongoClient().db.clean_dev_audio)
+    documents = source_collection.iter_documents(
+        projection=audio_splitter.SPLIT_PROJECTION
+    )
+    error = OperationFailure("not authorized")
+    with mock.patch.object(target.collection, "insert_many", side_effect=error):
+        with pytest.raises(OperationFailure):
+            audio_splitter.split_and_insert(documents, target, workers=2)
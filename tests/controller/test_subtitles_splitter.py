@@ -0,0 +1,130 @@
+import asyncio
+import os
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+import boto3
+import mongomock
+import pytest
+from moto import mock_aws
+from pymongo.errors import AutoReconnect, OperationFailure
+
+os.environ.setdefault("AWS_ACCESS_KEY", "testing")
+os.environ.setdefault("AWS_SECRET_KEY", "testing")
+os.environ.setdefault("AWS_DEFAULT_REGION", "us-east-1")
+from processing.controller import subtitles_splitter
+from processing.db.audio_db import AudioCollection
+from processing.s3_data_provider import S3Config, S3SubtitleProvider
+
+PREFIX = "masc/clean_dev/subtitles"
+TEST_DATA = Path("tests") / "test_data"
+
+
+class AsyncCollection:
+    """Motor-like stand-in over a mongomock collection."""
+
+    def __init__(self, collection):
+        self.collection = collection
+
+    async def insert_many(self, documents, ordered=True):
+        await asyncio.sleep(0)
+        return self.collection.insert_many(documents, ordered=ordered)
+
+
+@pytest.fixture
+def s3_provider(tmp_path):
+    with mock_aws():
+        bucket = boto3.resource("s3", region_name="us-east-1").create_bucket(
+            Bucket="arabic-speech-data"
+        )
+        for i in range(12):
+            vtt_name = ["test_with_threshold.vtt", "test_without_threshold.vtt"][i % 2]
+            bucket.upload_file(str(TEST_DATA / vtt_name), f"{PREFIX}/audio{i}.ar.vtt")
+        bucket.put_object(Key=f"{PREFIX}/broken.ar.vtt", Body=b"not a vtt")
+        config = S3Config(
+            access_key="testing",
+            secret_key="testing",
+            folder_prefix=PREFIX,
+            bucket_name=bucket.name,
+        )
+        yield S3SubtitleProvider(s3_config=config, subtitle_download_path=tmp_path)
+
+
+def _documents(collection):
+    return sorted(
+        (document for document in collection.find({}, {"_id": 0})),
+        key=lambda document: document["audio_id"],
+    )
+
+
+def test_subtitle_to_audio():
+    audio = subtitles_splitter.subtitle_to_audio(
+        TEST_DATA / "test_with_threshold.vtt", "audio1.ar.vtt"
+    )
+    assert audio.audio_id == "audio1"
+    assert audio.audio_segments[0].filename == "audio1_0"
+    assert all(isinstance(segment.start, int) for segment in audio.audio_segments)
+
+
+@pytest.mark.parametrize("concurrency", [1, 4])
+def test_ingest_subtitles_matches_sync_path(s3_provider, concurrency):
+    sync_collection = mongomock.MongoClient().db.sync
+    with AudioCollection(sync_collection).bulk_writer() as writer:
+        for audio in subtitles_splitter.splitter_generator(
+            s3_provider.download_subtitles()
+        ):
+            if audio.audio_length != 0:
+                writer.insert(audio.dict())
+
+    async_collection = mongomock.MongoClient().db.async_
+    with ThreadPoolExecutor(2) as executor:
+        inserted, failed = asyncio.run(
+            subtitles_splitter.ingest_subtitles(
+                s3_provider,
+                AsyncCollection(async_collection),
+                concurrency=concurrency,
+                batch_size=5,
+                executor=executor,
+            )
+        )
+    assert (inserted, failed) == (writer.inserted, 0) == (12, 0)
+    assert _documents(async_collection) == _documents(sync_collection)
+
+
+class FlakyAsyncCollection(AsyncCollection):
+    """Raises the given errors on the first insert_many calls."""
+
+    def __init__(self, collection, errors):
+        super().__init__(collection)
+        self.errors = list(errors)
+
+    async def insert_many(self, documents, ordered=True):
+        if self.errors:
+            raise self.errors.pop(0)
+        return await super().insert_many(documents, ordered=ordered)
+
+
+def test_ingest_subtitles_retries_transient_errors(s3_provider):
+    collection = mongomock.MongoClient().db.async_
+    flaky = FlakyAsyncCollection(collection, [AutoReconnect("reset")] * 2)
+    inserted, failed = asyncio.run(
+        subtitles_splitter.ingest_subtitles(
+            s3_provider, flaky, concurrency=4, batch_size=5, retry_delay=0
+        )
+    )
+    assert (inserted, failed) == (12, 0)
+    assert collection.count_documents({}) == 12
+
+
+def test_ingest_subtitles_stops_on_insert_error(s3_provider):
+    collection = mongomock.MongoClient().db.async_
+    broken = FlakyAsyncCollection(collection, [OperationFailure("not authorized")])
+    # batches of 1 fill the queue, the split workers would block on it forever
+    with pytest.raises(OperationFailure):
+        asyncio.run(
+            asyncio.wait_for(
+                subtitles_splitter.ingest_subtitles(
+                    s3_provider, broken, concurrency=4, batch_size=1
+                ),
+                timeout=30,
+            )
+        )
@@ -0,0 +1,107 @@
+from unittest import mock
+import bson
+import mongomock
+import pytest
+from pymongo.errors import AutoReconnect, BulkWriteError
+from processing.db.audio_db import (
+    AudioCollection,
+    InsertCounts,
+    bulk_write_counts,
+    estimated_bson_size,
+)
+
+
+@pytest.fixture
+def collection():
+    return mongomock.MongoClient().db.audios
+
+
+def test_bulk_writer_flushes_by_count(collection):
+    writer = AudioCollection(collection).bulk_writer(max_documents=3)
+    with mock.patch.object(collection, "insert_many", wraps=collection.insert_many) as spy:
+        with writer:
+            writer.insert_many({"filename": f"a_{i}"} for i in range(7))
+            assert collection.count_documents({}) == 6
+    assert spy.call_count == 3
+    assert collection.count_documents({}) == 7
+    assert writer.inserted == 7
+    assert writer.failed == 0
+
+
+def test_bulk_writer_flushes_by_size(collection):
+    with AudioCollection(collection).bulk_writer(max_bytes=100) as writer:
+        writer.insert({"text": "a" * 200})
+        assert collection.count_documents({}) == 1
+
+
+def test_bulk_writer_counts_existing_documents_as_duplicates(collection):
+    collection.insert_one({"_id": 1})
+    with AudioCollection(collection).bulk_writer() as writer:
+        writer.insert_many([{"_id": 1}, {"_id": 2}])
+    assert (writer.inserted, writer.duplicates, writer.failed) == (1, 1, 0)
+    assert collection.count_documents({}) == 2
+
+
+def test_bulk_writer_counts_retried_duplicates_as_inserted(collection):
+    insert_many = collection.insert_many
+    calls = []
+
+    def lost_ack(*args, **kwargs):
+        calls.append(args)
+        result = insert_many(*args, **kwargs)
+        if len(calls) == 1:
+            # stored, but the acknowledgement was lost
+            raise AutoReconnect("connection reset")
+        return result
+
+    with mock.patch.object(collection, "insert_many", side_effect=lost_ack):
+        with AudioCollection(collection).bulk_writer(retry_delay=0) as writer:
+            writer.insert_many([{"_id": 1}, {"_id": 2}])
+    assert (writer.inserted, writer.duplicates, writer.failed) == (2, 0, 0)
+
+
+def test_bulk_write_counts_write_concern_errors():
+    error = BulkWriteError(
+        {
+            "writeErrors": [{"code": 121, "errmsg": "validation failed"}],
+            "writeConcernErrors": [{"code": 64, "errmsg": "replication timed out"}],
+        }
+    )
+    counts = bulk_write_counts(error, 3, retried=False)
+    assert counts == InsertCounts(inserted=2, failed=1, write_concern_errors=1)
+
+
+@pytest.mark.parametrize(
+    "document",
+    [
+        {"filename": "a_0", "text": "مرحبا بكم", "duration": 6.5},
+        {"audio_id": "a", "n": 3, "ok": True, "none": None},
+    ],
+)
+def test_estimated_bson_size_of_flat_documents(document):
+    assert estimated_bson_size(document) >= len(bson.encode(document))
+    assert estimated_bson_size(document) <= len(bson.encode(document)) + 8 * len(document)
+
+
+def test_bulk_writer_retries_transient_errors(collection):
+    insert_many = collection.insert_many
+    errors = [AutoReconnect("connection reset"), AutoReconnect("connection reset")]
+
+    def flaky_insert_many(*args, **kwargs):
+        if errors:
+            raise errors.pop()
+        return insert_many(*args, **kwargs)
+
+    with mock.patch.object(collection, "insert_many", side_effect=flaky_insert_many):
+        with AudioCollection(collection).bulk_writer(retry_delay=0) as writer:
+            writer.insert({"filename": "a_0"})
+    assert writer.inserted == 1
+    assert collection.count_documents({}) == 1
+
+
+def test_bulk_writer_gives_up(collection):
+    with mock.patch.object(collection, "insert_many", side_effect=AutoReconnect("down")):
+        with AudioCollection(collection).bulk_writer(max_retries=2, retry_delay=0) as writer:
+            writer.insert({"filename": "a_0"})
+    assert writer.inserted == 0
+    assert writer.failed == 1
@@ -0,0 +1,44 @@
+import subprocess
+import sys
+from processing.db.models import AudioSegment, MASCAudio
+from processing.services import clean_text, cached_clean_text
+
+
+def test_masc_audio_cleans_text():
+    segment = AudioSegment(
+        start=0, end=6500, text="[موسيقى] إِنَّ الله مع الصابرين", filename="a_0"
+    )
+    masc_audio = MASCAudio.from_audio_segment(segment)
+    assert masc_audio.text == clean_text(segment.text)
+    assert masc_audio.dict() == {
+        "filename": "a_0",
+        "text": "موسيقى ان الله مع الصابرين",
+        "duration": 6.5,
+    }
+
+
+def test_masc_audio_uses_shared_cache():
+    cached_clean_text.cache_clear()
+    for _ in range(3):
+        MASCAudio(filename="a_0", text="السلام عليكم", duration=6.0)
+    info = cached_clean_text.cache_info()
+    assert info.misses == 1
+    assert info.hits == 2
+
+
+def test_masc_audio_skip_clean_text():
+    masc_audio = MASCAudio(filename="a_0", text="hello", duration=6.0, clean_text=False)
+    assert masc_audio.text == "hello"
+
+
+def test_models_do_not_import_services():
+    code = (
+        "import sys\n"
+        "import processing.db.models\n"
+        "print(sorted(m for m in ('processing.services', 'pydub', 'webvtt', 'pyarrow')"
+        " if m in sys.modules))"
+    )
+    result = subprocess.run(
+        [sys.executable, "-c", code], capture_output=True, text=True, check=True
+    )
+    assert result.stdout.strip() == "[]"
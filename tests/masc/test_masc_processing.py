@@ -1,7 +1,19 @@
+from pathlib import Path
+import wave
+import numpy as np
+import pyarrow.parquet as pq
 import pytest
 import pandas as pd
 from processing.masc import audio_to_dataframe
+from processing.masc.masc_processing import (
+    SplitSummary,
+    iter_audio_dataframes,
+    split_subset_to_audio,
+    vtt_split_to_dataframe,
+    vtt_split_to_parquet,
+)
 from processing.config import Audio, AudioSegment, SourceEnum
+from processing.services import SegmentManifest
 
 
 def test_audio_to_dataframe_with_single_segment():
@@ -138,3 +150,114 @@ def test_audio_to_dataframe_with_multiple_audios():
     assert df["segment_start"].tolist() == [0.0, 0.5, 0.0, 0.5]
     assert df["segment_end"].tolist() == [0.5, 1.0, 0.5, 1.0]
     assert df["segment_text"].tolist() == ["test", "test", "test", "test"]
+
+
+def _write_wav(path, seconds):
+    with wave.open(str(path), "wb") as f:
+        f.setnchannels(1)
+        f.setsampwidth(2)
+        f.setframerate(8000)
+        f.writeframes(np.zeros(8000 * seconds, dtype=np.int16).tobytes())
+
+
+@pytest.mark.parametrize("workers", [1, 2])
+def test_split_subset_to_audio(tmp_path, workers):
+    audio_folder = tmp_path / "audios"
+    output_folder = tmp_path / "segments"
+    audio_folder.mkdir()
+    output_folder.mkdir()
+    _write_wav(audio_folder / "a.wav", 20)
+    _write_wav(audio_folder / "b.wav", 10)
+    df = pd.DataFrame(
+        {
+            "audio_filename": ["a", "a", "b", "missing"],
+            "segment_filename": ["a_0", "a_1", "b_0", "missing_0"],
+            "segment_start": [0.0, 8.0, 1.0, 0.0],
+            "segment_end": [7.0, 16.0, 9.0, 6.0],
+        }
+    )
+    summary = split_subset_to_audio(df, audio_folder, output_folder, workers=workers)
+    assert summary == SplitSummary(exported=3, failed=1, missing_audios=1)
+    assert sorted(p.name for p in output_folder.iterdir()) == ["a_0.wav", "a_1.wav", "b_0.wav"]
+
+
+def test_split_subset_to_audio_resumes_from_manifest(tmp_path):
+    audio_folder = tmp_path / "audios"
+    output_folder = tmp_path / "segments"
+    audio_folder.mkdir()
+    output_folder.mkdir()
+    _write_wav(audio_folder / "a.wav", 20)
+    _write_wav(audio_folder / "b.wav", 10)
+    df = pd.DataFrame(
+        {
+            "audio_filename": ["a", "a", "b"],
+            "segment_filename": ["a_0", "a_1", "b_0"],
+            "segment_start": [0.0, 8.0, 1.0],
+            "segment_end": [7.0, 16.0, 9.0],
+        }
+    )
+    manifest = SegmentManifest(output_folder)
+    summary = split_subset_to_audio(df, audio_folder, output_folder, manifest=manifest)
+    assert summary == SplitSummary(exported=3)
+    summary = split_subset_to_audio(
+        df, audio_folder, output_folder, manifest=SegmentManifest(output_folder)
+    )
+    assert summary == SplitSummary(skipped_audios=2)
+    # new bounds for audio a, e.g. a vtt_split run with other parameters
+    df.loc[1, "segment_end"] = 15.0
+    summary = split_subset_to_audio(
+        df, audio_folder, output_folder, manifest=SegmentManifest(output_folder)
+    )
+    assert summary == SplitSummary(exported=2, skipped_audios=1)
+
+
+def test_iter_audio_dataframes_keeps_audios_whole():
+    audios = [
+        Audio(
+            filename=f"test{i}",
+            source=SourceEnum.MASC,
+            duration=1.0,
+            segments=[
+                AudioSegment(
+                    start=0.0,
+                    end=0.5,
+                    text="test",
+                    source=SourceEnum.MASC,
+                    filename=f"test{i}_{j}",
+                )
+                for j in range(2)
+            ],
+        )
+        for i in range(5)
+    ]
+    chunks = list(iter_audio_dataframes(iter(audios), chunk_size=3))
+    assert [len(chunk) for chunk in chunks] == [4, 4, 2]
+    pd.testing.assert_frame_equal(
+        pd.concat(chunks, ignore_index=True), audio_to_dataframe(audios)
+    )
+
+
+def test_vtt_split_to_parquet_matches_dataframe(tmp_path):
+    subtitle_folder = Path("tests") / "test_data"
+    dataframe_path = tmp_path / "subset.parquet"
+    kwargs = dict(
+        clean_segment_text=False, min_duration=8.0, max_duration=12.0, threshold=2.0
+    )
+    total = vtt_split_to_parquet(subtitle_folder, dataframe_path, chunk_size=1, **kwargs)
+    df = vtt_split_to_dataframe(subtitle_folder, **kwargs)
+    streamed = pd.read_parquet(dataframe_path)
+    assert total == len(df)
+    assert pq.ParquetFile(dataframe_path).num_row_groups == 2
+    pd.testing.assert_frame_equal(streamed, df)
+
+
+def test_vtt_split_to_parquet_parallel_is_identical(tmp_path):
+    subtitle_folder = Path("tests") / "test_data"
+    kwargs = dict(min_duration=8.0, max_duration=12.0, threshold=2.0, chunk_size=1)
+    vtt_split_to_parquet(subtitle_folder, tmp_path / "serial.parquet", **kwargs)
+    vtt_split_to_parquet(
+        subtitle_folder, tmp_path / "parallel.parquet", workers=2, **kwargs
+    )
+    assert (tmp_path / "serial.parquet").read_bytes() == (
+        tmp_path / "parallel.parquet"
+    ).read_bytes()
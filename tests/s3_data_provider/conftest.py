@@ -0,0 +1,24 @@
+import os
+import boto3
+import pytest
+from moto import mock_aws
+
+os.environ.setdefault("AWS_ACCESS_KEY", "testing")
+os.environ.setdefault("AWS_SECRET_KEY", "testing")
+os.environ.setdefault("AWS_DEFAULT_REGION", "us-east-1")
+
+BUCKET_NAME = "arabic-speech-data"
+
+
+@pytest.fixture
+def bucket():
+    with mock_aws():
+        s3 = boto3.resource("s3", region_name="us-east-1")
+        bucket = s3.create_bucket(Bucket=BUCKET_NAME)
+        for i in range(30):
+            bucket.put_object(
+                Key=f"masc/clean_dev/subtitles/audio{i}.ar.vtt",
+                Body=f"WEBVTT\n\n00:00:01.000 --> 00:00:02.000\n{i}\n".encode(),
+            )
+        bucket.put_object(Key="masc/clean_dev/audios/audio0.wav", Body=b"0" * 4096)
+        yield bucket
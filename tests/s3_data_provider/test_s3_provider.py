@@ -0,0 +1,125 @@
+import wave
+import numpy as np
+import pytest
+from processing import metrics
+from processing.s3_data_provider import S3AudioProvider, S3Config, S3SubtitleProvider
+from processing.s3_data_provider.object_cache import ObjectCache
+from processing.services import split_audio_arrays
+
+
+def _config(bucket, prefix):
+    return S3Config(
+        access_key="testing",
+        secret_key="testing",
+        folder_prefix=prefix,
+        bucket_name=bucket.name,
+    )
+
+
+@pytest.mark.parametrize("workers", [1, 8])
+def test_download_subtitles(bucket, tmp_path, workers):
+    provider = S3SubtitleProvider(
+        s3_config=_config(bucket, "masc/clean_dev/subtitles"), subtitle_download_path=tmp_path
+    )
+    paths = list(provider.download_subtitles(workers=workers))
+    assert sorted(p.name for p in paths) == sorted(f"audio{i}.ar.vtt" for i in range(30))
+    assert (tmp_path / "audio7.ar.vtt").read_text().endswith("\n7\n")
+
+
+@pytest.mark.usefixtures("enabled_metrics")
+def test_download_subtitles_default_arguments_are_measured(bucket, tmp_path):
+    provider = S3SubtitleProvider(
+        s3_config=_config(bucket, "masc/clean_dev/subtitles"), subtitle_download_path=tmp_path
+    )
+    before = metrics.summary()
+    paths = list(provider.download_subtitles())
+    after = metrics.summary()
+    transfers = after["stages"]["s3_transfer"]
+    assert len(paths) == 30
+    assert transfers["items"] - before["stages"]["s3_transfer"]["items"] == 30
+    assert after["s3_bytes"] - before["s3_bytes"] == sum(p.stat().st_size for p in paths)
+
+
+def test_download_many_skips_missing_objects(bucket, tmp_path):
+    provider = S3AudioProvider(
+        s3_config=_config(bucket, "masc/clean_dev/audios"), audio_download_path=tmp_path
+    )
+    paths = list(provider.download_audios(["audio0.wav", "missing.wav"], workers=2))
+    assert paths == [tmp_path / "audio0.wav"]
+    assert (tmp_path / "audio0.wav").stat().st_size == 4096
+
+
+def test_download_subtitles_skips_unchanged(bucket, tmp_path):
+    config = _config(bucket, "masc/clean_dev/subtitles")
+    provider = S3SubtitleProvider(s3_config=config, subtitle_download_path=tmp_path)
+    assert len(list(provider.download_subtitles(workers=4))) == 30
+
+    bucket.put_object(Key="masc/clean_dev/subtitles/audio3.ar.vtt", Body=b"WEBVTT\n")
+    bucket.put_object(Key="masc/clean_dev/subtitles/audio30.ar.vtt", Body=b"WEBVTT\n")
+    (tmp_path / "audio5.ar.vtt").unlink()
+    provider = S3SubtitleProvider(s3_config=config, subtitle_download_path=tmp_path)
+    downloaded = []
+    provider._client.download_file = _recorder(provider._client.download_file, downloaded)
+    paths = list(provider.download_subtitles(workers=4))
+    assert len(paths) == 31
+    assert sorted(downloaded) == ["audio3.ar.vtt", "audio30.ar.vtt", "audio5.ar.vtt"]
+    assert (tmp_path / "audio3.ar.vtt").read_bytes() == b"WEBVTT\n"
+
+
+def test_download_subtitles_saves_cache_while_downloading(bucket, tmp_path):
+    config = _config(bucket, "masc/clean_dev/subtitles")
+    provider = S3SubtitleProvider(s3_config=config, subtitle_download_path=tmp_path)
+    provider._cache.save_every = 10
+    provider._cache.save_interval = 3600
+    subtitles = provider.download_subtitles()
+    for _ in range(25):
+        next(subtitles)
+    # the generator is left open, as if the process was killed
+    assert len(ObjectCache(tmp_path)) == 20
+
+
+def _recorder(download_file, downloaded):
+    def record(bucket, key, filename, **kwargs):
+        downloaded.append(key.split("/")[-1])
+        return download_file(bucket, key, filename, **kwargs)
+
+    return record
+
+
+def test_stream_subtitles(bucket, tmp_path):
+    provider = S3SubtitleProvider(
+        s3_config=_config(bucket, "masc/clean_dev/subtitles"), subtitle_download_path=tmp_path
+    )
+    buffers = dict(provider.stream_subtitles(workers=4))
+    assert sorted(buffers) == sorted(f"audio{i}.ar.vtt" for i in range(30))
+    assert buffers["audio7.ar.vtt"].read().endswith(b"\n7\n")
+    assert list(tmp_path.iterdir()) == []
+
+
+def test_split_remote_matches_local_split(bucket, tmp_path):
+    rng = np.random.default_rng(0)
+    samples = rng.integers(-(2**15), 2**15, size=(16000 * 20, 2), dtype=np.int16)
+    wav_path = tmp_path / "audio1.wav"
+    with wave.open(str(wav_path), "wb") as f:
+        f.setnchannels(2)
+        f.setsampwidth(2)
+        f.setframerate(16000)
+        f.writeframes(samples.tobytes())
+    bucket.upload_file(str(wav_path), "masc/clean_dev/audios/audio1.wav")
+    filenames = np.array(["audio1_0", "audio1_1", "audio1_2"])
+    starts = np.array([0.0, 6.1234, 15.5])
+    ends = np.array([6.0, 14.9876, 25.0])
+    local_dir = tmp_path / "local"
+    remote_dir = tmp_path / "remote"
+    local_dir.mkdir()
+    remote_dir.mkdir()
+    split_audio_arrays(wav_path, filenames, starts, ends, local_dir, "wav")
+
+    provider = S3AudioProvider(
+        s3_config=_config(bucket, "masc/clean_dev/audios"), audio_download_path=tmp_path
+    )
+    assert provider.split_remote("audio1.wav", filenames, starts, ends, remote_dir) == 3
+    for filename in filenames:
+        remote_bytes = (remote_dir / f"{filename}.wav").read_bytes()
+        assert remote_bytes == (local_dir / f"{filename}.wav").read_bytes()
+    assert provider.split_remote("audio0.wav", filenames, starts, ends, remote_dir) is None
@@ -0,0 +1,79 @@
+import io
+from pathlib import Path
+import wave
+import numpy as np
+import pandas as pd
+import pytest
+from processing.services import split_audio_to_segments
+from processing.services.audio_split import read_wav_info
+
+
+@pytest.fixture
+def wav_file(tmp_path):
+    path = tmp_path / "audio.wav"
+    rng = np.random.default_rng(0)
+    samples = rng.integers(-(2**15), 2**15, size=(16000 * 30, 2), dtype=np.int16)
+    with wave.open(str(path), "wb") as f:
+        f.setnchannels(2)
+        f.setsampwidth(2)
+        f.setframerate(16000)
+        f.writeframes(samples.tobytes())
+    return path
+
+
+@pytest.fixture
+def segments():
+    return pd.DataFrame(
+        {
+            "segment_filename": ["audio_0", "audio_1", "audio_2"],
+            "segment_start": [0.0, 6.1234, 20.5],
+            "segment_end": [6.0, 14.9876, 31.0],
+        }
+    )
+
+
+def test_read_wav_info(wav_file):
+    info = read_wav_info(wav_file.read_bytes())
+    assert info.channels == 2
+    assert info.sample_rate == 16000
+    assert info.sample_width == 2
+    assert info.data_offset == 44
+    assert info.n_frames == 16000 * 30
+
+
+def test_read_wav_info_not_pcm():
+    assert read_wav_info(b"ID3\x03\x00\x00\x00\x00\x00\x00\x00\x00") is None
+
+
+def test_mmap_engine_matches_pydub(wav_file, segments, tmp_path):
+    mmap_dir = tmp_path / "mmap"
+    pydub_dir = tmp_path / "pydub"
+    mmap_dir.mkdir()
+    pydub_dir.mkdir()
+    assert split_audio_to_segments(wav_file, segments, mmap_dir, "wav", engine="mmap") == 3
+    assert split_audio_to_segments(wav_file, segments, pydub_dir, "wav", engine="pydub") == 3
+    for filename in segments.segment_filename:
+        mmap_bytes = (mmap_dir / f"{filename}.wav").read_bytes()
+        pydub_bytes = (pydub_dir / f"{filename}.wav").read_bytes()
+        assert mmap_bytes == pydub_bytes
+
+
+def test_mmap_engine_rejects_non_pcm(tmp_path, segments):
+    path = tmp_path / "audio.wav"
+    path.write_bytes(b"not a wav file")
+    with pytest.raises(ValueError):
+        split_audio_to_segments(path, segments, tmp_path, "wav", engine="mmap")
+
+
+@pytest.mark.parametrize("engine", ["mmap", "pydub"])
+def test_split_audio_buffer(wav_file, segments, tmp_path, engine):
+    file_dir = tmp_path / "file"
+    buffer_dir = tmp_path / "buffer"
+    file_dir.mkdir()
+    buffer_dir.mkdir()
+    split_audio_to_segments(wav_file, segments, file_dir, "wav", engine=engine)
+    buffer = io.BytesIO(wav_file.read_bytes())
+    assert split_audio_to_segments(buffer, segments, buffer_dir, "wav", engine=engine) == 3
+    for filename in segments.segment_filename:
+        file_bytes = (file_dir / f"{filename}.wav").read_bytes()
+        assert (buffer_dir / f"{filename}.wav").read_bytes() == file_bytes
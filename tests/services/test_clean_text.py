@@ -0,0 +1,37 @@
+import numpy as np
+import pandas as pd
+import pytest
+from processing.services import clean_text, clean_text_batch
+
+
+SAMPLES = [
+    "",
+    "عن أبي هريرة",
+    "إِنَّ اللّٰهَ مَعَ الصَّابِرِينَ",
+    "[موسيقى]   السلام عليكم ورحمة الله",
+    "الـــــسلام 123 hello, world!",
+    "سطر أول\nسطر ثاني\r\n  ",
+    "ٱلْحَمْدُ لِلَّهِ رَبِّ ٱلْعَـٰلَمِينَ",
+    "?!؟ ... ،؛",
+    "\n\nآمين\n",
+]
+ALPHABET = list("ابتثجحخدذرزسشصضطظعغفقكلمنهويىةآأإءؤئٲٳٱ") + list(
+    "َُِّْـٰ abcXYZ019،؟!.\n\r\t-[]"
+)
+
+
+def _random_texts(n):
+    rng = np.random.default_rng(0)
+    return ["".join(rng.choice(ALPHABET, rng.integers(0, 40))) for _ in range(n)]
+
+
+@pytest.mark.parametrize("dedupe", [True, False])
+def test_clean_text_batch_matches_clean_text(dedupe):
+    texts = SAMPLES + _random_texts(500)
+    assert clean_text_batch(texts, dedupe=dedupe) == [clean_text(t) for t in texts]
+
+
+def test_clean_text_batch_series_keeps_index():
+    texts = pd.Series(SAMPLES * 2, index=range(100, 100 + 2 * len(SAMPLES)), name="text")
+    cleaned = clean_text_batch(texts)
+    pd.testing.assert_series_equal(cleaned, texts.apply(clean_text))
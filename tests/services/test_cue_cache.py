@@ -0,0 +1,148 @@
+import os
+import shutil
+import sys
+from pathlib import Path
+import pyarrow.parquet as pq
+import pytest
+from processing.services import CueCache, folder_vtt_split, vtt_split
+from processing.services import cue_cache
+from processing.services.cue_cache import CUE_CACHE_FILENAME
+
+# the module is shadowed by the vtt_split function in processing.services
+vtt_split_module = sys.modules["processing.services.vtt_split"]
+
+
+@pytest.fixture
+def vtt_folder(tmp_path):
+    test_data = Path("tests") / "test_data"
+    for name in ("test_without_threshold.vtt", "test_with_threshold.vtt"):
+        shutil.copy(test_data / name, tmp_path / name)
+    return tmp_path
+
+
+def _fail_parse(*args, **kwargs):
+    raise AssertionError("cues should come from the cache")
+
+
+def _put(cache, vtt_path, cues, parser="webvtt"):
+    cached, cue_file = cache.get(vtt_path, parser)
+    assert cached is None
+    assert cache.put(cue_file, parser, cues)
+
+
+def test_cue_cache_round_trip(vtt_folder):
+    vtt_path = vtt_folder / "test_with_threshold.vtt"
+    cache = CueCache(vtt_folder)
+    cues = ([0.0, 2.5], [2.0, 4.0], ["a", "b"])
+    _put(cache, vtt_path, cues)
+    cache.save()
+    assert (vtt_folder / CUE_CACHE_FILENAME).is_file()
+    reloaded = CueCache(vtt_folder)
+    assert len(reloaded) == 1
+    assert reloaded.get(vtt_path, "webvtt")[0] == cues
+
+
+def test_cue_cache_is_per_parser(vtt_folder):
+    vtt_path = vtt_folder / "test_with_threshold.vtt"
+    cache = CueCache(vtt_folder)
+    _put(cache, vtt_path, ([0.0], [1.0], ["webvtt"]))
+    assert cache.get(vtt_path, "native")[0] is None
+    _put(cache, vtt_path, ([0.0], [1.0], ["native"]), parser="native")
+    cache.save()
+    reloaded = CueCache(vtt_folder)
+    assert reloaded.get(vtt_path, "webvtt")[0][2] == ["webvtt"]
+    assert reloaded.get(vtt_path, "native")[0][2] == ["native"]
+
+
+def test_cue_cache_invalidated_by_content(vtt_folder):
+    vtt_path = vtt_folder / "test_with_threshold.vtt"
+    cache = CueCache(vtt_folder)
+    _put(cache, vtt_path, ([0.0], [1.0], ["a"]))
+    vtt_path.write_text(vtt_path.read_text() + "\n")
+    assert cache.get(vtt_path, "webvtt")[0] is None
+
+
+def test_cue_cache_survives_touch(vtt_folder):
+    vtt_path = vtt_folder / "test_with_threshold.vtt"
+    cache = CueCache(vtt_folder)
+    cues = ([0.0], [1.0], ["a"])
+    _put(cache, vtt_path, cues)
+    stat = vtt_path.stat()
+    os.utime(vtt_path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+    assert cache.get(vtt_path, "webvtt")[0] == cues
+
+
+def test_cue_cache_skips_file_changed_while_parsed(vtt_folder):
+    vtt_path = vtt_folder / "test_with_threshold.vtt"
+    cache = CueCache(vtt_folder)
+    _, cue_file = cache.get(vtt_path, "webvtt")
+    vtt_path.write_text(vtt_path.read_text() + "\n")
+    assert not cache.put(cue_file, "webvtt", ([0.0], [1.0], ["a"]))
+    assert len(cache) == 0
+
+
+def test_cue_cache_prune(vtt_folder):
+    cache = CueCache(vtt_folder)
+    for vtt_path in sorted(vtt_folder.glob("*.vtt")):
+        _put(cache, vtt_path, ([0.0], [1.0], [vtt_path.name]))
+    cache.prune(["test_with_threshold.vtt"])
+    cache.save()
+    assert len(CueCache(vtt_folder)) == 1
+
+
+def test_cue_cache_reads_cues_by_row_group(tmp_path, monkeypatch):
+    monkeypatch.setattr(cue_cache, "ROW_GROUP_SIZE", 2)
+    cache = CueCache(tmp_path)
+    vtt_paths = []
+    for i in range(5):
+        vtt_path = tmp_path / f"{i}.vtt"
+        vtt_path.write_text(f"WEBVTT {i}")
+        vtt_paths.append(vtt_path)
+        _put(cache, vtt_path, ([float(i)], [i + 1.0], [str(i)]))
+    # spilled cues are read back from disk
+    assert cache.get(vtt_paths[0], "webvtt")[0] == ([0.0], [1.0], ["0"])
+    cache.save()
+    assert pq.ParquetFile(tmp_path / CUE_CACHE_FILENAME).num_row_groups == 3
+    reloaded = CueCache(tmp_path)
+    for i, vtt_path in reversed(list(enumerate(vtt_paths))):
+        assert reloaded.get(vtt_path, "webvtt")[0] == ([float(i)], [i + 1.0], [str(i)])
+
+
+def test_cue_cache_ignores_corrupted_file(vtt_folder):
+    (vtt_folder / CUE_CACHE_FILENAME).write_bytes(b"not parquet")
+    assert len(CueCache(vtt_folder)) == 0
+
+
+def test_vtt_split_uses_cue_cache(vtt_folder, monkeypatch):
+    vtt_path = vtt_folder / "test_without_threshold.vtt"
+    cache = CueCache(vtt_folder)
+    expected = vtt_split(vtt_path, min_duration=8.0, max_duration=12.0)
+    first = vtt_split(vtt_path, min_duration=8.0, max_duration=12.0, cue_cache=cache)
+    monkeypatch.setattr(vtt_split_module, "_read_cues", _fail_parse)
+    second = vtt_split(vtt_path, min_duration=8.0, max_duration=12.0, cue_cache=cache)
+    assert first == expected
+    assert second == expected
+
+
+@pytest.mark.parametrize("workers", [1, 2])
+def test_folder_vtt_split_with_cue_cache(vtt_folder, monkeypatch, workers):
+    expected = folder_vtt_split(vtt_folder, min_duration=8.0, max_duration=12.0)
+    first = folder_vtt_split(
+        vtt_folder, min_duration=8.0, max_duration=12.0, workers=workers, cue_cache=True
+    )
+    assert first == expected
+    assert len(CueCache(vtt_folder)) == 2
+    # deleted files leave the cache
+    (vtt_folder / "test_with_threshold.vtt").unlink()
+    expected = expected[1:]
+    assert folder_vtt_split(
+        vtt_folder, min_duration=8.0, max_duration=12.0, workers=workers, cue_cache=True
+    ) == expected
+    assert len(CueCache(vtt_folder)) == 1
+    monkeypatch.setattr(vtt_split_module, "_read_cues", _fail_parse)
+    # other durations, parsing is skipped
+    swept = folder_vtt_split(
+        vtt_folder, min_duration=6.0, max_duration=16.0, workers=workers, cue_cache=True
+    )
+    monkeypatch.undo()
+    assert swept == folder_vtt_split(vtt_folder, min_duration=6.0, max_duration=16.0)
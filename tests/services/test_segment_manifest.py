@@ -0,0 +1,75 @@
+from processing.services import SegmentManifest
+import numpy as np
+from processing.services.segment_manifest import (
+    MANIFEST_FILENAME,
+    segment_record,
+    segments_digest,
+)
+
+
+def _export(folder, name, content):
+    path = folder / f"{name}.wav"
+    path.write_bytes(content)
+    return segment_record(path)
+
+
+def test_manifest_is_persisted(tmp_path):
+    manifest = SegmentManifest(tmp_path)
+    manifest.add("a", [_export(tmp_path, "a_0", b"0" * 10)])
+    reloaded = SegmentManifest(tmp_path)
+    assert "a" in reloaded
+    assert "b" not in reloaded
+    assert len(reloaded) == 1
+
+
+def test_manifest_skips_truncated_line(tmp_path):
+    manifest = SegmentManifest(tmp_path)
+    manifest.add("a", [_export(tmp_path, "a_0", b"0" * 10)])
+    with open(tmp_path / MANIFEST_FILENAME, "a") as f:
+        f.write('{"audio_filename": "b", "segm')
+    assert len(SegmentManifest(tmp_path)) == 1
+
+
+def test_manifest_add_after_truncated_line(tmp_path):
+    manifest = SegmentManifest(tmp_path)
+    manifest.add("a", [_export(tmp_path, "a_0", b"0" * 10)])
+    with open(tmp_path / MANIFEST_FILENAME, "a") as f:
+        f.write('{"audio_filename": "b", "segm')
+    manifest = SegmentManifest(tmp_path)
+    manifest.add("c", [_export(tmp_path, "c_0", b"2" * 10)])
+    reloaded = SegmentManifest(tmp_path)
+    assert "a" in reloaded
+    assert "c" in reloaded
+    assert len(reloaded) == 2
+
+
+def test_manifest_is_complete_compares_segments(tmp_path):
+    filenames = ["a_0", "a_1"]
+    starts, ends = np.array([0.0, 8.0]), np.array([7.0, 16.0])
+    digest = segments_digest(filenames, starts, ends)
+    manifest = SegmentManifest(tmp_path)
+    records = [_export(tmp_path, name, b"0" * 10) for name in filenames]
+    manifest.add("a", records, digest)
+    reloaded = SegmentManifest(tmp_path)
+    assert reloaded.is_complete("a", filenames, digest)
+    assert not reloaded.is_complete(
+        "a", filenames, segments_digest(filenames, starts, ends + 0.5)
+    )
+    assert not reloaded.is_complete("b", filenames, digest)
+
+
+def test_manifest_verify_and_invalidate(tmp_path):
+    manifest = SegmentManifest(tmp_path)
+    manifest.add("a", [_export(tmp_path, "a_0", b"0" * 10)])
+    manifest.add("b", [_export(tmp_path, "b_0", b"1" * 10)])
+    manifest.add("c", [_export(tmp_path, "c_0", b"2" * 10)])
+    assert manifest.verify(workers=2) == []
+    (tmp_path / "a_0.wav").write_bytes(b"3" * 10)
+    (tmp_path / "b_0.wav").unlink()
+    corrupted = manifest.verify()
+    assert sorted(corrupted) == ["a", "b"]
+    manifest.invalidate(corrupted)
+    reloaded = SegmentManifest(tmp_path)
+    assert "a" not in reloaded
+    assert "b" not in reloaded
+    assert "c" in reloaded
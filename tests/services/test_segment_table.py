@@ -0,0 +1,63 @@
+import numpy as np
+import pytest
+from processing.config import Audio, AudioSegment, SourceEnum
+from processing.db import models
+from processing.services import SegmentTable
+
+
+@pytest.fixture
+def audios():
+    return [
+        Audio(
+            filename=f"audio{i}",
+            duration=0.0,
+            source=SourceEnum.MASC,
+            segments=[
+                AudioSegment(
+                    start=j * 7.1,
+                    end=j * 7.1 + 6.35,
+                    text=f"[موسيقى] نص {j}",
+                    source=SourceEnum.MASC,
+                    filename=f"audio{i}_{j}",
+                )
+                for j in range(i)
+            ],
+        )
+        for i in range(4)
+    ]
+
+
+def test_segments_are_slotted():
+    segment = AudioSegment(start=0.0, end=1.0, text="", source=SourceEnum.MASC)
+    assert not hasattr(segment, "__dict__")
+    assert not hasattr(models.MASCAudio("a", "b", 1.0), "__dict__")
+
+
+def test_from_audios_to_dataframe(audios):
+    table = SegmentTable.from_audios(audios)
+    assert len(table) == 6
+    df = table.to_dataframe()
+    assert df.audio_filename.tolist() == ["audio1", "audio2", "audio2"] + ["audio3"] * 3
+    segments = [segment for audio in audios for segment in audio.segments]
+    assert df.to_dict("records") == [
+        {"audio_filename": segment.filename.split("_")[0], **segment.to_dict()}
+        for segment in segments
+    ]
+
+
+def test_masc_documents_match_masc_audio():
+    segments = [
+        models.AudioSegment(start=start, end=end, text=" [موسيقى]  مرحبا", filename=f"a_{start}")
+        for start, end in [(0, 6500), (7001, 14999), (15333, 31000)]
+    ]
+    table = SegmentTable(
+        audio_filenames=["a"] * 3,
+        filenames=[segment.filename for segment in segments],
+        texts=[segment.text for segment in segments],
+        starts=np.array([segment.start for segment in segments]) / 1000,
+        ends=np.array([segment.end for segment in segments]) / 1000,
+        sources=["MASC"] * 3,
+    )
+    expected = [models.MASCAudio.from_audio_segment(segment).dict() for segment in segments]
+    assert table.masc_documents() == expected
+    assert table.take(np.array([False, True, True])).masc_documents() == expected[1:]
@@ -0,0 +1,115 @@
+import io
+from pathlib import Path
+import pytest
+import webvtt
+from processing.services import vtt_split
+from processing.services.vtt_parser import parse_vtt
+
+
+EDGE_CASES_VTT = """﻿WEBVTT
+Kind: captions
+Language: ar
+
+STYLE
+::cue { color: white }
+
+NOTE a comment
+spanning lines
+
+1
+00:00:01.000 --> 00:00:02.500 align:start position:0%
+first <c>line</c>
+second line
+
+   
+00:02.500 --> 00:03.750
+without hours
+00:00:04.000 --> 01:00:05.125
+cue without blank line
+
+2
+00:00:06.001 --> 00:00:07.999
+<00:00:06.500><c> tagged</c> word
+"""
+
+
+def _assert_same_cues(vtt_path):
+    cues = parse_vtt(vtt_path)
+    captions = webvtt.read(vtt_path).captions
+    assert len(cues) == len(captions)
+    assert cues.starts.tolist() == [c.start_in_seconds for c in captions]
+    assert cues.ends.tolist() == [c.end_in_seconds for c in captions]
+    assert cues.texts == [c.text for c in captions]
+
+
+@pytest.mark.parametrize(
+    "vtt_path",
+    [
+        Path("tests") / "test_data" / "test_with_threshold.vtt",
+        Path("tests") / "test_data" / "test_without_threshold.vtt",
+    ],
+)
+def test_parse_vtt_matches_webvtt(vtt_path):
+    _assert_same_cues(vtt_path)
+
+
+def test_parse_vtt_edge_cases_match_webvtt(tmp_path):
+    vtt_path = tmp_path / "edge.vtt"
+    vtt_path.write_text(EDGE_CASES_VTT, encoding="utf-8")
+    _assert_same_cues(vtt_path)
+    assert len(parse_vtt(vtt_path)) == 4
+
+
+def test_parse_vtt_many_cues_without_blank_lines(tmp_path):
+    vtt_path = tmp_path / "dense.vtt"
+    cues = "".join(
+        f"00:00:{i // 1000:02d}.{i % 1000:03d} --> 00:00:{i // 1000:02d}.{i % 1000:03d}\n"
+        f"cue {i}\n"
+        for i in range(5000)
+    )
+    vtt_path.write_text("WEBVTT\n\n" + cues, encoding="utf-8")
+    # webvtt itself recurses on such files, compare with the expected cues instead
+    cues = parse_vtt(vtt_path)
+    assert cues.starts.tolist() == pytest.approx([i / 1000 for i in range(5000)])
+    assert cues.texts[-1] == "cue 4999"
+
+
+def test_parse_vtt_rejects_invalid_file(tmp_path):
+    vtt_path = tmp_path / "invalid.vtt"
+    vtt_path.write_text("1\n00:00:01,000 --> 00:00:02,000\ntext\n", encoding="utf-8")
+    with pytest.raises(ValueError):
+        parse_vtt(vtt_path)
+
+
+def test_parse_vtt_sources(tmp_path):
+    vtt_path = tmp_path / "edge.vtt"
+    vtt_path.write_text(EDGE_CASES_VTT, encoding="utf-8")
+    expected = parse_vtt(vtt_path).texts
+    assert parse_vtt(str(vtt_path)).texts == expected
+    assert parse_vtt(vtt_path.read_bytes(), name="edge").texts == expected
+    text = io.StringIO(EDGE_CASES_VTT.lstrip("\ufeff"))
+    assert parse_vtt(text, name="edge").texts == expected
+    # a str is a path, not content
+    with pytest.raises(OSError):
+        parse_vtt(EDGE_CASES_VTT)
+
+
+@pytest.mark.parametrize("vtt_name", ["test_with_threshold.vtt", "test_without_threshold.vtt"])
+def test_vtt_split_native_parser(vtt_name):
+    vtt_path = Path("tests") / "test_data" / vtt_name
+    kwargs = dict(min_duration=8.0, max_duration=12.0, threshold=2.0)
+    assert vtt_split(vtt_path, parser="native", **kwargs) == vtt_split(
+        vtt_path, parser="webvtt", **kwargs
+    )
+
+
+@pytest.mark.parametrize("parser", ["webvtt", "native"])
+def test_vtt_split_buffer(parser):
+    vtt_path = Path("tests") / "test_data" / "test_with_threshold.vtt"
+    kwargs = dict(min_duration=8.0, max_duration=12.0, threshold=2.0, parser=parser)
+    expected = vtt_split(vtt_path, **kwargs)
+    with open(vtt_path, "rb") as f:
+        assert vtt_split(f, filename=vtt_path.stem, **kwargs) == expected
+    assert vtt_split(vtt_path.read_bytes(), filename=vtt_path.stem, **kwargs) == expected
+    with pytest.raises(ValueError):
+        vtt_split(vtt_path.read_bytes(), **kwargs)
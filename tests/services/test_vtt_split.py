@@ -1,6 +1,8 @@
 from pathlib import Path
+import numpy as np
 import pytest
 from processing.services import vtt_split, folder_vtt_split
+from processing.services.vtt_split import _split_cues, _split_cues_numpy
 from processing.config import Audio, AudioSegment, SourceEnum
 
 
@@ -91,3 +93,36 @@ def test_folder_vtt_split(vtt_folder):
             assert segment.source == SourceEnum.MASC
             assert segment.filename is not None, "The filename should not be None"
             assert segment.text is not None, "The text should not be None"
+
+
+def test_folder_vtt_split_parallel(vtt_folder):
+    kwargs = dict(min_duration=8.0, max_duration=12.0, threshold=2.0)
+    assert folder_vtt_split(vtt_folder, workers=2, **kwargs) == folder_vtt_split(
+        vtt_folder, **kwargs
+    )
+
+
+@pytest.mark.parametrize("vtt_name", ["test_with_threshold.vtt", "test_without_threshold.vtt"])
+def test_vtt_split_numpy_engine(vtt_name, vtt_folder):
+    kwargs = dict(min_duration=8.0, max_duration=12.0, threshold=2.0)
+    assert vtt_split(vtt_folder / vtt_name, engine="numpy", **kwargs) == vtt_split(
+        vtt_folder / vtt_name, engine="python", **kwargs
+    )
+
+
+@pytest.mark.parametrize("seed", range(20))
+@pytest.mark.parametrize(
+    "min_duration, max_duration, threshold",
+    [(6.0, 16.0, 2.0), (2.0, 5.0, 0.5), (1.0, 3.0, 1.0), (0.0, 30.0, 10.0)],
+)
+def test_numpy_engine_matches_python_engine(seed, min_duration, max_duration, threshold):
+    rng = np.random.default_rng(seed)
+    n_cues = int(rng.integers(1, 300))
+    durations = rng.uniform(0.1, 13.0, n_cues).round(3)
+    gaps = rng.exponential(1.0, n_cues).round(3) - 0.2
+    starts = np.cumsum(gaps + np.concatenate([[0.0], durations[:-1]])).round(3)
+    ends = (starts + durations).round(3)
+    texts = [str(i) for i in range(n_cues)]
+    args = ("audio", min_duration, max_duration, threshold, SourceEnum.MASC)
+    expected = _split_cues(starts.tolist(), ends.tolist(), texts, *args)
+    assert _split_cues_numpy(starts, ends, texts, *args) == expected
@@ -0,0 +1,83 @@
+import shutil
+import sys
+from multiprocessing import Pool
+from pathlib import Path
+import numpy as np
+import pytest
+from processing.services import folder_vtt_split
+from processing.services.cue_cache import CueCache
+from processing.services.vtt_sweep import (
+    parameter_grid,
+    sweep_cues,
+    sweep_folder,
+    sweep_report,
+)
+
+# the module is shadowed by the vtt_split function in processing.services
+vtt_split_module = sys.modules["processing.services.vtt_split"]
+
+
+@pytest.fixture
+def vtt_folder(tmp_path):
+    test_data = Path("tests") / "test_data"
+    for name in ("test_without_threshold.vtt", "test_with_threshold.vtt"):
+        shutil.copy(test_data / name, tmp_path / name)
+    return tmp_path
+
+
+def test_parameter_grid_skips_inverted_durations():
+    grid = parameter_grid([6.0, 12.0], [8.0, 16.0], [1.0, 2.0])
+    assert len(grid) == 6
+    assert (12.0, 8.0, 1.0) not in grid
+
+
+@pytest.mark.parametrize("workers", [1, 2])
+def test_sweep_folder_matches_vtt_split(vtt_folder, workers):
+    grid = parameter_grid([4.0, 8.0], [8.0, 12.0, 16.0], [0.5, 2.0])
+    bins = np.arange(0.0, 17.0)
+    results = sweep_folder(vtt_folder, grid, bins=bins, workers=workers)
+    assert len(CueCache(vtt_folder)) == 2
+    for result, (min_duration, max_duration, threshold) in zip(results, grid):
+        audios = folder_vtt_split(
+            vtt_folder,
+            min_duration=min_duration,
+            max_duration=max_duration,
+            threshold=threshold,
+        )
+        durations = [
+            segment.duration for audio in audios for segment in audio.segments
+        ]
+        histogram = np.histogram(durations, bins=bins)[0]
+        assert result.segments == len(durations)
+        assert result.seconds == pytest.approx(sum(durations))
+        assert result.histogram.tolist() == histogram.tolist()
+
+
+def test_sweep_cues_handles_empty_files():
+    cues = [([], [], []), ([0.0, 3.0], [3.0, 7.0], ["a", "b"])]
+    results = sweep_cues(cues, [(6.0, 16.0, 2.0)])
+    assert results[0].segments == 1
+    assert results[0].seconds == pytest.approx(7.0)
+    assert len(results[0].histogram) == 16
+
+
+def test_sweep_report_sorted_by_hours():
+    cues = [([0.0, 3.0, 20.0], [3.0, 7.0, 27.0], ["a", "b", "c"])]
+    report = sweep_report(sweep_cues(cues, parameter_grid([6.0, 8.0], [16.0], [2.0])))
+    assert report.min_duration.tolist() == [6.0, 8.0]
+    assert report.segments.tolist() == [2, 0]
+    assert report.hours[0] == pytest.approx(14.0 / 3600)
+    assert np.isnan(report.mean_duration[1])
+
+
+def test_sweep_folder_uses_one_pool(vtt_folder, monkeypatch):
+    pools = []
+
+    def counting_pool(*args, **kwargs):
+        pools.append(args)
+        return Pool(*args, **kwargs)
+
+    monkeypatch.setattr(vtt_split_module, "Pool", counting_pool)
+    results = sweep_folder(vtt_folder, [(6.0, 16.0, 2.0)], workers=2)
+    assert len(pools) == 1
+    assert results[0].segments > 0
@@ -0,0 +1,86 @@
+import json
+import os
+import subprocess
+import sys
+import wave
+from multiprocessing import Pool
+import numpy as np
+import pytest
+from processing import metrics
+from processing.services import clean_text_batch, split_audio_arrays
+
+
+def _stage(stage):
+    return metrics.summary()["stages"][stage]
+
+
+def _clean(texts):
+    return clean_text_batch(texts, dedupe=False)
+
+
+@pytest.mark.usefixtures("enabled_metrics")
+def test_metrics_aggregate_pool_workers():
+    before = _stage("clean_text")
+    with Pool(2) as pool:
+        pool.map(_clean, [["مرحبا"] * 3, ["بكم"] * 4, ["نص"] * 5])
+    after = _stage("clean_text")
+    assert after["calls"] - before["calls"] == 3
+    assert after["items"] - before["items"] == 12
+    assert after["seconds"] > before["seconds"]
+
+
+@pytest.mark.usefixtures("enabled_metrics")
+def test_segment_export_failures_are_counted(tmp_path):
+    wav = tmp_path / "audio.wav"
+    with wave.open(str(wav), "wb") as f:
+        f.setnchannels(1)
+        f.setsampwidth(2)
+        f.setframerate(16000)
+        f.writeframes(np.zeros(16000 * 3, dtype=np.int16).tobytes())
+    before = _stage("segment_export")
+    # the output folder does not exist, both segments fail
+    exported = split_audio_arrays(
+        wav,
+        np.array(["a_0", "a_1"]),
+        np.array([0.0, 1.0]),
+        np.array([1.0, 2.0]),
+        tmp_path / "missing",
+        "wav",
+    )
+    after = _stage("segment_export")
+    assert exported == 0
+    assert after["failures"] - before["failures"] == 2
+
+
+@pytest.mark.usefixtures("enabled_metrics")
+def test_write_summary(tmp_path):
+    metrics.write_summary(tmp_path / "metrics.json")
+    summary = json.loads((tmp_path / "metrics.json").read_text())
+    assert set(summary["stages"]) == set(metrics.STAGES)
+
+
+def test_import_has_no_side_effect():
+    env = {k: v for k, v in os.environ.items() if k != "PROMETHEUS_MULTIPROC_DIR"}
+    code = (
+        "import os, sys\n"
+        "import processing.services, processing.db.audio_db\n"
+        "from processing import metrics\n"
+        "with metrics.track('clean_text'):\n"
+        "    metrics.count('clean_text')\n"
+        "print('PROMETHEUS_MULTIPROC_DIR' in os.environ)\n"
+        "print('prometheus_client' in sys.modules)"
+    )
+    result = subprocess.run(
+        [sys.executable, "-c", code],
+        env=env,
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    assert result.stdout.split() == ["False", "False"]
+
+
+def test_metrics_are_off_after_enabled_tests(_metrics_state):
+    # runs after the tests above, enabling the metrics doesn't leak into other tests
+    assert not metrics.enabled()
+    assert os.environ.get("PROMETHEUS_MULTIPROC_DIR") != _metrics_state[1]
@@ -0,0 +1,42 @@
+import subprocess
+import sys
+from multiprocessing import Pool
+import pstats
+from processing import profiling
+
+
+def _encode(seconds):
+    subprocess.run([sys.executable, "-c", f"import time; time.sleep({seconds})"], check=True)
+    return sum(i * i for i in range(10_000))
+
+
+def test_profile_merges_workers(tmp_path):
+    with profiling.profile(tmp_path):
+        with Pool(2) as pool:
+            pool.map(_encode, [0.1] * 4, chunksize=1)
+    profiles = sorted(path.name for path in tmp_path.glob("*.prof"))
+    assert "main.prof" in profiles and "merged.prof" in profiles
+    assert len([name for name in profiles if name.startswith("worker-")]) == 2
+    stats = pstats.Stats(str(tmp_path / "merged.prof"))
+    seconds, calls = profiling.subprocess_wait_seconds(stats)
+    assert calls == 4
+    assert seconds >= 0.4
+    report = (tmp_path / "report.txt").read_text()
+    assert "3 processes profiled" in report
+    assert "_encode" in report
+
+
+def test_profile_ignores_previous_runs(tmp_path):
+    (tmp_path / "worker-1.prof").write_bytes(b"")
+    with profiling.profile(tmp_path):
+        _encode(0)
+    assert sorted(path.name for path in tmp_path.glob("*.prof")) == [
+        "main.prof",
+        "merged.prof",
+    ]
+    assert "1 processes profiled" in (tmp_path / "report.txt").read_text()
+
+
+def test_profile_disabled():
+    with profiling.profile(None):
+        pass